@@ -108,6 +108,52 @@ int main(int argc, char **argv)
                 self.define_macros.append(('WTF_HAVE_INITGROUPS', None))
         finally:
             conftest.destroy()
+        conftest = ext.ConfTest(build, """
+#include <sys/types.h>
+#include <sys/socket.h>
+#include <sys/uio.h>
+int main(int argc, char **argv)
+{
+    struct msghdr msg;
+    char control[CMSG_SPACE(sizeof(int))];
+    msg.msg_control = control;
+    msg.msg_controllen = sizeof(control);
+    CMSG_FIRSTHDR(&msg)->cmsg_type = SCM_RIGHTS;
+    return !!sendmsg(0, &msg, 0) + !!recvmsg(0, &msg, 0);
+}
+        """)
+        try:
+            if conftest.compile() and conftest.link():
+                self.define_macros.append(('WTF_HAVE_FD_PASSING', None))
+        finally:
+            conftest.destroy()
+        conftest = ext.ConfTest(build, """
+#include <sys/inotify.h>
+int main(int argc, char **argv)
+{
+    int fd = inotify_init1(IN_NONBLOCK | IN_CLOEXEC);
+    return !!inotify_add_watch(fd, ".", IN_CLOSE_WRITE);
+}
+        """)
+        try:
+            if conftest.compile() and conftest.link():
+                self.define_macros.append(('WTF_HAVE_INOTIFY', None))
+        finally:
+            conftest.destroy()
+        conftest = ext.ConfTest(build, """
+#include <sys/types.h>
+#include <sys/sendfile.h>
+int main(int argc, char **argv)
+{
+    off_t offset = 0;
+    return !!sendfile(1, 0, &offset, 1);
+}
+        """)
+        try:
+            if conftest.compile() and conftest.link():
+                self.define_macros.append(('WTF_HAVE_SENDFILE', None))
+        finally:
+            conftest.destroy()
         make_util_private_h(self.sources[0])
         return False
 
@@ -123,6 +169,10 @@ def setup(args=None, _manifest=0):
             ext.Extension('wtf._wtf_cstream', [
                 'wtf/stream.c'
             ], depends=['_setup/include/cext.h']),
+
+            ext.Extension('wtf._wtf_chttp', [
+                'wtf/http.c'
+            ], depends=['_setup/include/cext.h']),
         ],
         script_args=args,
         manifest_only=_manifest,
@@ -125,13 +125,16 @@ def _register_defaults(envkey=None):
     from wtf.opi import register, daemon
     register('daemon', daemon.DaemonOPI)
 
-    from wtf.opi.worker import register, threaded, single
+    from wtf.opi.worker import register, threaded, prefork, single
     register('threaded', threaded.ThreadedWorker)
+    register('prefork', prefork.PreforkWorker)
     register('single', single.SingleWorker)
 
-    from wtf.impl import register, scgi, http
+    from wtf.impl import register, scgi, http, fastcgi, uwsgi
     register('scgi', scgi.SCGIServer)
     register('http', http.HTTPServer)
+    register('fastcgi', fastcgi.FastCGIServer)
+    register('uwsgi', uwsgi.UWSGIServer)
 
 
 def c_override(envkey=None):
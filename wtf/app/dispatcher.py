@@ -24,7 +24,11 @@ an application friendly wrapper.
 __author__ = u"Andr\xe9 Malo"
 __docformat__ = "restructuredtext en"
 
+import os as _os
+import sys as _sys
+
 from wtf import util as _util
+from wtf.app import form as _form
 from wtf.app import response as _response
 
 
@@ -71,9 +75,21 @@ class Dispatcher(object):
         else:
             cookie_codec = 'wtf.app.cookie.DefaultCookie'
 
+        form = {}
+        if 'form' in config.app:
+            section = config.app.form
+            form['spool'] = int(float(section('spool', 64)) * 1024)
+            form['max_size'] = int(float(section('max_size', 0)) * 1048576)
+            form['max_field'] = int(float(section('max_field', 1)) * 1048576)
+            if 'tempdir' in section:
+                form['tempdir'] = _os.path.join(config.ROOT, unicode(
+                    section.tempdir
+                ).encode(_sys.getfilesystemencoding()))
+
         self._addenv = {
             'wtf.codec.cookie':
                 _util.load_dotted(cookie_codec)(config, opts, args)(),
+            'wtf.form.parser': _form.FormParser(**form),
         }
 
     def __call__(self, environ, start_response):
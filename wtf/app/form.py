@@ -0,0 +1,555 @@
+# -*- coding: ascii -*-
+#
+# Copyright 2006-2012
+# Andr\xe9 Malo or his licensors, as applicable
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Form data parser
+================
+
+This module implements a streaming parser for form data
+(``application/x-www-form-urlencoded`` and ``multipart/form-data``).
+
+The request body is read in large blocks. Uploaded files are kept in
+memory up to a threshold and spooled to temporary files beyond that.
+"""
+__author__ = u"Andr\xe9 Malo"
+__docformat__ = "restructuredtext en"
+
+import cgi as _cgi
+import re as _re
+import tempfile as _tempfile
+import urllib as _urllib
+try:
+    import cStringIO as _string_io
+except ImportError:
+    import StringIO as _string_io
+
+from wtf.util import Property
+
+
+class FormError(ValueError):
+    """ Form data could not be parsed """
+
+
+class FormTooLarge(FormError):
+    """ Form data exceeds a size limit """
+
+
+class Upload(object):
+    """
+    Uploaded file
+
+    :IVariables:
+     - `name`: Form name
+     - `filename`: File name as submitted by the client
+     - `type`: Content type (lowercased, without parameters)
+     - `type_options`: Content type parameters
+     - `headers`: Part headers (``{'lowercased-name': 'value', ...}``)
+     - `file`: File object containing the data, positioned at the start
+
+    :Types:
+     - `name`: ``str``
+     - `filename`: ``str``
+     - `type`: ``str``
+     - `type_options`: ``dict``
+     - `headers`: ``dict``
+     - `file`: ``file``
+    """
+
+    def __init__(self, name, filename, headers, fp):
+        """
+        Initialization
+
+        :Parameters:
+         - `name`: Form name
+         - `filename`: File name
+         - `headers`: Part headers
+         - `fp`: File object containing the data
+
+        :Types:
+         - `name`: ``str``
+         - `filename`: ``str``
+         - `headers`: ``dict``
+         - `fp`: ``file``
+        """
+        self.name, self.filename, self.headers = name, filename, headers
+        self.type, self.type_options = _cgi.parse_header(
+            headers.get('content-type', 'application/octet-stream')
+        )
+        self.type = self.type.lower()
+        self.file = fp
+
+    @Property
+    def value():
+        """
+        The complete file content
+
+        Reading the value loads the whole file into memory and rewinds it
+        afterwards.
+
+        :Type: ``str``
+        """
+        # pylint: disable = E0211, C0111, W0612
+
+        def fget(self):
+            self.file.seek(0)
+            try:
+                return self.file.read()
+            finally:
+                self.file.seek(0)
+        return locals()
+
+
+class FormParser(object):
+    """
+    Form data parser
+
+    The parser is stateless and may be shared between requests.
+
+    :CVariables:
+     - `_MAX_HEADER`: Maximum size of a part header block
+     - `_SPLIT_PAIRS`: Splitter for urlencoded data
+
+    :IVariables:
+     - `blocksize`: Read block size
+     - `spool`: Upload size, beyond which uploads are spooled to disk
+     - `max_size`: Maximum request body size (``0`` = unlimited)
+     - `max_field`: Maximum size of a single regular (non-upload) field
+       (``0`` = unlimited)
+     - `tempdir`: Directory for spooled uploads (``None`` = system default)
+
+    :Types:
+     - `_MAX_HEADER`: ``int``
+     - `_SPLIT_PAIRS`: ``callable``
+     - `blocksize`: ``int``
+     - `spool`: ``int``
+     - `max_size`: ``int``
+     - `max_field`: ``int``
+     - `tempdir`: ``str``
+    """
+    _MAX_HEADER = 8192
+    _SPLIT_PAIRS = _re.compile(r'[&;]').split
+
+    def __init__(self, spool=65536, max_size=0, max_field=1048576,
+                 tempdir=None, blocksize=65536):
+        """
+        Initialization
+
+        :Parameters:
+         - `spool`: Upload size, beyond which uploads are spooled to disk
+         - `max_size`: Maximum request body size (``0`` = unlimited)
+         - `max_field`: Maximum size of a regular field (``0`` = unlimited)
+         - `tempdir`: Directory for spooled uploads (``None`` = system
+           default)
+         - `blocksize`: Read block size
+
+        :Types:
+         - `spool`: ``int``
+         - `max_size`: ``int``
+         - `max_field`: ``int``
+         - `tempdir`: ``str``
+         - `blocksize`: ``int``
+        """
+        self.spool, self.max_size = max(0, spool), max(0, max_size)
+        self.max_field, self.tempdir = max(0, max_field), tempdir
+        self.blocksize = max(1024, blocksize)
+
+    def parse(self, environ):
+        """
+        Parse the form data of a request
+
+        The query string is always parsed. The request body is parsed for
+        methods other than GET and HEAD, if its content type is
+        ``application/x-www-form-urlencoded`` (or missing) or
+        ``multipart/form-data``. The fields of the body are returned
+        before the fields of the query string.
+
+        :Parameters:
+         - `environ`: WSGI environment
+
+        :Types:
+         - `environ`: ``dict``
+
+        :return: Regular fields and uploads
+                 (``([('name', 'value'), ...], [('name', Upload), ...])``)
+        :rtype: ``tuple``
+
+        :Exceptions:
+         - `FormTooLarge`: A size limit was exceeded
+         - `FormError`: The form data could not be parsed
+        """
+        fields, uploads = [], []
+        if environ.get('REQUEST_METHOD', 'GET').upper() not in (
+                'GET', 'HEAD'):
+            ctype, options = _cgi.parse_header(
+                environ.get('CONTENT_TYPE') or
+                'application/x-www-form-urlencoded'
+            )
+            ctype = ctype.lower()
+            if ctype == 'multipart/form-data':
+                boundary = options.get('boundary')
+                if not boundary or len(boundary) > 200:
+                    raise FormError("Invalid multipart boundary")
+                self._multipart(self._reader(environ), boundary,
+                    fields, uploads)
+            elif ctype == 'application/x-www-form-urlencoded':
+                self._urlencoded(self._reader(environ), fields)
+        query = environ.get('QUERY_STRING')
+        if query:
+            self._pairs(self._SPLIT_PAIRS(query), fields)
+        return fields, uploads
+
+    def _reader(self, environ):
+        """
+        Create a block reader for the request body
+
+        :Parameters:
+         - `environ`: WSGI environment
+
+        :Types:
+         - `environ`: ``dict``
+
+        :return: Reader function, returning the next block or ``''`` at
+                 the end of the body
+        :rtype: ``callable``
+
+        :Exceptions:
+         - `FormTooLarge`: The announced body size exceeds the limit
+         - `FormError`: Invalid content length
+        """
+        try:
+            length = int(environ.get('CONTENT_LENGTH') or -1)
+        except ValueError:
+            raise FormError("Invalid content length")
+        max_size, blocksize = self.max_size, self.blocksize
+        if max_size and length > max_size:
+            raise FormTooLarge("Request body too large")
+        stream = environ['wsgi.input']
+        state = [length, 0]
+
+        def read():
+            """ Read the next block """
+            left = state[0]
+            if left == 0:
+                return ''
+            data = stream.read(left < 0 and blocksize or min(left, blocksize))
+            if not data:
+                if left > 0:
+                    raise FormError("Unexpected end of request body")
+                state[0] = 0
+                return ''
+            if left > 0:
+                state[0] = left - len(data)
+            state[1] += len(data)
+            if max_size and state[1] > max_size:
+                raise FormTooLarge("Request body too large")
+            return data
+        return read
+
+    def _pairs(self, pairs, fields):
+        """
+        Decode urlencoded key/value pairs
+
+        :Parameters:
+         - `pairs`: Encoded pairs (``['key=value', ...]``)
+         - `fields`: Field list to append to
+
+        :Types:
+         - `pairs`: ``iterable``
+         - `fields`: ``list``
+        """
+        unquote = _urllib.unquote_plus
+        for pair in pairs:
+            if pair:
+                pair = pair.split('=', 1)
+                if len(pair) == 1:
+                    pair.append('')
+                fields.append((unquote(pair[0]), unquote(pair[1])))
+
+    def _urlencoded(self, read, fields):
+        """
+        Parse an urlencoded request body
+
+        :Parameters:
+         - `read`: Block reader
+         - `fields`: Field list to append to
+
+        :Types:
+         - `read`: ``callable``
+         - `fields`: ``list``
+
+        :Exceptions:
+         - `FormTooLarge`: A field exceeds the size limit
+        """
+        split, max_field, rest = self._SPLIT_PAIRS, self.max_field, ''
+        while True:
+            data = read()
+            if not data:
+                self._pairs([rest], fields)
+                break
+            pairs = split(rest + data)
+            rest = pairs.pop()
+            if max_field and len(rest) > max_field:
+                raise FormTooLarge("Form field too large")
+            self._pairs(pairs, fields)
+
+    def _multipart(self, read, boundary, fields, uploads):
+        """
+        Parse a multipart request body
+
+        :Parameters:
+         - `read`: Block reader
+         - `boundary`: Part boundary
+         - `fields`: Field list to append to
+         - `uploads`: Upload list to append to
+
+        :Types:
+         - `read`: ``callable``
+         - `boundary`: ``str``
+         - `fields`: ``list``
+         - `uploads`: ``list``
+
+        :Exceptions:
+         - `FormTooLarge`: A size limit was exceeded
+         - `FormError`: The data could not be parsed
+        """
+        # Prepending CRLF lets the first boundary match the delimiter, too
+        delim, buf = '\r\n--' + boundary, '\r\n'
+        dlen, max_header = len(delim), self._MAX_HEADER
+
+        # skip the preamble
+        while True:
+            pos = buf.find(delim)
+            if pos >= 0:
+                buf = buf[pos + dlen:]
+                break
+            buf = buf[-dlen:]
+            data = read()
+            if not data:
+                raise FormError("Missing multipart boundary")
+            buf += data
+
+        while True:
+            # rest of the boundary line: '--' (end) or padding + CRLF
+            while buf[:2] != '--':
+                pos = buf.find('\r\n')
+                if pos >= 0:
+                    break
+                if len(buf) > max_header:
+                    raise FormError("Invalid multipart boundary line")
+                data = read()
+                if not data:
+                    raise FormError("Unexpected end of multipart data")
+                buf += data
+            else:
+                return # ignore the epilogue
+            buf = buf[pos + 2:]
+
+            # part headers
+            while True:
+                if buf[:2] == '\r\n':
+                    header, buf = '', buf[2:]
+                    break
+                pos = buf.find('\r\n\r\n')
+                if pos >= 0:
+                    header, buf = buf[:pos], buf[pos + 4:]
+                    break
+                if len(buf) > max_header:
+                    raise FormError("Multipart header too large")
+                data = read()
+                if not data:
+                    raise FormError("Unexpected end of multipart data")
+                buf += data
+            headers = self._headers(header)
+            _, options = _cgi.parse_header(
+                headers.get('content-disposition', '')
+            )
+            name, filename = options.get('name'), options.get('filename')
+
+            # part body
+            if filename:
+                target = _Spool(self.spool, self.tempdir)
+            else:
+                target = _Field(self.max_field)
+            while True:
+                pos = buf.find(delim)
+                if pos >= 0:
+                    target.write(buf[:pos])
+                    buf = buf[pos + dlen:]
+                    break
+                pos = len(buf) - dlen + 1
+                if pos > 0:
+                    target.write(buf[:pos])
+                    buf = buf[pos:]
+                data = read()
+                if not data:
+                    raise FormError("Unexpected end of multipart data")
+                buf += data
+
+            if name is None:
+                continue
+            if filename:
+                uploads.append(
+                    (name, Upload(name, filename, headers, target.finish()))
+                )
+            else:
+                fields.append((name, target.finish()))
+
+    def _headers(self, header):
+        """
+        Parse a part header block
+
+        :Parameters:
+         - `header`: The header block (without the final empty line)
+
+        :Types:
+         - `header`: ``str``
+
+        :return: Headers (``{'lowercased-name': 'value', ...}``)
+        :rtype: ``dict``
+        """
+        result, name = {}, None
+        for line in header.split('\r\n'):
+            if line[:1] in (' ', '\t'):
+                if name is not None:
+                    result[name] = "%s %s" % (result[name], line.strip())
+                continue
+            pos = line.find(':')
+            if pos > 0:
+                name = line[:pos].strip().lower()
+                result[name] = line[pos + 1:].strip()
+        return result
+
+
+class _Field(object):
+    """
+    In-memory collector for a regular form field
+
+    :IVariables:
+     - `_chunks`: Collected chunks
+     - `_size`: Collected size
+     - `_max`: Maximum size (``0`` = unlimited)
+
+    :Types:
+     - `_chunks`: ``list``
+     - `_size`: ``int``
+     - `_max`: ``int``
+    """
+
+    def __init__(self, max_size):
+        """
+        Initialization
+
+        :Parameters:
+         - `max_size`: Maximum size (``0`` = unlimited)
+
+        :Types:
+         - `max_size`: ``int``
+        """
+        self._chunks, self._size, self._max = [], 0, max_size
+
+    def write(self, data):
+        """
+        Collect a chunk
+
+        :Parameters:
+         - `data`: The chunk
+
+        :Types:
+         - `data`: ``str``
+
+        :Exceptions:
+         - `FormTooLarge`: The field exceeds the size limit
+        """
+        if data:
+            self._size += len(data)
+            if self._max and self._size > self._max:
+                raise FormTooLarge("Form field too large")
+            self._chunks.append(data)
+
+    def finish(self):
+        """
+        Finish the field
+
+        :return: The field value
+        :rtype: ``str``
+        """
+        return ''.join(self._chunks)
+
+
+class _Spool(object):
+    """
+    Upload collector, which rolls over to a temporary file
+
+    :IVariables:
+     - `_fp`: Current file object
+     - `_size`: Collected size
+     - `_spool`: Size beyond which the data is moved to disk
+     - `_tempdir`: Directory for the temporary file
+
+    :Types:
+     - `_fp`: ``file``
+     - `_size`: ``int``
+     - `_spool`: ``int``
+     - `_tempdir`: ``str``
+    """
+
+    def __init__(self, spool, tempdir):
+        """
+        Initialization
+
+        :Parameters:
+         - `spool`: Size beyond which the data is moved to disk
+         - `tempdir`: Directory for the temporary file (``None`` = system
+           default)
+
+        :Types:
+         - `spool`: ``int``
+         - `tempdir`: ``str``
+        """
+        self._fp, self._size = _string_io.StringIO(), 0
+        self._spool, self._tempdir = spool, tempdir
+
+    def write(self, data):
+        """
+        Collect a chunk
+
+        :Parameters:
+         - `data`: The chunk
+
+        :Types:
+         - `data`: ``str``
+        """
+        if data:
+            size = self._size = self._size + len(data)
+            if self._spool is not None and size > self._spool:
+                memory = self._fp
+                self._fp = _tempfile.TemporaryFile(dir=self._tempdir)
+                self._fp.write(memory.getvalue())
+                self._spool = None
+            self._fp.write(data)
+
+    def finish(self):
+        """
+        Finish the upload
+
+        :return: File object positioned at the start
+        :rtype: ``file``
+        """
+        fp = self._fp
+        if self._spool is None:
+            fp.flush()
+        fp.seek(0)
+        return fp
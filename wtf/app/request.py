@@ -25,13 +25,14 @@ __docformat__ = "restructuredtext en"
 
 import binascii as _binascii
 import codecs as _codecs
-import cgi as _cgi
 import encodings as _encodings
 import re as _re
 import urlparse as _urlparse
 import weakref as _weakref
 
 from wtf import webutil as _webutil
+from wtf.app import form as _form
+from wtf.app import http_response as _http
 from wtf.util import Property
 
 
@@ -40,7 +41,7 @@ class Uploads(object):
     Container for uploaded files
 
     :IVariables:
-     - `_pairs`: Dict of form names and file objects
+     - `_pairs`: Dict of form names and upload objects
 
     :Types:
      - `_pairs`: ``dict``
@@ -51,7 +52,7 @@ class Uploads(object):
         Initialization
 
         :Parameters:
-         - `uploads`: Dict of form names and file objects
+         - `uploads`: Dict of form names and upload objects
 
         :Types:
          - `uploads`: ``dict``
@@ -68,8 +69,8 @@ class Uploads(object):
         :Types:
          - `name`: ``str``
 
-        :return: File object
-        :rtype: ``file``
+        :return: Upload object
+        :rtype: `wtf.app.form.Upload`
 
         :Exceptions:
          - `KeyError`: The name does not exist
@@ -124,7 +125,7 @@ class Uploads(object):
 
 class ParameterWrapper(object):
     """
-    Wrapper around cgi.FieldStorage
+    Wrapper around the parsed form data
 
     This wrapper provides a better interface and unicode awareness
     """
@@ -133,45 +134,51 @@ class ParameterWrapper(object):
         """
         Initialization
 
+        The form data is parsed by the parser found in the
+        ``wtf.form.parser`` environment key (a `wtf.app.form.FormParser`
+        with default settings, if there's none).
+
         :Parameters:
          - `request`: request object
 
         :Types:
          - `request`: `Request`
+
+        :Exceptions:
+         - `http.RequestEntityTooLarge`: The form data exceeds a size limit
         """
         env = request.env
+        parser = env.get('wtf.form.parser')
+        if parser is None:
+            parser = _form.FormParser()
         try:
-            store = _cgi.FieldStorage(
-                fp=env['wsgi.input'], environ=env, keep_blank_values=True
-            )
-            if store.list is None:
-                raise ValueError()
-        except ValueError:
-            self._encoding = 'utf-8'
-            self._uploads = Uploads({})
-            self._pairs = {}
-        else:
-            encoding = self._determine_encoding(store)
-
-            uploads = {}
-            regular = {}
-            for key in store:
-                values = store[key]
-                if type(values) is not list:
-                    values = [values]
-                for value in values:
-                    if value.filename:
-                        uploads.setdefault(key, []).append(value)
-                    else:
-                        try:
-                            value = value.value.decode(encoding)
-                        except UnicodeError:
-                            value = value.value.decode('cp1252')
-                        regular.setdefault(key, []).append(value)
+            fields, files = parser.parse(env)
+        except _form.FormTooLarge:
+            raise _http.RequestEntityTooLarge(request)
+        except _form.FormError:
+            fields, files = [], []
+
+        raw, uploads = {}, {}
+        for key, value in fields:
+            raw.setdefault(key, []).append(value)
+        for key, value in files:
+            uploads.setdefault(key, []).append(value)
+
+        encoding = self._determine_encoding(raw)
+        regular = {}
+        for key, values in raw.iteritems():
+            decoded = []
+            for value in values:
+                try:
+                    value = value.decode(encoding)
+                except UnicodeError:
+                    value = value.decode('cp1252')
+                decoded.append(value)
+            regular[key] = decoded
 
-            self._encoding = encoding
-            self._uploads = Uploads(uploads)
-            self._pairs = regular
+        self._encoding = encoding
+        self._uploads = Uploads(uploads)
+        self._pairs = regular
 
     @Property
     def encoding():
@@ -260,10 +267,10 @@ class ParameterWrapper(object):
         return tuple(self._pairs.get(name, ()))
 
     @staticmethod
-    def _determine_encoding(store):
+    def _determine_encoding(raw):
         """ Guess encoding of the request parameters """
         # try simple method first...
-        encoding = store.getfirst('_charset_')
+        encoding = (raw.get('_charset_') or [None])[0]
         if not encoding:
             # peek is assumed to be '\xe4', i.e. &#228;
             encoding = {
@@ -271,7 +278,7 @@ class ParameterWrapper(object):
                 None      : 'utf-8',
                 ''        : 'utf-8',
                 '\x84'    : 'cp437', # default lynx on dos
-            }.get(store.getfirst('_peek_'), 'cp1252')
+            }.get((raw.get('_peek_') or [None])[0], 'cp1252')
         encoding = _encodings.normalize_encoding(encoding)
 
         # fix known browser bug, but it doesn't exactly hurt:
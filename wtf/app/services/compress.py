@@ -0,0 +1,776 @@
+# -*- coding: ascii -*-
+#
+# Copyright 2006-2012
+# Andr\xe9 Malo or his licensors, as applicable
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Compression service
+===================
+
+This service puts a middleware onto the stack, which compresses response
+bodies (``gzip`` or ``deflate``, as negotiated via ``Accept-Encoding``).
+The body is streamed through the compressor chunk by chunk.
+
+Compressed bodies of responses carrying validators (``ETag`` or
+``Last-Modified``) can be kept in a size bounded LRU cache. As long as the
+validators don't change, the body is compressed only once - hot static
+resources are delivered from the cache then. Responses varying on other
+request headers than ``Accept-Encoding`` and private responses (carrying
+``Set-Cookie`` or ``Cache-Control: private`` or ``no-store``) are never
+cached.
+
+Strong entity tags of compressed responses are made coding specific (``"abc"``
+becomes ``"abc-gzip"``). The suffix is removed from ``If-None-Match`` again
+before the application sees it (and restored on ``304`` responses).
+
+The service should be listed last, so the middleware sees the final
+responses::
+
+    [compress]
+    # level = 6
+    # min_size = 256
+    # types = text/* application/javascript application/json ...
+    # cache.size = 16 # MB, 0 = no cache
+    # cache.max_body = 1 # MB
+"""
+__author__ = u"Andr\xe9 Malo"
+__docformat__ = "restructuredtext en"
+
+import threading as _threading
+import zlib as _zlib
+
+from wtf import services as _services
+
+
+def choose_encoding(accept):
+    """
+    Choose the content encoding from an ``Accept-Encoding`` header
+
+    ``gzip`` is preferred over ``deflate`` if both are equally acceptable.
+
+    :Parameters:
+     - `accept`: The header value
+
+    :Types:
+     - `accept`: ``str``
+
+    :return: The encoding (``'gzip'`` or ``'deflate'``) or ``None``
+    :rtype: ``str``
+    """
+    codings = {}
+    for item in accept.split(','):
+        params = item.split(';')
+        coding, quality = params.pop(0).strip().lower(), 1.0
+        if not coding:
+            continue
+        for param in params:
+            if '=' in param:
+                key, value = param.split('=', 1)
+                if key.strip().lower() == 'q':
+                    try:
+                        quality = float(value.strip())
+                    except ValueError:
+                        quality = 0.0
+        codings[coding] = quality
+
+    star, result, best = codings.get('*', 0.0), None, 0.0
+    for coding in ('gzip', 'deflate'):
+        quality = codings.get(coding, codings.get('x-' + coding, star))
+        if quality > best:
+            result, best = coding, quality
+    return result
+
+
+def coding_etag(etag, coding):
+    """
+    Make a strong entity tag specific for a content encoding
+
+    Weak entity tags are returned unchanged.
+
+    :Parameters:
+     - `etag`: The entity tag
+     - `coding`: The content encoding
+
+    :Types:
+     - `etag`: ``str``
+     - `coding`: ``str``
+
+    :return: The coding specific entity tag
+    :rtype: ``str``
+    """
+    etag = etag.strip()
+    if len(etag) > 1 and etag.startswith('"') and etag.endswith('"'):
+        return '%s-%s"' % (etag[:-1], coding)
+    return etag
+
+
+def strip_coding_etags(value, coding):
+    """
+    Remove the coding suffix from the entity tags of an ``If-None-Match``
+
+    :Parameters:
+     - `value`: The header value
+     - `coding`: The content encoding
+
+    :Types:
+     - `value`: ``str``
+     - `coding`: ``str``
+
+    :return: The new header value and the list of the stripped entity tags
+             (``(str, [str, ...])``)
+    :rtype: ``tuple``
+    """
+    suffix, result, stripped = '-%s"' % coding, [], []
+    for etag in value.split(','):
+        etag = etag.strip()
+        if etag.startswith('"') and etag.endswith(suffix) and \
+                len(etag) > len(suffix):
+            etag = etag[:-len(suffix)] + '"'
+            stripped.append(etag)
+        result.append(etag)
+    return ', '.join(result), stripped
+
+
+class BodyCache(object):
+    """
+    LRU cache of compressed bodies, bounded by their total size
+
+    :IVariables:
+     - `_maxsize`: Maximum number of cached octets
+     - `_size`: Number of cached octets
+     - `_map`: Key -> node mapping (``{key: [prev, next, key, body]}``)
+     - `_root`: Sentinel node of the LRU list (most recent first)
+     - `_lock`: Lock protecting the cache
+
+    :Types:
+     - `_maxsize`: ``int``
+     - `_size`: ``int``
+     - `_map`: ``dict``
+     - `_root`: ``list``
+     - `_lock`: ``threading.Lock``
+    """
+
+    def __init__(self, maxsize):
+        """
+        Initialization
+
+        :Parameters:
+         - `maxsize`: Maximum number of cached octets
+
+        :Types:
+         - `maxsize`: ``int``
+        """
+        self._maxsize, self._size, self._map = maxsize, 0, {}
+        self._root = root = [None, None, None, None]
+        root[0] = root[1] = root
+        self._lock = _threading.Lock()
+
+    def get(self, key):
+        """
+        Look up a body and mark it as recently used
+
+        :Parameters:
+         - `key`: The cache key
+
+        :Types:
+         - `key`: ``tuple``
+
+        :return: The body or ``None``
+        :rtype: ``str``
+        """
+        self._lock.acquire()
+        try:
+            node = self._map.get(key)
+            if node is None:
+                return None
+            self._unlink(node)
+            self._link(node)
+            return node[3]
+        finally:
+            self._lock.release()
+
+    def set(self, key, body):
+        """
+        Store a body, evicting the least recently used ones if necessary
+
+        Bodies larger than the cache are not stored.
+
+        :Parameters:
+         - `key`: The cache key
+         - `body`: The compressed body
+
+        :Types:
+         - `key`: ``tuple``
+         - `body`: ``str``
+        """
+        if len(body) > self._maxsize:
+            return
+        self._lock.acquire()
+        try:
+            node = self._map.pop(key, None)
+            if node is not None:
+                self._unlink(node)
+                self._size -= len(node[3])
+            while self._size + len(body) > self._maxsize:
+                node = self._root[1]
+                self._unlink(node)
+                del self._map[node[2]]
+                self._size -= len(node[3])
+            node = [None, None, key, body]
+            self._link(node)
+            self._map[key] = node
+            self._size += len(body)
+        finally:
+            self._lock.release()
+
+    def _link(self, node):
+        """ Insert node as most recently used """
+        root = self._root
+        node[0], node[1] = root[0], root
+        root[0][1] = root[0] = node
+
+    def _unlink(self, node):
+        """ Remove node from the LRU list """
+        node[0][1], node[1][0] = node[1], node[0]
+
+
+class Encoder(object):
+    """
+    Response body encoder for a single request
+
+    The decision to compress is made when the response is started.
+
+    :CVariables:
+     - `_VARY`: The header name added to ``Vary``
+     - `_PRIVATE`: ``Cache-Control`` directives preventing the caching
+
+    :IVariables:
+     - `cached`: The cached compressed body to deliver instead of the
+       application's (or ``None``)
+     - `active`: Is the body compressed?
+     - `_svc`: Compression service instance
+     - `_coding`: Accepted content encoding (or ``None``)
+     - `_resource`: Resource identifier for the cache key
+     - `_etags`: Entity tags stripped from ``If-None-Match``
+     - `_compress`: Compressor object
+     - `_key`: Cache key (or ``None`` if the body is not cached)
+     - `_body`: Compressed body for the cache so far (``[str, ...]``)
+     - `_size`: Size of `_body`
+
+    :Types:
+     - `_VARY`: ``str``
+     - `_PRIVATE`: ``tuple``
+     - `cached`: ``str``
+     - `active`: ``bool``
+     - `_svc`: `CompressService`
+     - `_coding`: ``str``
+     - `_resource`: ``tuple``
+     - `_etags`: ``list``
+     - `_compress`: zlib compressor
+     - `_key`: ``tuple``
+     - `_body`: ``list``
+     - `_size`: ``int``
+    """
+    cached, active, _compress, _key, _body, _size = \
+        None, False, None, None, None, 0
+    _VARY = 'Accept-Encoding'
+    _PRIVATE = ('private', 'no-store')
+
+    def __init__(self, svc, coding, resource, etags=()):
+        """
+        Initialization
+
+        :Parameters:
+         - `svc`: Compression service instance
+         - `coding`: Accepted content encoding (or ``None``)
+         - `resource`: Resource identifier for the cache key
+         - `etags`: Entity tags stripped from ``If-None-Match``
+
+        :Types:
+         - `svc`: `CompressService`
+         - `coding`: ``str``
+         - `resource`: ``tuple``
+         - `etags`: ``list``
+        """
+        self._svc, self._coding, self._resource = svc, coding, resource
+        self._etags = etags
+
+    def headers(self, status, headers):
+        """
+        Inspect the response and adapt the headers
+
+        :Parameters:
+         - `status`: Response status line
+         - `headers`: Response headers (``[(name, value), ...]``)
+
+        :Types:
+         - `status`: ``str``
+         - `headers`: ``list``
+
+        :return: The headers to send
+        :rtype: ``list``
+        """
+        self.cached, self.active, self._key = None, False, None
+        if not self._svc.compressible(status, headers):
+            if self._etags and status[:3] == '304':
+                result = []
+                for name, value in headers:
+                    if name.lower() == 'etag' and \
+                            value.strip() in self._etags:
+                        value = coding_etag(value, self._coding)
+                    result.append((name, value))
+                headers = result
+            return headers
+
+        result, vary, validators = [], None, [None, None]
+        private = False
+        for name, value in headers:
+            lname = name.lower()
+            if lname == 'vary':
+                vary = value
+                continue
+            elif lname == 'etag':
+                validators[0] = value
+                if self._coding is not None:
+                    value = coding_etag(value, self._coding)
+            elif lname == 'last-modified':
+                validators[1] = value
+            elif lname == 'content-length' and self._coding is not None:
+                continue
+            elif lname == 'set-cookie':
+                private = True
+            elif lname == 'cache-control':
+                for item in value.split(','):
+                    if item.split('=', 1)[0].strip().lower() in self._PRIVATE:
+                        private = True
+            result.append((name, value))
+        if vary is None:
+            vary = self._VARY
+        else:
+            items = [item.strip().lower() for item in vary.split(',')]
+            if [item for item in items
+                    if item and item != self._VARY.lower()]:
+                private = True
+            if self._VARY.lower() not in items and vary.strip() != '*':
+                vary = "%s, %s" % (vary, self._VARY)
+        result.append(('Vary', vary))
+        if self._coding is None:
+            return result
+
+        result.append(('Content-Encoding', self._coding))
+        self.active = True
+        cache = self._svc.cache
+        if cache is not None and status[:3] == '200' and not private and \
+                validators != [None, None]:
+            self._key = self._resource + (self._coding, tuple(validators))
+            self.cached = cache.get(self._key)
+            if self.cached is not None:
+                result.append(('Content-Length', str(len(self.cached))))
+                return result
+            self._body, self._size = [], 0
+        self._compress = self._svc.compressor(self._coding)
+        return result
+
+    def encode(self, data):
+        """
+        Compress a piece of the body
+
+        If the body is delivered from the cache, the data is dropped (the
+        cached body contains it already).
+
+        :Parameters:
+         - `data`: The piece to compress
+
+        :Types:
+         - `data`: ``str``
+
+        :return: The compressed data (may be empty)
+        :rtype: ``str``
+        """
+        if self.cached is not None:
+            return ''
+        if self._compress is None:
+            return data
+        return self._collect(self._compress.compress(data))
+
+    def flush(self):
+        """
+        Flush the compressor, so all data written so far can be decoded
+
+        :return: The compressed data (may be empty)
+        :rtype: ``str``
+        """
+        if self._compress is None:
+            return ''
+        return self._collect(self._compress.flush(_zlib.Z_SYNC_FLUSH))
+
+    def finish(self):
+        """
+        Finish the compressed body (and store it in the cache)
+
+        :return: The remaining compressed data (may be empty)
+        :rtype: ``str``
+        """
+        compress, self._compress = self._compress, None
+        if compress is None:
+            return ''
+        data = self._collect(compress.flush())
+        if self._body is not None:
+            self._svc.cache.set(self._key, ''.join(self._body))
+            self._body = None
+        return data
+
+    def _collect(self, data):
+        """ Remember the compressed data for the cache (if still suitable) """
+        if self._body is not None and data:
+            self._size += len(data)
+            if self._size > self._svc.max_body:
+                self._body = None
+            else:
+                self._body.append(data)
+        return data
+
+
+class Iterator(object):
+    """
+    Result iterator, delivering the encoded body
+
+    Sized results (e.g. lists) are compressed completely on the first
+    iteration step, so the gateway can determine the content length.
+
+    :IVariables:
+     - `close`: The iterable's close method (only if there's one)
+     - `_wrapped`: The wrapped iterable
+     - `_encoder`: The encoder
+     - `_iter`: Iterator over the wrapped iterable (or ``None`` before the
+       first step)
+     - `_remaining`: Number of remaining items, if known (or ``None``)
+     - `_finished`: Was the encoder finished?
+
+    :Types:
+     - `close`: ``callable``
+     - `_wrapped`: ``iterable``
+     - `_encoder`: `Encoder`
+     - `_iter`: ``iterator``
+     - `_remaining`: ``int``
+     - `_finished`: ``bool``
+    """
+    _iter, _remaining, _finished = None, None, False
+
+    def __init__(self, wrapped, encoder):
+        """
+        Initialization
+
+        :Parameters:
+         - `wrapped`: The iterable to wrap
+         - `encoder`: The encoder
+
+        :Types:
+         - `wrapped`: ``iterable``
+         - `encoder`: `Encoder`
+        """
+        try:
+            close = wrapped.close
+        except AttributeError:
+            pass
+        else:
+            self.close = close
+        self._wrapped, self._encoder = wrapped, encoder
+
+    def __iter__(self):
+        """
+        Return iterator object (iterator protocol)
+
+        :return: The iterator object
+        :rtype: `Iterator`
+        """
+        return self
+
+    def next(self):
+        """
+        Return next item of the iterable (iterator protocol)
+
+        :return: The next item
+        :rtype: ``str``
+        """
+        encoder = self._encoder
+        if self._iter is None:
+            self._iter = iter(self._wrapped)
+            if encoder.cached is None:
+                try:
+                    self._remaining = len(self._wrapped)
+                except TypeError:
+                    pass
+                else:
+                    if encoder.active:
+                        data = ''.join([encoder.encode(chunk)
+                            for chunk in self._iter]) + encoder.finish()
+                        self._remaining, self._finished = 0, True
+                        return data
+
+        for chunk in self._iter:
+            if self._remaining is not None:
+                self._remaining -= 1
+            if encoder.cached is not None:
+                break
+            if not encoder.active:
+                return chunk
+            data = encoder.encode(chunk)
+            if data:
+                return data
+
+        if encoder.cached is not None:
+            self._iter, self._remaining = iter(()), 0
+            data, encoder.cached = encoder.cached, None
+            self._finished = True
+            return data
+        if not self._finished:
+            self._finished = True
+            data = encoder.finish()
+            if data:
+                return data
+        raise StopIteration()
+
+    def __len__(self):
+        """
+        Determine the number of remaining items
+
+        :return: The length
+        :rtype: ``int``
+
+        :Exceptions:
+         - `TypeError`: The number is unknown
+        """
+        if self._remaining is None or \
+                (self._encoder.active and not self._finished):
+            raise TypeError()
+        return self._remaining
+
+
+class Middleware(object):
+    """
+    Compression middleware
+
+    :IVariables:
+     - `_svc`: Compression service instance
+     - `_func`: Wrapped WSGI callable
+
+    :Types:
+     - `_svc`: `CompressService`
+     - `_func`: ``callable``
+    """
+
+    def __init__(self, svc, func):
+        """
+        Initialization
+
+        :Parameters:
+         - `svc`: Compression service instance
+         - `func`: WSGI callable to wrap
+
+        :Types:
+         - `svc`: `CompressService`
+         - `func`: ``callable``
+        """
+        self._svc, self._func = svc, func
+
+    def __call__(self, environ, start_response):
+        """
+        Middleware handler
+
+        :Parameters:
+         - `environ`: WSGI environment
+         - `start_response`: Start response callable
+
+        :Types:
+         - `environ`: ``dict``
+         - `start_response`: ``callable``
+
+        :return: WSGI response iterable
+        :rtype: ``iterable``
+        """
+        coding, etags = None, ()
+        if environ.get('REQUEST_METHOD') != 'HEAD':
+            coding = choose_encoding(environ.get('HTTP_ACCEPT_ENCODING', ''))
+            if coding is not None and 'HTTP_IF_NONE_MATCH' in environ:
+                environ['HTTP_IF_NONE_MATCH'], etags = strip_coding_etags(
+                    environ['HTTP_IF_NONE_MATCH'], coding
+                )
+        encoder = Encoder(self._svc, coding, (
+            environ.get('wsgi.url_scheme', ''),
+            environ.get('HTTP_HOST', '').lower(),
+            environ.get('SCRIPT_NAME', ''), environ.get('PATH_INFO', ''),
+            environ.get('QUERY_STRING', ''),
+        ), etags)
+
+        writer = []
+        def my_start_response(status, response_headers, exc_info=None):
+            """ start_response wrapper, which compresses the written data """
+            write = start_response(
+                status, encoder.headers(status, response_headers), exc_info
+            )
+            writer[:] = [write]
+            def my_write(data):
+                """ Compressing writer """
+                if encoder.active:
+                    data = encoder.encode(data)
+                if data:
+                    write(data)
+            return my_write
+
+        flush = environ.get('wtf.response.flush')
+        if flush is not None:
+            def my_flush(response):
+                """ Response flush factory, which flushes the compressor """
+                func = flush(response)
+                def flush_response():
+                    """ Send the compressed data written so far """
+                    data = encoder.flush()
+                    if data:
+                        writer[0](data)
+                    func()
+                return flush_response
+            environ['wtf.response.flush'] = my_flush
+
+        result = self._func(environ, my_start_response)
+        if writer and not encoder.active:
+            # untouched (keeps file wrappers intact, for example)
+            return result
+        return Iterator(result, encoder)
+
+
+class CompressService(object):
+    """
+    Compression service
+
+    :IVariables:
+     - `cache`: Body cache (or ``None``)
+     - `max_body`: Maximum size of a cached body
+     - `_level`: Compression level
+     - `_min_size`: Minimum content length to compress
+     - `_types`: Compressible content types (``set``) and type prefixes
+       (``tuple``)
+
+    :Types:
+     - `cache`: `BodyCache`
+     - `max_body`: ``int``
+     - `_level`: ``int``
+     - `_min_size`: ``int``
+     - `_types`: ``tuple``
+    """
+    __implements__ = [_services.ServiceInterface]
+    _TYPES = (
+        'text/*', 'application/javascript', 'application/json',
+        'application/x-javascript', 'application/xml', 'application/xhtml+xml',
+        'application/rss+xml', 'application/atom+xml', 'image/svg+xml',
+    )
+
+    def __init__(self, config, opts, args):
+        """ :See: `wtf.services.ServiceInterface.__init__` """
+        level, min_size, types, size, max_body = 6, 256, self._TYPES, 0, 1
+        if 'compress' in config:
+            section = config.compress
+            level = int(section('level', level))
+            min_size = int(section('min_size', min_size))
+            types = section('types', types)
+            if 'cache' in section:
+                size = float(section.cache('size', size))
+                max_body = float(section.cache('max_body', max_body))
+        if not 1 <= level <= 9:
+            raise ValueError("Compression level must be between 1 and 9")
+        self._level, self._min_size = level, max(0, min_size)
+        exact, prefixes = set(), []
+        for mtype in types:
+            mtype = unicode(mtype).encode('ascii').strip().lower()
+            if mtype.endswith('/*'):
+                prefixes.append(mtype[:-1])
+            elif mtype:
+                exact.add(mtype)
+        self._types = exact, tuple(prefixes)
+        self.cache, self.max_body = None, int(max_body * 1048576)
+        if size > 0:
+            self.cache = BodyCache(int(size * 1048576))
+
+    def shutdown(self):
+        """ :See: `wtf.services.ServiceInterface.shutdown` """
+        pass
+
+    def global_service(self):
+        """ :See: `wtf.services.ServiceInterface.global_service` """
+        return None
+
+    def middleware(self, func):
+        """ :See: `wtf.services.ServiceInterface.middleware` """
+        return Middleware(self, func)
+
+    def compressible(self, status, headers):
+        """
+        Decide whether a response may be compressed
+
+        :Parameters:
+         - `status`: Response status line
+         - `headers`: Response headers (``[(name, value), ...]``)
+
+        :Types:
+         - `status`: ``str``
+         - `headers`: ``list``
+
+        :return: May the response be compressed?
+        :rtype: ``bool``
+        """
+        if status[:3] in ('204', '206', '304') or status[:1] == '1':
+            return False
+        ctype = None
+        for name, value in headers:
+            name = name.lower()
+            if name == 'content-type':
+                ctype = value.split(';', 1)[0].strip().lower()
+            elif name in ('content-encoding', 'content-range'):
+                return False
+            elif name == 'content-length':
+                try:
+                    if int(value) < self._min_size:
+                        return False
+                except ValueError:
+                    return False
+            elif name == 'cache-control' and \
+                    'no-transform' in value.lower():
+                return False
+        if ctype is None:
+            return False
+        exact, prefixes = self._types
+        if ctype in exact:
+            return True
+        for prefix in prefixes:
+            if ctype.startswith(prefix):
+                return True
+        return False
+
+    def compressor(self, coding):
+        """
+        Create a compressor
+
+        :Parameters:
+         - `coding`: Content encoding (``'gzip'`` or ``'deflate'``)
+
+        :Types:
+         - `coding`: ``str``
+
+        :return: The compressor object
+        :rtype: zlib compressor
+        """
+        wbits = _zlib.MAX_WBITS
+        if coding == 'gzip':
+            wbits += 16
+        return _zlib.compressobj(self._level, _zlib.DEFLATED, wbits)
@@ -216,6 +216,10 @@ class ResponseFactory(object):
 
             stream = file(name, 'rb')
             try:
+                wrapper = response.request.env.get('wsgi.file_wrapper')
+                if wrapper is not None:
+                    # allows the gateway to use sendfile(2)
+                    return wrapper(stream)
                 return _stream.GenericStream(stream, blockiter=0)
             except: # pylint: disable = W0702
                 e = _sys.exc_info()
@@ -19,15 +19,26 @@ Autoreload of python code
 =========================
 
 This module provides logic to implemented the autoreload mechanism. This is
-implemented by forking early, remembering the module's mtimes and dealing
-with changed mtimes by going back right before the fork point.
+implemented by forking early, watching the modules loaded afterwards and
+dealing with changes by going back right before the fork point.
+
+The modules are watched by a background thread, using inotify if
+available and periodic mtime checks otherwise.
 """
 __author__ = u"Andr\xe9 Malo"
 __docformat__ = "restructuredtext en"
 
+import errno as _errno
 import os as _os
+import select as _select
+import struct as _struct
 import sys as _sys
+import thread as _thread
+import threading as _threading
 import time as _time
+import traceback as _traceback
+
+from wtf import osutil as _osutil
 
 
 class ReloadRequested(SystemExit):
@@ -48,8 +59,19 @@ class ReloadRequested(SystemExit):
 
 
 class Autoreload(object):
-    """ Autoreload logic container """
-    _check_mtime, _before = None, None
+    """
+    Autoreload logic container
+
+    The modules are watched by a background thread (see `Watcher`), so
+    `check` is cheap.
+
+    :IVariables:
+     - `_watcher`: The module watcher (or ``None``)
+
+    :Types:
+     - `_watcher`: `Watcher`
+    """
+    _watcher = None
 
     def __init__(self, config, opts, args):
         """
@@ -67,8 +89,8 @@ class Autoreload(object):
         """
         autoreload = config.wtf('autoreload', False)
         if autoreload:
-            self._check_mtime = _time.time()
-            self._before = set(_sys.modules.iterkeys())
+            self._watcher = watcher_factory(_sys.modules.iterkeys())
+            self._watcher.start()
             self.check = self._check
         else:
             self.check = lambda: ()
@@ -77,49 +99,329 @@ class Autoreload(object):
         """
         Check the need of reloading in case autoreload has been turned on
 
-        This method takes a snapshot of the current sys.modules, mtimes
-        are compared with an older snapshot and on differences true is
-        returned. False otherwise.
+        The watcher collects the names of the changed modules in the
+        background. This method just fetches them.
 
         :return: Names of the changed modules (empty if nothing's changed)
         :rtype: ``iterable``
         """
-        check_mtime, changed = _time.time(), []
+        watcher = self._watcher
+        if not watcher.changed:
+            return ()
+        return watcher.fetch()
+
+
+class Watcher(object):
+    """
+    Module watcher, based on periodic mtime checks
+
+    Modules already loaded when the watcher is created are not watched.
+
+    :CVariables:
+     - `_INTERVAL`: Time between two scans in seconds
+
+    :IVariables:
+     - `changed`: Are there changed modules, which haven't been fetched
+       yet?
+     - `_before`: Names of the modules not to watch
+     - `_known`: Watched modules (``{name: filename}``)
+     - `_changed`: Names of the changed modules
+     - `_check_mtime`: Start time of the last scan
+     - `_lock`: Lock for `changed` and `_changed`
+
+    :Types:
+     - `_INTERVAL`: ``float``
+     - `changed`: ``bool``
+     - `_before`: ``set``
+     - `_known`: ``dict``
+     - `_changed`: ``set``
+     - `_check_mtime`: ``float``
+     - `_lock`: ``threading.Lock``
+    """
+    _INTERVAL = 1.0
+    changed = False
+
+    def __init__(self, before):
+        """
+        Initialization
+
+        :Parameters:
+         - `before`: Names of the modules not to watch
+
+        :Types:
+         - `before`: ``iterable``
+        """
+        self._before = set(before)
+        self._known, self._changed = {}, set()
+        self._check_mtime = _time.time()
+        self._lock = _threading.Lock()
+
+    def start(self):
+        """ Start the watcher thread """
+        _thread.start_new_thread(self._run, ())
+
+    def fetch(self):
+        """
+        Fetch (and reset) the names of the changed modules
+
+        :return: The names of the changed modules
+        :rtype: ``list``
+        """
+        self._lock.acquire()
+        try:
+            changed, self._changed = self._changed, set()
+            self.changed = False
+        finally:
+            self._lock.release()
+        return sorted(changed)
+
+    def _report(self, names):
+        """
+        Record changed modules
+
+        :Parameters:
+         - `names`: The names of the changed modules
+
+        :Types:
+         - `names`: ``iterable``
+        """
+        names = list(names)
+        if names:
+            self._lock.acquire()
+            try:
+                self._changed.update(names)
+                self.changed = True
+            finally:
+                self._lock.release()
+
+    def _new_modules(self):
+        """
+        Find modules loaded since the last call
+
+        :return: The new modules (``[(name, filename), ...]``). The
+                 filename is the one to watch.
+        :rtype: ``list``
+        """
+        result, known, before = [], self._known, self._before
         for name, mod in _sys.modules.items():
-            if mod is None or name in self._before:
+            if mod is None or name in before or name in known:
                 continue
-            mtime = self._mtime(mod)
-            if mtime is None:
+            filename = _filename(mod)
+            known[name] = filename
+            if filename is not None:
+                result.append((name, filename))
+        return result
+
+    def _run(self):
+        """ Watcher thread main loop """
+        try:
+            while True:
+                self._scan()
+                _time.sleep(self._INTERVAL)
+        except:
+            _sys.stderr.write(
+                "Uncaught exception in autoreload watcher:\n" +
+                _traceback.format_exc()
+            )
+
+    def _scan(self):
+        """ Pick up new modules and check the mtimes of all of them """
+        self._new_modules()
+        self._stat()
+
+    def _stat(self):
+        """ Check the mtimes of all watched modules """
+        check_mtime, changed = _time.time(), []
+        for name, filename in self._known.items():
+            if filename is None:
                 continue
-            if mtime > self._check_mtime:
+            mtime = _mtime(filename)
+            if mtime is not None and mtime > self._check_mtime:
                 changed.append(name)
         self._check_mtime = check_mtime
-        return changed
+        self._report(changed)
+
+
+class InotifyWatcher(Watcher):
+    """
+    Module watcher, based on inotify
+
+    The directories of the modules are watched (so files replaced by
+    editors are noticed as well). Newly loaded modules are picked up
+    every `_INTERVAL` seconds.
+
+    :CVariables:
+     - `_MASK`: The inotify events to watch for
+     - `_IN_Q_OVERFLOW`: inotify queue overflow event
+
+    :IVariables:
+     - `_fd`: The inotify descriptor
+     - `_dirs`: Watched directories (``{wd: {basename: [name, ...]}}``)
+     - `_wds`: Watch descriptors of the directories (``{dirname: wd}``)
+
+    :Types:
+     - `_MASK`: ``int``
+     - `_IN_Q_OVERFLOW`: ``int``
+     - `_fd`: ``int``
+     - `_dirs`: ``dict``
+     - `_wds`: ``dict``
+    """
+    # IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+    _MASK = 0x00000004 | 0x00000008 | 0x00000080 | 0x00000100
+    _IN_Q_OVERFLOW = 0x00004000
 
-    def _mtime(self, mod):
+    def __init__(self, before):
         """
-        Determine the mtime of a module
+        Initialization
 
         :Parameters:
-         - `mod`: The module to inspect
+         - `before`: Names of the modules not to watch
 
         :Types:
-         - `mod`: ``module``
+         - `before`: ``iterable``
 
-        :return: The mtime or ``None`` if it couldn't be determined (``float``
-                 or ``int``, depending on the ``os.stat_float_times`` setting)
-        :rtype: number
+        :Exceptions:
+         - `OSError`: inotify could not be initialized
+         - `NotImplementedError`: inotify is not available
         """
-        filename = getattr(mod, '__file__', None)
-        if filename is not None:
-            try:
-                if filename.endswith('.pyo') or filename.endswith('.pyc'):
-                    newname = filename[:-1]
-                    return _os.stat(newname).st_mtime
-                raise OSError()
-            except OSError:
+        super(InotifyWatcher, self).__init__(before)
+        self._fd = _osutil.inotify_init()
+        self._dirs, self._wds = {}, {}
+
+    def _run(self):
+        """ Watcher thread main loop """
+        try:
+            while True:
+                self._add_new()
                 try:
-                    return _os.stat(filename).st_mtime
+                    ready, _, _ = _select.select(
+                        [self._fd], [], [], self._INTERVAL
+                    )
+                except _select.error, e:
+                    if e[0] != _errno.EINTR:
+                        raise
+                    continue
+                if ready:
+                    self._read()
+        except:
+            _sys.stderr.write(
+                "Uncaught exception in autoreload watcher:\n" +
+                _traceback.format_exc()
+            )
+
+    def _add_new(self):
+        """ Watch the directories of newly loaded modules """
+        changed = []
+        for name, filename in self._new_modules():
+            dirname, basename = _os.path.split(filename)
+            wd = self._wds.get(dirname)
+            if wd is None:
+                try:
+                    wd = _osutil.inotify_add_watch(
+                        self._fd, dirname or '.', self._MASK
+                    )
                 except OSError:
-                    pass
+                    continue
+                self._wds[dirname] = wd
+            self._dirs.setdefault(wd, {}).setdefault(basename, []).append(
+                name
+            )
+            # modified between the start and the watch?
+            mtime = _mtime(filename)
+            if mtime is not None and mtime > self._check_mtime:
+                changed.append(name)
+        self._report(changed)
+
+    def _read(self):
+        """ Read and dispatch the pending events """
+        data = []
+        while True:
+            try:
+                chunk = _os.read(self._fd, 65536)
+            except OSError, e:
+                if e[0] == _errno.EINTR:
+                    continue
+                if e[0] != _errno.EAGAIN:
+                    raise
+                break
+            if not chunk:
+                break
+            data.append(chunk)
+        data = ''.join(data)
+
+        changed, pos, dirs = [], 0, self._dirs
+        while pos + 16 <= len(data):
+            wd, mask, _, size = _struct.unpack('iIII', data[pos:pos + 16])
+            basename = data[pos + 16:pos + 16 + size].rstrip('\0')
+            pos += 16 + size
+            if mask & self._IN_Q_OVERFLOW:
+                # lost events. Check everything the hard way.
+                self._stat()
+                continue
+            changed.extend(dirs.get(wd, {}).get(basename, ()))
+        self._check_mtime = _time.time()
+        self._report(changed)
+
+
+def watcher_factory(before):
+    """
+    Create the best module watcher available
+
+    :Parameters:
+     - `before`: Names of the modules not to watch
+
+    :Types:
+     - `before`: ``iterable``
+
+    :return: New watcher (not started yet)
+    :rtype: `Watcher`
+    """
+    before = set(before)
+    try:
+        return InotifyWatcher(before)
+    except (NotImplementedError, OSError):
+        return Watcher(before)
+
+
+def _filename(mod):
+    """
+    Determine the file to watch for a module
+
+    :Parameters:
+     - `mod`: The module to inspect
+
+    :Types:
+     - `mod`: ``module``
+
+    :return: The filename (the source file, if available) or ``None``, if
+             it couldn't be determined
+    :rtype: ``str``
+    """
+    filename = getattr(mod, '__file__', None)
+    if filename is not None:
+        if filename.endswith('.pyo') or filename.endswith('.pyc'):
+            if _os.path.exists(filename[:-1]):
+                return filename[:-1]
+        if _os.path.exists(filename):
+            return filename
+    return None
+
+
+def _mtime(filename):
+    """
+    Determine the mtime of a file
+
+    :Parameters:
+     - `filename`: The file to inspect
+
+    :Types:
+     - `filename`: ``str``
+
+    :return: The mtime or ``None`` if it couldn't be determined (``float``
+             or ``int``, depending on the ``os.stat_float_times`` setting)
+    :rtype: number
+    """
+    try:
+        return _os.stat(filename).st_mtime
+    except OSError:
         return None
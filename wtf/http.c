@@ -0,0 +1,428 @@
+/*
+ * Copyright 2006-2012
+ * Andr Malo or his licensors, as applicable
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+#include "cext.h"
+EXT_INIT_FUNC;
+
+#include <string.h>
+
+/* ------------------------ BEGIN COMMON DEFINITIONS ----------------------- */
+
+/* whitespace as understood by python's str.split() and \s */
+#define WTF_IS_SPACE(c) (   (c) == ' ' || (c) == '\t' || (c) == '\n' \
+                         || (c) == '\r' || (c) == '\f' || (c) == '\v')
+
+#define WTF_IS_DIGIT(c) ((c) >= '0' && (c) <= '9')
+
+/* token chars from rfc 2616 */
+#define WTF_IS_TOKEN(c) (   (c) > 32 && (c) < 127 \
+                         && !strchr("()<>@,;:\\\"/[]?={}", (c)))
+
+/*
+ * Static objects (allocated once at module init time)
+ */
+static PyObject *spacestring;  /* " " */
+static PyObject *commastring;  /* ", " */
+
+/* ------------------------- END COMMON DEFINITIONS ------------------------ */
+
+/* --------------------------BEGIN HELPER FUNCTIONS------------------------- */
+
+/* Raise a ValueError(part, message) */
+static void
+set_parse_error(const char *part, const char *message)
+{
+    PyObject *args;
+
+    if ((args = Py_BuildValue("(ss)", part, message))) {
+        PyErr_SetObject(PyExc_ValueError, args);
+        Py_DECREF(args);
+    }
+}
+
+/* Create an int from a string of digits (overflow safe) */
+static PyObject *
+number_from_digits(const char *start, const char *end)
+{
+    PyObject *digits, *result;
+
+    if (!(digits = PyString_FromStringAndSize(start, end - start)))
+        return NULL;
+    result = PyInt_FromString(PyString_AS_STRING(digits), NULL, 10);
+    Py_DECREF(digits);
+
+    return result;
+}
+
+/*
+ * Parse the protocol string ("HTTP/major.minor")
+ *
+ * Returns the version tuple, or NULL (with or without exception set)
+ */
+static PyObject *
+parse_protocol(const char *start, const char *end)
+{
+    PyObject *major, *minor, *result;
+    const char *dot, *mstart;
+    int is_zero = 1;
+
+    if (end - start < 8 || memcmp(start, "HTTP/", 5))
+        return NULL;
+
+    mstart = start += 5;
+    while (start < end && WTF_IS_DIGIT(*start)) {
+        if (*start++ != '0')
+            is_zero = 0;
+    }
+    if (start == mstart || start >= end || *start != '.')
+        return NULL;
+    dot = start++;
+    if (start == end)
+        return NULL;
+    for (; start < end; ++start) {
+        if (!WTF_IS_DIGIT(*start))
+            return NULL;
+    }
+    if (is_zero) {
+        set_parse_error("request", "Invalid protocol version");
+        return NULL;
+    }
+
+    if (!(major = number_from_digits(mstart, dot)))
+        return NULL;
+    if (!(minor = number_from_digits(dot + 1, end))) {
+        Py_DECREF(major);
+        return NULL;
+    }
+    result = PyTuple_Pack(2, major, minor);
+    Py_DECREF(minor);
+    Py_DECREF(major);
+
+    return result;
+}
+
+/*
+ * Store a finished header (name + continuation values)
+ *
+ * Returns -1 on error
+ */
+static int
+store_header(PyObject *headers, PyObject *name, PyObject *values)
+{
+    PyObject *value, *list;
+    int res;
+
+    if (PyList_GET_SIZE(values) == 1) {
+        value = PyList_GET_ITEM(values, 0);
+        Py_INCREF(value);
+    }
+    else if (!(value = _PyString_Join(spacestring, values)))
+        return -1;
+
+    if ((list = PyDict_GetItem(headers, name))) {
+        res = PyList_Append(list, value);
+        Py_DECREF(value);
+        return res;
+    }
+
+    if (!(list = PyList_New(1))) {
+        Py_DECREF(value);
+        return -1;
+    }
+    PyList_SET_ITEM(list, 0, value);
+    res = PyDict_SetItem(headers, name, list);
+    Py_DECREF(list);
+
+    return res;
+}
+
+/*
+ * Parse the header lines between start and end (end is the final LF of
+ * the last header line)
+ *
+ * Returns the dict of comma folded headers or NULL on error
+ */
+static PyObject *
+parse_headers(const char *start, const char *end)
+{
+    PyObject *headers, *name = NULL, *values = NULL, *value, *folded;
+    const char *lend, *nend, *vstart;
+    char *lower;
+    Py_ssize_t pos;
+
+    if (!(headers = PyDict_New()))
+        return NULL;
+
+    while (start < end) {
+        if (!(lend = memchr(start, '\n', (size_t)(end - start))))
+            lend = end;
+        nend = lend;
+        if (nend > start && nend[-1] == '\r')
+            --nend;
+
+        /* continuation line */
+        if (nend > start && WTF_IS_SPACE(*start)) {
+            if (!name) {
+                set_parse_error("header",
+                                "Continuation line without line to continue");
+                goto error;
+            }
+            while (start < nend && WTF_IS_SPACE(*start))
+                ++start;
+            if (!(value = PyString_FromStringAndSize(start, nend - start)))
+                goto error;
+            if (PyList_Append(values, value) == -1) {
+                Py_DECREF(value);
+                goto error;
+            }
+            Py_DECREF(value);
+            start = lend + 1;
+            continue;
+        }
+        else if (name) {
+            if (store_header(headers, name, values) == -1)
+                goto error;
+            Py_CLEAR(name);
+            Py_CLEAR(values);
+        }
+
+        /* name: value */
+        vstart = start;
+        while (vstart < nend && WTF_IS_TOKEN(*vstart))
+            ++vstart;
+        if (vstart == start)
+            goto invalid;
+        if (!(name = PyString_FromStringAndSize(NULL, vstart - start)))
+            goto error;
+        for (lower = PyString_AS_STRING(name); start < vstart; ++start)
+            *lower++ = (*start >= 'A' && *start <= 'Z')
+                ? *start + ('a' - 'A') : *start;
+        while (vstart < nend && WTF_IS_SPACE(*vstart))
+            ++vstart;
+        if (vstart >= nend || *vstart++ != ':')
+            goto invalid;
+        while (vstart < nend && WTF_IS_SPACE(*vstart))
+            ++vstart;
+
+        if (!(values = PyList_New(1)))
+            goto error;
+        if (!(value = PyString_FromStringAndSize(vstart, nend - vstart)))
+            goto error;
+        PyList_SET_ITEM(values, 0, value);
+        start = lend + 1;
+    }
+    if (name) {
+        if (store_header(headers, name, values) == -1)
+            goto error;
+        Py_CLEAR(name);
+        Py_CLEAR(values);
+    }
+
+    /* fold the values */
+    pos = 0;
+    while (PyDict_Next(headers, &pos, &name, &values)) {
+        if (PyList_GET_SIZE(values) == 1) {
+            folded = PyList_GET_ITEM(values, 0);
+            Py_INCREF(folded);
+        }
+        else if (!(folded = _PyString_Join(commastring, values))) {
+            name = values = NULL;
+            goto error;
+        }
+        /* replacing the value of an existing key is safe during iteration */
+        if (PyDict_SetItem(headers, name, folded) == -1) {
+            Py_DECREF(folded);
+            name = values = NULL;
+            goto error;
+        }
+        Py_DECREF(folded);
+    }
+
+    return headers;
+
+invalid:
+    set_parse_error("header", "Invalid header line format");
+error:
+    Py_XDECREF(values);
+    Py_XDECREF(name);
+    Py_DECREF(headers);
+    return NULL;
+}
+
+/* ---------------------------END HELPER FUNCTIONS-------------------------- */
+
+/* ------------------------ BEGIN GLOBAL FUNCTIONS ------------------------ */
+
+PyDoc_STRVAR(wtf_parse_head__doc__,
+"parse_head(data)\n\
+\n\
+Parse a request head (request line and headers)\n\
+\n\
+:Parameters:\n\
+ - `data`: The octets received so far, starting with the request line\n\
+\n\
+:Types:\n\
+ - `data`: ``str``\n\
+\n\
+:return: ``None`` if the head is not complete yet. Otherwise a tuple of\n\
+         method, url, protocol version, a dict of comma folded headers\n\
+         (keys are lower cased) and the size of the head\n\
+         (``('method', 'url', (major, minor), {...}, size)``)\n\
+:rtype: ``tuple``\n\
+\n\
+:Exceptions:\n\
+ - `ValueError`: The head is invalid. The exception arguments are the\n\
+   invalid part (``'request'`` or ``'header'``) and the message.");
+
+static PyObject *
+wtf_parse_head(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"data", NULL};
+    PyObject *method = NULL, *url = NULL, *protocol = NULL, *headers,
+             *result = NULL;
+    const char *data, *sentinel, *end, *cur, *tokens[4][2], *hend;
+    Py_ssize_t size;
+    int num = 0;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "s#", kwlist, &data, &size))
+        return NULL;
+
+    sentinel = data + size;
+    if (!(end = memchr(data, '\n', (size_t)size)))
+        Py_RETURN_NONE;
+
+    if (WTF_IS_SPACE(*data)) {
+        set_parse_error("request", "Invalid request line format");
+        return NULL;
+    }
+
+    /* split the request line */
+    for (cur = data; cur < end && num < 4; ++num) {
+        tokens[num][0] = cur;
+        while (cur < end && !WTF_IS_SPACE(*cur))
+            ++cur;
+        tokens[num][1] = cur;
+        while (cur < end && WTF_IS_SPACE(*cur))
+            ++cur;
+    }
+    if (num == 2) {
+        if (   tokens[0][1] - tokens[0][0] != 3
+            || memcmp(tokens[0][0], "GET", 3)) {
+            set_parse_error("request", "Invalid method on HTTP/0.9 request");
+            return NULL;
+        }
+        if (!(protocol = Py_BuildValue("(ii)", 0, 9)))
+            return NULL;
+        if (!(headers = PyDict_New()))
+            goto error;
+        hend = end + 1;
+    }
+    else if (num == 3) {
+        if (!(protocol = parse_protocol(tokens[2][0], tokens[2][1]))) {
+            if (!PyErr_Occurred())
+                set_parse_error("request", "Invalid protocol string");
+            return NULL;
+        }
+
+        /* find the empty line */
+        cur = end;
+        for (;;) {
+            if (cur + 1 < sentinel && cur[1] == '\n') {
+                hend = cur + 2;
+                break;
+            }
+            if (cur + 2 < sentinel && cur[1] == '\r' && cur[2] == '\n') {
+                hend = cur + 3;
+                break;
+            }
+            if (!(cur = memchr(cur + 1, '\n', (size_t)(sentinel - cur - 1)))) {
+                Py_DECREF(protocol);
+                Py_RETURN_NONE;
+            }
+        }
+        if (!(headers = parse_headers(end + 1, cur)))
+            goto error;
+    }
+    else {
+        set_parse_error("request", "Request line format not recognized");
+        return NULL;
+    }
+
+    if (!(method = PyString_FromStringAndSize(tokens[0][0],
+                                              tokens[0][1] - tokens[0][0])))
+        goto error_headers;
+    if (!(url = PyString_FromStringAndSize(tokens[1][0],
+                                           tokens[1][1] - tokens[1][0])))
+        goto error_headers;
+
+    result = Py_BuildValue("(OOOOn)", method, url, protocol, headers,
+                           (Py_ssize_t)(hend - data));
+
+error_headers:
+    Py_DECREF(headers);
+error:
+    Py_XDECREF(url);
+    Py_XDECREF(method);
+    Py_DECREF(protocol);
+    return result;
+}
+
+/* -------------------------- END GLOBAL FUNCTIONS ------------------------- */
+
+/* ------------------------ BEGIN MODULE DEFINITION ------------------------ */
+
+EXT_METHODS = {
+    {"parse_head",
+        (PyCFunction)wtf_parse_head, METH_KEYWORDS,
+        wtf_parse_head__doc__},
+
+    {NULL}  /* Sentinel */
+};
+
+PyDoc_STRVAR(EXT_DOCS_VAR,
+"C implementations of HTTP parsers\n\
+=================================\n\
+\n\
+This module provides a speedy HTTP request parser for WTF.");
+
+
+#define INIT_PYSTRING(NAME, VALUE) do {                \
+    if (!NAME && !(NAME = PyString_FromString(VALUE))) \
+        return;                                        \
+} while (0)
+
+#define ADD_STRING(MODULE, NAME, STRING) do {                 \
+    if (PyModule_AddStringConstant(MODULE, NAME, STRING) < 0) \
+        return;                                               \
+} while (0)
+
+EXT_INIT_FUNC {
+    PyObject *m;
+
+    /* Init static objects */
+    INIT_PYSTRING(spacestring, " ");
+    INIT_PYSTRING(commastring, ", ");
+
+    /* Create the module and populate stuff */
+    if (!(m = Py_InitModule3(EXT_MODULE_NAME, EXT_METHODS_VAR, EXT_DOCS_VAR)))
+        return;
+
+    ADD_STRING(m, "__author__", "Andr Malo");
+    ADD_STRING(m, "__docformat__", "restructuredtext en");
+}
+
+/* ------------------------- END MODULE DEFINITION ------------------------- */
@@ -35,6 +35,7 @@ __docformat__ = "restructuredtext en"
 
 import datetime as _datetime
 import re as _re
+import time as _time
 
 from wtf import Error
 
@@ -86,6 +87,25 @@ make_date.months = (None, # pylint: disable = W0612
 )
 
 
+def current_date():
+    """
+    Make a HTTP date of the current time
+
+    The string is computed once per second and shared between all threads.
+
+    :return: The HTTP date string
+    :rtype: ``str``
+    """
+    self, now = current_date, int(_time.time())
+    stamp, date = self.cache # pylint: disable = E1101
+    if stamp != now:
+        date = make_date(_datetime.datetime.utcfromtimestamp(now))
+        # replaced as a whole, so readers always see a consistent pair
+        self.cache = now, date
+    return date
+current_date.cache = (None, None) # pylint: disable = W0612
+
+
 def read_headers(stream):
     """
     Read MIME headers from stream
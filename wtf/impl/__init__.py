@@ -62,6 +62,26 @@ class ServerInterface(object):
          - `flags`: `FlagsInterface`
         """
 
+    def shed(self, accepted, flags, retry_after):
+        """
+        Reject an accepted socket because of overload
+
+        The request is answered with ``503 Service Unavailable`` (and a
+        ``Retry-After`` header) without running the application.
+
+        :Parameters:
+         - `accepted`: The accepted socket, being a tuple of socket object and
+           peername
+         - `flags`: Worker flags
+         - `retry_after`: Number of seconds the client should wait before
+           trying again
+
+        :Types:
+         - `accepted`: ``tuple``
+         - `flags`: `FlagsInterface`
+         - `retry_after`: ``int``
+        """
+
 
 class FlagsInterface(object):
     """
@@ -86,6 +106,39 @@ class FlagsInterface(object):
         :rtype: ``bool``
         """
 
+    def park(self, accepted, timeout):
+        """
+        Hand over an idle keep-alive connection to the worker
+
+        If the worker takes over the connection, it's handed back to the
+        implementation's ``handle`` method (like a freshly accepted socket)
+        as soon as there's data to read. If no data arrives within
+        `timeout`, the connection is closed.
+
+        :Parameters:
+         - `accepted`: The connection socket and the peername
+         - `timeout`: Keep-alive timeout in seconds
+
+        :Types:
+         - `accepted`: ``tuple``
+         - `timeout`: ``float``
+
+        :return: Was the connection taken over? If ``False``, the caller
+                 remains responsible for the connection.
+        :rtype: ``bool``
+        """
+
+    def status(self):
+        """
+        Retrieve the worker status
+
+        The contents are up to the worker model. The threaded models report
+        the threadpool state (including the autoscaling decisions).
+
+        :return: The status or ``None`` if not available
+        :rtype: ``dict``
+        """
+
 
 def factory(config, opts, args):
     """
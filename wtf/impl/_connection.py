@@ -89,26 +89,44 @@ class Connection(object):
             finally:
                 sock.close()
 
+    def detach(self):
+        """
+        Detach the socket from the connection
+
+        The connection is closed afterwards, but the socket is left alone.
+
+        :return: The socket
+        :rtype: ``socket.socket``
+        """
+        sock, self._sock = self._sock, None
+        return sock
+
     def reader(self):
         """
         Create a new reading stream for the socket
 
+        Closing the stream does not touch the socket (it may be kept alive).
+        The socket is shut down by `close`.
+
         :return: reading stream
         :rtype: ``file``
         """
         return _stream.GenericStream(_stream.MinimalSocketStream(
-            self._sock, _socket.SHUT_RD
+            _StreamSocket(self._sock)
         ))
 
     def writer(self):
         """
         Create a new writing stream for the socket
 
+        Closing the stream does not touch the socket (it may be kept alive).
+        The socket is shut down by `close`.
+
         :return: writing stream
         :rtype: ``file``
         """
         return _stream.GenericStream(_stream.MinimalSocketStream(
-            self._sock, _socket.SHUT_WR
+            _StreamSocket(self._sock)
         ))
 
     def settimeout(self, timeout):
@@ -124,3 +142,70 @@ class Connection(object):
         if timeout is not None:
             timeout = float(timeout)
         self._sock.settimeout(timeout)
+
+    def cork(self, flag=True):
+        """
+        Cork or uncork the socket
+
+        While the socket is corked, partial frames are held back, so
+        separately written response parts are coalesced.
+
+        :Parameters:
+         - `flag`: Cork or uncork?
+
+        :Types:
+         - `flag`: ``bool``
+        """
+        _osutil.cork(self._sock, flag)
+
+    def gettimeout(self):
+        """
+        Determine the current socket timeout
+
+        :return: The socket timeout (or ``None``)
+        :rtype: ``float``
+        """
+        return self._sock.gettimeout()
+
+
+class _StreamSocket(object):
+    """
+    Socket wrapper for connection streams
+
+    The wrapper delegates everything to the actual socket, except
+    ``close``, which is a no-op.
+
+    :IVariables:
+     - `_sock`: The actual socket
+
+    :Types:
+     - `_sock`: ``socket.socket``
+    """
+
+    def __init__(self, sock):
+        """
+        Initialization
+
+        :Parameters:
+         - `sock`: The actual socket
+
+        :Types:
+         - `sock`: ``socket.socket``
+        """
+        self._sock = sock
+
+    def __getattr__(self, name):
+        """
+        Delegate all undefined symbol requests to the real socket
+
+        :Parameters:
+         - `name`: The symbol to look up
+
+        :Types:
+         - `name`: ``str``
+        """
+        return getattr(self._sock, name)
+
+    def close(self):
+        """ Leave the socket open """
+        pass
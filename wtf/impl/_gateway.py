@@ -23,11 +23,16 @@ Here's the gateway implemented.
 __author__ = u"Andr\xe9 Malo"
 __docformat__ = "restructuredtext en"
 
+import errno as _errno
 import os as _os
+import select as _select
+import socket as _socket
+import stat as _stat
 import sys as _sys
 import traceback as _traceback
 
 from wtf import Error
+from wtf import osutil as _osutil
 from wtf.util import Property
 
 
@@ -40,6 +45,9 @@ class ResponseNotStarted(GatewayError):
 class ResponseAlreadyStarted(GatewayError):
     """ The response was already started """
 
+class IncompleteFile(GatewayError):
+    """ The file ended before the announced content length was sent """
+
 
 class Gateway(object):
     """
@@ -49,13 +57,17 @@ class Gateway(object):
      - `config`: Configuration
      - `opts`: Command line options
      - `args`: Positioned command line arguments
-     - `_baseenv`: Base environment (``((key, value), ...)``)
+     - `response_buffer`: Maximum number of octets of a response held
+       back in order to determine its length (0 = only single chunk
+       responses)
+     - `_baseenv`: Base environment (must not be modified)
 
     :Types:
      - `config`: `wtf.config.Config`
      - `opts`: ``optparse.OptionContainer``
      - `args`: ``list``
-     - `_baseenv`: ``tuple``
+     - `response_buffer`: ``int``
+     - `_baseenv`: ``dict``
     """
 
     def __init__(self, config, opts, args):
@@ -73,6 +85,11 @@ class Gateway(object):
          - `args`: ``list``
         """
         self.config, self.opts, self.args = config, opts, args
+        self.response_buffer = 0
+        if 'response' in config.wtf:
+            self.response_buffer = max(0,
+                int(config.wtf.response('buffer', 0))
+            )
         # populate from os environment, but don't pollute with gateway stuff
         base_env = dict((key, value) for key, value in _os.environ.iteritems()
             if not key.startswith('HTTP_')
@@ -81,11 +98,12 @@ class Gateway(object):
         base_env.update({
             'wsgi.version': (1, 0),
             'wsgi.errors': _sys.stderr,
+            'wsgi.file_wrapper': FileWrapper,
         })
         # base_env is used by every request. To make it thread safe,
-        # we need it shallow-copied for every request - making it
-        # readonly is the best way to ensure that.
-        self._baseenv = tuple(self._populate_base_env(base_env).iteritems())
+        # it's shallow-copied for every request (dict.copy is the cheapest
+        # way) and never modified afterwards.
+        self._baseenv = dict(self._populate_base_env(base_env))
 
     def _populate_base_env(self, base_env):
         """
@@ -120,10 +138,17 @@ class Gateway(object):
          - `request`: any
          - `application`: ``callable``
         """
-        environ = dict(self._baseenv)
         renv, start_response = self._init_from_request(connection, request)
-        environ.update(renv)
+        if isinstance(renv, LazyEnviron):
+            environ = LazyEnviron(self._baseenv, renv.deferred)
+        else:
+            environ = self._baseenv.copy()
+        dict.update(environ, renv)
         responder = ResponseStarter(start_response)
+        if self.response_buffer and 'wtf.response.flush' in environ:
+            environ['wtf.response.flush'] = _releasing_flush(
+                environ['wtf.response.flush'], responder
+            )
         iterator = application(environ, responder)
         try:
             close = iterator.close
@@ -131,28 +156,36 @@ class Gateway(object):
             close = lambda: None
 
         try:
-            # Try determining content length
+            if isinstance(iterator, FileWrapper) and \
+                    self._send_file(connection, request, responder, iterator):
+                iterator = ()
+
+            # Try determining content length by holding back the first
+            # chunks (at least one) up to the buffer size
             if not responder.started:
                 iterator = iter(iterator)
-                try:
-                    chunk = iterator.next()
-                except StopIteration:
-                    # we could say Content-Length: 0, but there might be
-                    # a reason not to (like body-less responses)
-                    chunk, ilen = "", -1
-                else:
+                size, count, done = 0, 0, False
+                while not responder.started:
                     try:
-                        ilen = len(iterator)
-                    except TypeError: # unsized object
-                        ilen = -1
-                if ilen == 0 and not responder.started:
+                        chunk = iterator.next()
+                    except StopIteration:
+                        # we could say Content-Length: 0, but there might be
+                        # a reason not to (like body-less responses)
+                        done = count > 0
+                        break
+                    responder.hold(chunk)
+                    size, count = size + len(chunk), count + 1
+                    if size > self.response_buffer:
+                        done = _remaining(iterator) == 0
+                        break
+                if done and not responder.started:
                     have_length = 'content-length' in [key.lower()
                         for key, _ in responder.headers]
                     if not have_length:
                         responder.headers.append(
-                            ('Content-Length', str(len(chunk)))
+                            ('Content-Length', str(size))
                         )
-                responder.write(chunk)
+                responder.release()
             # Pump out
             for chunk in iterator:
                 if chunk:
@@ -178,12 +211,381 @@ class Gateway(object):
          - `connection`: `Connection`
          - `request`: any
 
+        The request env may be a `LazyEnviron` instance, in which case
+        its deferred variables are carried over to the final environment.
+
         :return: A tuple of the request env and a specific response starter
                  (```(dict, callable)``)
         :rtype: ``dict``
         """
         raise NotImplementedError()
 
+    def _file_stream(self, request):
+        """
+        Determine the raw connection stream for sending a file
+
+        The stream is asked after the response was started. Subclasses
+        return the stream writing directly to the connection socket, if
+        the response body may be sent untouched. By default this method
+        returns ``None``.
+
+        :Parameters:
+         - `request`: The request instance
+
+        :Types:
+         - `request`: any
+
+        :return: The stream or ``None`` (if the file must be iterated)
+        :rtype: `wtf.stream.GenericStream`
+        """
+        # pylint: disable = W0613
+
+        return None
+
+    def _send_file(self, connection, request, responder, wrapper):
+        """
+        Send a ``wsgi.file_wrapper`` response with ``sendfile(2)``
+
+        The file is sent from its current position up to its end (or the
+        content length supplied by the application). If the Content-Length
+        header is missing, it's added.
+
+        :Parameters:
+         - `connection`: The connection the request is handled on
+         - `request`: The request instance
+         - `responder`: The response starter
+         - `wrapper`: The file wrapper returned by the application
+
+        :Types:
+         - `connection`: `Connection`
+         - `request`: any
+         - `responder`: `ResponseStarter`
+         - `wrapper`: `FileWrapper`
+
+        :return: Was the file sent? If not, the wrapper needs to be
+                 iterated as usual.
+        :rtype: ``bool``
+
+        :Exceptions:
+         - `IncompleteFile`: The file was shorter than announced
+        """
+        if responder.started or responder.write == responder.write_initial:
+            return False
+        fileno = wrapper.fileno()
+        if fileno is None:
+            return False
+        try:
+            offset = wrapper.filelike.tell()
+            stat = _os.fstat(fileno)
+        except (AttributeError, IOError, OSError):
+            return False
+        if not _stat.S_ISREG(stat.st_mode):
+            return False
+
+        count = length = max(0, stat.st_size - offset)
+        for key, value in responder.headers:
+            if key.lower() == 'content-length':
+                try:
+                    length = int(value)
+                except ValueError:
+                    return False
+                count = min(count, length)
+                break
+        else:
+            responder.headers.append(('Content-Length', str(count)))
+        wrapper.limit = count
+        responder.write_headers("", True)
+        stream = self._file_stream(request)
+        if stream is None:
+            return False
+
+        stream.flush()
+        out_fd, timeout, sent = stream.fileno(), connection.gettimeout(), 0
+        if timeout is not None:
+            timeout = int(timeout * 1000)
+        while sent < count:
+            try:
+                result = _osutil.sendfile(
+                    out_fd, fileno, offset + sent, count - sent
+                )
+            except NotImplementedError:
+                if sent:
+                    raise
+                return False
+            except OSError, e:
+                if e.errno == _errno.EINTR:
+                    continue
+                elif e.errno != _errno.EAGAIN:
+                    raise _socket.error(e.errno, e.strerror)
+                # the socket is non-blocking, if there's a timeout
+                poll = _select.poll()
+                poll.register(out_fd, _select.POLLOUT)
+                if not poll.poll(timeout):
+                    raise _socket.timeout("timed out")
+                continue
+            if not result:
+                break
+            sent += result
+        if sent < length:
+            raise IncompleteFile(
+                "File ended after %d of %d bytes" % (sent, length)
+            )
+        return True
+
+
+def _remaining(iterator):
+    """
+    Determine the number of items left in an iterator
+
+    Only lengths known for sure are reported (``len`` of the iterator or
+    the length hint of list and tuple iterators).
+
+    :Parameters:
+     - `iterator`: The iterator
+
+    :Types:
+     - `iterator`: ``iterator``
+
+    :return: The number of items or ``-1`` if it's unknown
+    :rtype: ``int``
+    """
+    try:
+        return len(iterator)
+    except TypeError: # unsized object
+        if type(iterator) in _EXACT_HINTS:
+            return iterator.__length_hint__()
+    return -1
+
+_EXACT_HINTS = tuple([typ for typ in (type(iter([])), type(iter(())))
+    if hasattr(typ, '__length_hint__')])
+
+
+def _releasing_flush(flush, responder):
+    """
+    Wrap the ``wtf.response.flush`` factory for response buffering
+
+    Flushing the response sends the data held back by the gateway first
+    (which starts the response and thereby ends the buffering).
+
+    :Parameters:
+     - `flush`: The flush factory provided by the implementation
+     - `responder`: The response starter
+
+    :Types:
+     - `flush`: ``callable``
+     - `responder`: `ResponseStarter`
+
+    :return: The wrapping flush factory
+    :rtype: ``callable``
+    """
+    def releasing_flush(response):
+        """ Response flush factory """
+        func = flush(response)
+        def flush_response():
+            """ Send the held back data, then flush """
+            responder.release()
+            func()
+        return flush_response
+    return releasing_flush
+
+
+_MISSING = object()
+
+class LazyEnviron(dict):
+    """
+    WSGI environment resolving some variables on first access
+
+    The deferred variables are provided by an object with two methods:
+    ``lookup(key)`` returns the value of a single deferred variable (or
+    ``None`` if there's no such variable) and ``load()`` returns a dict of
+    all of them.
+    Looked up variables are stored in the dict. Every operation which
+    needs to see the whole environment (iteration, ``len``, ``copy``,
+    comparison, deletion etc) loads the remaining ones first. Variables
+    already present are never overwritten by deferred ones.
+
+    The environment is a ``dict`` subclass (deliberately deviating from
+    WSGI, which asks for a plain ``dict``). Every ``dict`` method sees all
+    variables. Note that copying it via ``dict(environ)`` or
+    ``{}.update(environ)`` bypasses the methods and misses variables, which
+    were not resolved yet. Use ``environ.copy()`` instead.
+
+    :IVariables:
+     - `deferred`: The provider of the deferred variables (or ``None``
+       if they were loaded already)
+
+    :Types:
+     - `deferred`: any
+    """
+    deferred = None
+
+    def __init__(self, env, deferred):
+        """
+        Initialization
+
+        :Parameters:
+         - `env`: Initial variables
+         - `deferred`: Provider of the deferred variables
+
+        :Types:
+         - `env`: ``dict``
+         - `deferred`: any
+        """
+        dict.__init__(self, env)
+        self.deferred = deferred
+
+    def _resolve(self):
+        """ Load all remaining deferred variables """
+        deferred, self.deferred = self.deferred, None
+        if deferred is not None:
+            for key, value in deferred.load().iteritems():
+                if not dict.__contains__(self, key):
+                    dict.__setitem__(self, key, value)
+
+    def __missing__(self, key):
+        """ Look up a deferred variable """
+        if self.deferred is not None:
+            value = self.deferred.lookup(key)
+            if value is not None:
+                dict.__setitem__(self, key, value)
+                return value
+        raise KeyError(key)
+
+    if _sys.version_info < (2, 5):
+        def __getitem__(self, key):
+            """ Look up a variable (no __missing__ support) """
+            try:
+                return dict.__getitem__(self, key)
+            except KeyError:
+                return self.__missing__(key)
+
+    def get(self, key, default=None):
+        """ :See: ``dict.get`` """
+        value = dict.get(self, key, _MISSING)
+        if value is _MISSING:
+            if self.deferred is not None:
+                value = self.deferred.lookup(key)
+                if value is not None:
+                    dict.__setitem__(self, key, value)
+                    return value
+            return default
+        return value
+
+    def __contains__(self, key):
+        """ :See: ``dict.__contains__`` """
+        return self.get(key, _MISSING) is not _MISSING
+
+    def has_key(self, key):
+        """ :See: ``dict.has_key`` """
+        return self.__contains__(key)
+
+    def setdefault(self, key, default=None):
+        """ :See: ``dict.setdefault`` """
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            dict.__setitem__(self, key, default)
+            return default
+        return value
+
+    def _resolving(name): # pylint: disable = E0213
+        """ Create a method, which loads the deferred variables first """
+        method = getattr(dict, name)
+        def resolving(self, *args, **kwargs):
+            """ :See: ``dict`` """
+            if self.deferred is not None:
+                self._resolve() # pylint: disable = W0212
+            return method(self, *args, **kwargs)
+        resolving.__name__, resolving.__doc__ = name, method.__doc__
+        return resolving
+
+    for _name in """
+            __cmp__ __delitem__ __eq__ __ge__ __gt__ __iter__ __le__ __len__
+            __lt__ __ne__ __repr__ clear items iteritems iterkeys itervalues
+            keys pop popitem values viewitems viewkeys viewvalues
+            """.split():
+        if hasattr(dict, _name): # views are new in Python 2.7
+            locals()[_name] = _resolving(_name)
+    del _name, _resolving
+
+    def copy(self):
+        """ :See: ``dict.copy`` """
+        if self.deferred is not None:
+            self._resolve()
+        return dict(self)
+
+    def __reduce__(self):
+        """ Pickle as a plain dict """
+        return (dict, (self.copy(),))
+
+
+class FileWrapper(object):
+    """
+    ``wsgi.file_wrapper`` implementation
+
+    Iterating the wrapper delivers the file in blocks. The gateway
+    recognizes the wrapper and sends regular files via ``sendfile(2)``
+    instead, if possible.
+
+    :IVariables:
+     - `filelike`: The wrapped file
+     - `blksize`: Block size for iteration
+     - `limit`: Maximum number of bytes to deliver (or ``None``)
+
+    :Types:
+     - `filelike`: ``file``
+     - `blksize`: ``int``
+     - `limit`: ``int``
+    """
+    limit = None
+
+    def __init__(self, filelike, blksize=8192):
+        """
+        Initialization
+
+        :Parameters:
+         - `filelike`: The file to wrap
+         - `blksize`: Block size for iteration
+
+        :Types:
+         - `filelike`: ``file``
+         - `blksize`: ``int``
+        """
+        self.filelike, self.blksize = filelike, blksize
+
+    def __iter__(self):
+        """ Iterate over the file blocks """
+        read, blksize, limit = self.filelike.read, self.blksize, self.limit
+        while limit is None or limit > 0:
+            if limit is not None:
+                blksize = min(blksize, limit)
+            data = read(blksize)
+            if not data:
+                break
+            if limit is not None:
+                limit -= len(data)
+            yield data
+
+    def fileno(self):
+        """
+        Determine the file descriptor of the wrapped file
+
+        :return: The descriptor or ``None`` (if there's none)
+        :rtype: ``int``
+        """
+        try:
+            return self.filelike.fileno()
+        except (AttributeError, IOError, ValueError):
+            return None
+
+    def close(self):
+        """ Close the wrapped file (if possible) """
+        try:
+            close = self.filelike.close
+        except AttributeError:
+            pass
+        else:
+            close()
+
 
 class ResponseStarter(object):
     """
@@ -193,6 +595,7 @@ class ResponseStarter(object):
      - `_stream`: Response body stream
      - `_start_response`: Implementation defined response starter
      - `_response`: Status and headers supplied by the application
+     - `_held`: Data held back until the response is started
      - `write`: Current write callable
      - `started`: Flag indicating whether the response was started or not
 
@@ -200,6 +603,7 @@ class ResponseStarter(object):
      - `_stream`: ``file``
      - `_start_response`: ``callable``
      - `_response`: ``tuple``
+     - `_held`: ``list``
      - `write`: ``callable``
      - `started`: ``bool``
     """
@@ -218,6 +622,7 @@ class ResponseStarter(object):
          - `start_response`: ``callable``
         """
         self._start_response = start_response
+        self._held = []
         self.write = self.write_initial
 
     def __call__(self, status, headers, exc_info=None):
@@ -318,7 +723,8 @@ class ResponseStarter(object):
 
         This write callable initializes the response on the first real
         occurence of data. The ``write`` method will be set directly to
-        the stream's write method after response initialization.
+        the stream's write method after response initialization. Held back
+        data is sent first.
 
         :Parameters:
          - `data`: The data to write
@@ -329,6 +735,8 @@ class ResponseStarter(object):
          - `_do_init`: ``bool``
         """
         if self.write == self.write_headers:
+            if self._held:
+                data, self._held = ''.join(self._held) + data, []
             if data or _do_init:
                 self.started = True
                 self._stream = self._start_response(*self._response)
@@ -336,6 +744,27 @@ class ResponseStarter(object):
         if data:
             self.write(data)
 
+    def hold(self, data):
+        """
+        Hold back data until the response is started
+
+        The data is sent before the data of the next write call (or on
+        `release`).
+
+        :Parameters:
+         - `data`: The data to hold back
+
+        :Types:
+         - `data`: ``str``
+        """
+        self._held.append(data)
+
+    def release(self):
+        """ Send the held back data (if any) """
+        if self._held:
+            data, self._held = ''.join(self._held), []
+            self.write(data)
+
     def write_body(self, data):
         """
         Final write callable
@@ -21,6 +21,8 @@ Implementation utilities
 __author__ = u"Andr\xe9 Malo"
 __docformat__ = "restructuredtext en"
 
+import itertools as _it
+
 from wtf import stream as _stream
 
 
@@ -70,3 +72,79 @@ class ContentLengthReader(object):
             self._left -= len(result)
             return result
         return ""
+
+
+def uwsgi_vars(data):
+    """
+    Decode the variables block of an uwsgi request packet
+
+    The block consists of key/value pairs, each of them prefixed by its
+    length (16 bit little endian).
+
+    :Parameters:
+     - `data`: The variables block
+
+    :Types:
+     - `data`: ``str``
+
+    :return: The variables (``{'key': 'value', ...}``)
+    :rtype: ``dict``
+
+    :Exceptions:
+     - `ValueError`: The block is truncated
+    """
+    env, pos, end = {}, 0, len(data)
+    while pos < end:
+        if end - pos < 2:
+            raise ValueError("Truncated uwsgi variables block")
+        klen = ord(data[pos]) | ord(data[pos + 1]) << 8
+        kstart, pos = pos + 2, pos + 2 + klen
+        if end - pos < 2:
+            raise ValueError("Truncated uwsgi variables block")
+        vlen = ord(data[pos]) | ord(data[pos + 1]) << 8
+        vstart, pos = pos + 2, pos + 2 + vlen
+        if pos > end:
+            raise ValueError("Truncated uwsgi variables block")
+        env[data[kstart:vstart - 2]] = data[vstart:pos]
+    return env
+
+
+def scgi_environ(data):
+    """
+    Decode the header block of an SCGI request
+
+    The block (the netstring payload) consists of NUL terminated names and
+    values. ``CONTENT_LENGTH`` is required and must be a decimal number.
+
+    :Parameters:
+     - `data`: The header block
+
+    :Types:
+     - `data`: ``str``
+
+    :return: The environment and the content length
+             (``({'name': 'value', ...}, int)``)
+    :rtype: ``tuple``
+
+    :Exceptions:
+     - `ValueError`: The block is invalid or the content length is missing
+       or invalid
+    """
+    block = data.split('\0')
+    if block.pop() or len(block) % 2:
+        raise ValueError("Invalid SCGI header block")
+    block = iter(block)
+    env = dict(_it.izip(block, block))
+    clen = env.get('CONTENT_LENGTH')
+    if not clen or not clen.isdigit():
+        raise ValueError("Missing or invalid CONTENT_LENGTH")
+    return env, int(clen)
+
+
+from wtf import c_override
+cimpl = c_override('_wtf_cutil')
+if cimpl is not None:
+    # pylint: disable = E1103
+    uwsgi_vars = cimpl.uwsgi_vars
+    scgi_environ = cimpl.scgi_environ
+del c_override, cimpl
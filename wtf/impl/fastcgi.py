@@ -0,0 +1,916 @@
+# -*- coding: ascii -*-
+#
+# Copyright 2007-2012
+# Andr\xe9 Malo or his licensors, as applicable
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+FastCGI Implementation
+======================
+
+Here's the FastCGI (responder role) handling implemented.
+
+Connections are kept open if the webserver asks for it (``FCGI_KEEP_CONN``),
+so it can send request after request over the same connection. Requests
+multiplexed over one connection are accepted (up to a configurable
+number) and processed one after the other by the worker handling the
+connection. Records of requests waiting for their turn are buffered
+meanwhile.
+
+Requests aborted by the webserver (``FCGI_ABORT_REQUEST``) are ended right
+away. If the request is already running, further output is dropped and
+reading the request body raises `RequestAborted`.
+"""
+__author__ = u"Andr\xe9 Malo"
+__docformat__ = "restructuredtext en"
+
+import errno as _errno
+import socket as _socket
+import struct as _struct
+import sys as _sys
+import traceback as _traceback
+
+from wtf import Error
+from wtf import impl as _impl
+from wtf import stream as _stream
+from wtf.impl import _connection
+from wtf.impl import _gateway
+from wtf.util import Property
+
+#: FastCGI protocol version
+#:
+#: :Type: ``int``
+FCGI_VERSION_1 = 1
+
+#: Record types
+FCGI_BEGIN_REQUEST = 1
+FCGI_ABORT_REQUEST = 2
+FCGI_END_REQUEST = 3
+FCGI_PARAMS = 4
+FCGI_STDIN = 5
+FCGI_STDOUT = 6
+FCGI_STDERR = 7
+FCGI_DATA = 8
+FCGI_GET_VALUES = 9
+FCGI_GET_VALUES_RESULT = 10
+FCGI_UNKNOWN_TYPE = 11
+
+#: Roles
+FCGI_RESPONDER = 1
+
+#: Request flags
+FCGI_KEEP_CONN = 1
+
+#: Protocol status codes
+FCGI_REQUEST_COMPLETE = 0
+FCGI_CANT_MPX_CONN = 1
+FCGI_OVERLOADED = 2
+FCGI_UNKNOWN_ROLE = 3
+
+#: Maximum record content length
+#:
+#: :Type: ``int``
+FCGI_MAX_CONTENT = 65535
+
+_HEADER, _HEADER_SIZE = '!BBHHBx', 8
+_BEGIN_BODY, _BEGIN_BODY_SIZE = '!HB5x', 8
+_END_BODY = '!LB3x'
+_UNKNOWN_BODY = '!B7x'
+
+
+class FastCGIError(Error):
+    """ FastCGI protocol error """
+
+
+class RequestAborted(Error):
+    """ The request was aborted by the webserver """
+
+
+class FastCGIServer(object):
+    """
+    FastCGI server
+
+    :CVariables:
+     - `_OVERLOADED`: Message of the overload response
+     - `_SHED_TIMEOUT`: Socket timeout while rejecting a request in seconds
+
+    :IVariables:
+     - `config`: Configuration
+     - `opts`: Command line options
+     - `args`: Positioned command line arguments
+     - `max_requests`: Maximum number of requests per connection at the
+       same time (``1`` = no multiplexing)
+     - `keep_alive`: Time in seconds an idle kept connection is waited on
+     - `parking`: Hand over idle kept connections to the worker?
+
+    :Types:
+     - `_OVERLOADED`: ``str``
+     - `_SHED_TIMEOUT`: ``float``
+     - `config`: `wtf.config.Config`
+     - `opts`: ``optparse.OptionContainer``
+     - `args`: ``list``
+     - `max_requests`: ``int``
+     - `keep_alive`: ``float``
+     - `parking`: ``bool``
+    """
+    __implements__ = [_impl.ServerInterface]
+    _OVERLOADED = (
+        "The server is too busy to process the request right now. "
+        "Please try again later."
+    )
+    _SHED_TIMEOUT = 5.0
+
+    def __init__(self, config, opts, args):
+        """
+        Initialization
+
+        :See: `wtf.impl.ServerInterface`
+        """
+        self.config, self.opts, self.args = config, opts, args
+        self.max_requests, self.keep_alive = 10, 60.0
+        if 'fastcgi' in config.wtf:
+            self.max_requests = max(1, min(FCGI_MAX_CONTENT,
+                int(config.wtf.fastcgi('max_requests', self.max_requests))
+            ))
+            self.keep_alive = float(
+                config.wtf.fastcgi('keep-alive', self.keep_alive)
+            )
+            if self.keep_alive <= 0:
+                raise ValueError("FastCGI keep-alive timeout must be > 0")
+        self.parking = bool(config.wtf('parking', False))
+        self._gateway = Gateway(config, opts, args)
+
+    def handle(self, (sock, peername), application, flags):
+        """
+        Handle an accepted socket
+
+        :See: `wtf.impl.ServerInterface`
+        """
+        conn = _connection.Connection(sock, peername)
+        fcgi = None
+        try:
+            fcgi = FastCGIConnection(self, conn)
+            while True:
+                try:
+                    request = fcgi.next_request(flags)
+                except _socket.error, e:
+                    if e[0] not in (_errno.EPIPE, _errno.ECONNRESET):
+                        raise
+                    break
+                if request is None:
+                    break
+                try:
+                    try:
+                        self._gateway.handle(conn, request, application)
+                    except _socket.error, e:
+                        if e[0] not in (_errno.EPIPE, _errno.ECONNRESET):
+                            raise
+                        print >> _sys.stderr, "Connection to webserver died."
+                        break
+                    except RequestAborted:
+                        pass
+                    except (SystemExit, KeyboardInterrupt):
+                        raise
+                    except:
+                        if not request.response_started:
+                            try:
+                                request.error(
+                                    "500 Internal Server Error",
+                                    "Something went wrong while processing "
+                                    "the request. You might want to try "
+                                    "again later. Sorry for the "
+                                    "inconvenience."
+                                )
+                            except _socket.error:
+                                pass
+                        print >> _sys.stderr, \
+                            "Request aborted due to exception:\n" + ''.join(
+                                _traceback.format_exception(*_sys.exc_info())
+                            )
+                finally:
+                    try:
+                        request.close()
+                    except _socket.error, e:
+                        if e[0] not in (_errno.EPIPE, _errno.ECONNRESET):
+                            raise
+                        request.keep_conn = False
+                if not request.keep_conn:
+                    break
+                if flags.shutdown():
+                    fcgi.closing = True
+                    if fcgi.idle:
+                        break
+                # Requests, which are ready or already buffered, are handled
+                # right away. Their responses are sent together.
+                if fcgi.ready or fcgi.reader.buffered:
+                    continue
+                try:
+                    fcgi.writer.flush()
+                except _socket.error, e:
+                    if e[0] not in (_errno.EPIPE, _errno.ECONNRESET):
+                        raise
+                    break
+                if self.parking and fcgi.idle:
+                    fcgi, sock = None, conn.detach()
+                    if flags.park((sock, peername), self.keep_alive):
+                        break
+                    conn = _connection.Connection(sock, peername)
+                    fcgi = FastCGIConnection(self, conn)
+        finally:
+            try:
+                try:
+                    if fcgi is not None:
+                        fcgi.close()
+                finally:
+                    conn.close()
+            except (SystemExit, KeyboardInterrupt):
+                raise
+            except:
+                pass # nothing we could do here anyway, maybe log it?
+
+    def shed(self, (sock, peername), flags, retry_after):
+        """
+        Reject an accepted socket because of overload
+
+        The first request's parameters are read (so the webserver actually
+        receives the response), the body is not.
+
+        :See: `wtf.impl.ServerInterface`
+        """
+        conn = _connection.Connection(sock, peername)
+        try:
+            fcgi = FastCGIConnection(self, conn, self._SHED_TIMEOUT)
+            try:
+                try:
+                    request = fcgi.next_request(flags, self._SHED_TIMEOUT)
+                    if request is not None:
+                        request.error(
+                            "503 Service Unavailable", self._OVERLOADED,
+                            [("Retry-After", str(retry_after))]
+                        )
+                        request.close()
+                except (FastCGIError, _socket.error):
+                    pass
+            finally:
+                fcgi.close()
+        finally:
+            try:
+                conn.close()
+            except (SystemExit, KeyboardInterrupt):
+                raise
+            except:
+                pass
+
+
+class Gateway(_gateway.Gateway):
+    """ FastCGI implementation specific gateway """
+
+    def _init_from_request(self, connection, request):
+        """
+        Create FastCGI implementation specific request environment
+
+        :See: `_gateway.Gateway._init_from_request`
+        """
+        environ = request.environ
+        if environ.get('HTTPS', '').lower() == 'on':
+            scheme = 'https'
+        else:
+            scheme = 'http'
+        environ.update({
+            'wsgi.multithread':  request.flags.multithread,
+            'wsgi.multiprocess': request.flags.multiprocess,
+            'wsgi.run_once':     request.flags.run_once,
+            'wtf.worker.status': request.flags.status,
+            'wsgi.input':        request.request_body_stream,
+            'wsgi.url_scheme':   scheme,
+        })
+        return environ, request.start_response
+
+
+class FastCGIConnection(object):
+    """
+    FastCGI connection
+
+    The connection reads the records and dispatches them to the requests.
+
+    :IVariables:
+     - `reader`: Connection read stream
+     - `writer`: Connection write stream
+     - `closing`: Reject new requests?
+     - `_server`: Server instance
+     - `_connection`: Socket connection
+     - `_requests`: Active requests (``{id: FastCGIRequest, ...}``)
+     - `_ready`: Requests ready to run (parameters complete)
+     - `_busy_timeout`: Socket timeout while requests are in flight
+     - `_timeout`: Current socket timeout
+
+    :Types:
+     - `reader`: `stream.GenericStream`
+     - `writer`: `stream.GenericStream`
+     - `closing`: ``bool``
+     - `_server`: `FastCGIServer`
+     - `_connection`: `Connection`
+     - `_requests`: ``dict``
+     - `_ready`: ``list``
+     - `_busy_timeout`: ``float``
+     - `_timeout`: ``float``
+    """
+    closing, _timeout = False, -1
+
+    def __init__(self, server, connection, timeout=None):
+        """
+        Initialization
+
+        :Parameters:
+         - `server`: Server instance
+         - `connection`: Socket connection
+         - `timeout`: Socket timeout while requests are in flight
+
+        :Types:
+         - `server`: `FastCGIServer`
+         - `connection`: `Connection`
+         - `timeout`: ``float``
+        """
+        self._server, self._connection = server, connection
+        self._busy_timeout = timeout
+        self.reader = connection.reader()
+        self.writer = connection.writer()
+        self._requests, self._ready = {}, []
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        """ Close the streams (pending output is flushed) """
+        try:
+            reader, self.reader = self.reader, None
+            if reader is not None:
+                reader.close()
+        finally:
+            writer, self.writer = self.writer, None
+            if writer is not None:
+                writer.close()
+
+    @Property
+    def idle():
+        """
+        Is there no request in flight?
+
+        :Type: ``bool``
+        """
+        # pylint: disable = E0211, C0111, W0212, W0612
+
+        def fget(self):
+            return not self._requests
+        return locals()
+
+    @Property
+    def ready():
+        """
+        Is a request ready to run?
+
+        :Type: ``bool``
+        """
+        # pylint: disable = E0211, C0111, W0212, W0612
+
+        def fget(self):
+            return bool(self._ready)
+        return locals()
+
+    def next_request(self, flags, timeout=None):
+        """
+        Read records until a request is ready to run
+
+        :Parameters:
+         - `flags`: Worker flags
+         - `timeout`: Socket timeout while no request is in flight (if
+           ``None``, the server's keep-alive timeout is applied)
+
+        :Types:
+         - `flags`: `FlagsInterface`
+         - `timeout`: ``float``
+
+        :return: The request or ``None`` if the connection is done
+        :rtype: `FastCGIRequest`
+
+        :Exceptions:
+         - `FastCGIError`: Protocol error
+        """
+        if timeout is None:
+            timeout = self._server.keep_alive
+        while not self._ready:
+            if self._requests:
+                self._settimeout(self._busy_timeout)
+            else:
+                self._settimeout(timeout)
+            try:
+                if not self.process_record():
+                    return None
+            except _socket.timeout:
+                if self._requests:
+                    raise
+                return None
+        self._settimeout(self._busy_timeout)
+        request = self._ready.pop(0)
+        request.flags = flags
+        return request
+
+    def _settimeout(self, timeout):
+        """ Set the socket timeout (if changed) """
+        if timeout != self._timeout:
+            self._connection.settimeout(timeout)
+            self._timeout = timeout
+
+    def process_record(self):
+        """
+        Read and dispatch the next record
+
+        :return: Was a record read? (``False`` on EOF)
+        :rtype: ``bool``
+
+        :Exceptions:
+         - `FastCGIError`: Protocol error
+        """
+        read = self.reader.read_exact
+        header = read(_HEADER_SIZE)
+        if not header:
+            return False
+        elif len(header) < _HEADER_SIZE:
+            raise FastCGIError("Truncated record header")
+        version, rtype, rid, clen, plen = _struct.unpack(_HEADER, header)
+        if version != FCGI_VERSION_1:
+            raise FastCGIError("Unsupported FastCGI version %d" % version)
+        content = clen and read(clen) or ''
+        if len(content) < clen or (plen and len(read(plen)) < plen):
+            raise FastCGIError("Truncated record")
+
+        if not rid:
+            if rtype == FCGI_GET_VALUES:
+                self._get_values(content)
+            else:
+                self.write_record(
+                    FCGI_UNKNOWN_TYPE, 0, _struct.pack(_UNKNOWN_BODY, rtype)
+                )
+            self.writer.flush()
+        elif rtype == FCGI_BEGIN_REQUEST:
+            self._begin_request(rid, content)
+        else:
+            request = self._requests.get(rid)
+            if request is None:
+                pass # finished or rejected request. ignore.
+            elif rtype == FCGI_STDIN:
+                request.add_stdin(content)
+            elif rtype == FCGI_PARAMS:
+                if request.add_params(content):
+                    self._ready.append(request)
+            elif rtype == FCGI_ABORT_REQUEST:
+                if request.environ is None or request in self._ready:
+                    if request in self._ready:
+                        self._ready.remove(request)
+                    self.end_request(rid)
+                    self.writer.flush()
+                else:
+                    request.abort()
+        return True
+
+    def _begin_request(self, rid, content):
+        """
+        Start a new request
+
+        :Parameters:
+         - `rid`: Request ID
+         - `content`: Record content
+
+        :Types:
+         - `rid`: ``int``
+         - `content`: ``str``
+        """
+        if rid in self._requests or len(content) < _BEGIN_BODY_SIZE:
+            return # protocol violation. ignore.
+        role, flags = _struct.unpack(
+            _BEGIN_BODY, content[:_BEGIN_BODY_SIZE]
+        )
+        if role != FCGI_RESPONDER:
+            status = FCGI_UNKNOWN_ROLE
+        elif self._server.max_requests == 1 and self._requests:
+            status = FCGI_CANT_MPX_CONN
+        elif self.closing or len(self._requests) >= self._server.max_requests:
+            status = FCGI_OVERLOADED
+        else:
+            self._requests[rid] = FastCGIRequest(
+                self, rid, bool(flags & FCGI_KEEP_CONN)
+            )
+            return
+        self.write_record(FCGI_END_REQUEST, rid,
+            _struct.pack(_END_BODY, 0, status)
+        )
+        self.writer.flush()
+
+    def _get_values(self, content):
+        """
+        Answer a ``FCGI_GET_VALUES`` record
+
+        :Parameters:
+         - `content`: Record content
+
+        :Types:
+         - `content`: ``str``
+        """
+        max_requests = self._server.max_requests
+        known = {
+            'FCGI_MAX_REQS': str(max_requests),
+            'FCGI_MPXS_CONNS': max_requests > 1 and '1' or '0',
+        }
+        self.write_record(FCGI_GET_VALUES_RESULT, 0, encode_pairs([
+            (name, known[name]) for name, _ in decode_pairs(content)
+            if name in known
+        ]))
+
+    def write_record(self, rtype, rid, content):
+        """
+        Write a record
+
+        :Parameters:
+         - `rtype`: Record type
+         - `rid`: Request ID
+         - `content`: Record content (must fit into a single record)
+
+        :Types:
+         - `rtype`: ``int``
+         - `rid`: ``int``
+         - `content`: ``str``
+        """
+        self.writer.write(
+            _struct.pack(_HEADER, FCGI_VERSION_1, rtype, rid, len(content), 0)
+            + content
+        )
+
+    def end_request(self, rid):
+        """
+        Finish a request
+
+        The stdout stream is terminated and the request is ended.
+
+        :Parameters:
+         - `rid`: Request ID
+
+        :Types:
+         - `rid`: ``int``
+        """
+        self._requests.pop(rid, None)
+        self.write_record(FCGI_STDOUT, rid, '')
+        self.write_record(FCGI_END_REQUEST, rid,
+            _struct.pack(_END_BODY, 0, FCGI_REQUEST_COMPLETE)
+        )
+
+
+class FastCGIRequest(object):
+    """
+    FastCGI Request abstraction
+
+    :IVariables:
+     - `id`: Request ID
+     - `keep_conn`: Keep the connection open after the request?
+     - `aborted`: Was the request aborted by the webserver while running?
+     - `environ`: Request parameters (complete after the request got
+       ready)
+     - `request_body_stream`: Request body stream
+     - `flags`: Worker flags (set when the request is run)
+     - `_connection`: FastCGI connection
+     - `_params`: Collected parameter records (or ``None`` if complete)
+     - `_stdin`: Buffered stdin data
+     - `_stdin_done`: Was the end of stdin received?
+
+    :Types:
+     - `id`: ``int``
+     - `keep_conn`: ``bool``
+     - `aborted`: ``bool``
+     - `environ`: ``dict``
+     - `request_body_stream`: `stream.GenericStream`
+     - `flags`: `FlagsInterface`
+     - `_connection`: `FastCGIConnection`
+     - `_params`: ``list``
+     - `_stdin`: ``list``
+     - `_stdin_done`: ``bool``
+    """
+    aborted, response_started, _stdin_done = False, False, False
+    _response_body_stream, environ, flags = None, None, None
+
+    def __init__(self, connection, rid, keep_conn):
+        """
+        Initialization
+
+        :Parameters:
+         - `connection`: FastCGI connection
+         - `rid`: Request ID
+         - `keep_conn`: Keep the connection open after the request?
+
+        :Types:
+         - `connection`: `FastCGIConnection`
+         - `rid`: ``int``
+         - `keep_conn`: ``bool``
+        """
+        self._connection, self.id, self.keep_conn = connection, rid, keep_conn
+        self._params, self._stdin = [], []
+        self.request_body_stream = _stream.GenericStream(
+            _StdinReader(self), read_exact=True
+        )
+
+    def add_params(self, content):
+        """
+        Add a ``FCGI_PARAMS`` record
+
+        :Parameters:
+         - `content`: Record content
+
+        :Types:
+         - `content`: ``str``
+
+        :return: Are the parameters complete now?
+        :rtype: ``bool``
+
+        :Exceptions:
+         - `FastCGIError`: Invalid parameters
+        """
+        if self._params is None:
+            return False
+        elif content:
+            self._params.append(content)
+            return False
+        params, self._params = ''.join(self._params), None
+        self.environ = dict(decode_pairs(params))
+        return True
+
+    def add_stdin(self, content):
+        """
+        Add a ``FCGI_STDIN`` record
+
+        :Parameters:
+         - `content`: Record content
+
+        :Types:
+         - `content`: ``str``
+        """
+        if content:
+            self._stdin.append(content)
+        else:
+            self._stdin_done = True
+
+    def read_stdin(self, size):
+        """
+        Read from the request body
+
+        Records are read from the connection until data for this request
+        arrives.
+
+        :Parameters:
+         - `size`: Maximum number of octets to read
+
+        :Types:
+         - `size`: ``int``
+
+        :return: The data (empty on EOF)
+        :rtype: ``str``
+
+        :Exceptions:
+         - `RequestAborted`: The request was aborted by the webserver
+        """
+        stdin = self._stdin
+        while not stdin and not self._stdin_done:
+            if self.aborted:
+                raise RequestAborted("Request aborted by the webserver")
+            if self._connection.reader is None or \
+                    not self._connection.process_record():
+                self._stdin_done = True
+        if not stdin:
+            return ''
+        data = stdin.pop(0)
+        if size >= 0 and len(data) > size:
+            data, rest = data[:size], data[size:]
+            stdin.insert(0, rest)
+        return data
+
+    def abort(self):
+        """
+        Abort the running request
+
+        The request is ended right away. Further output is dropped.
+        """
+        self.aborted = True
+        self._connection.end_request(self.id)
+        self._connection.writer.flush()
+
+    def close(self):
+        """ Finish the request """
+        connection, self._connection = self._connection, None
+        if connection is not None:
+            stream, self._response_body_stream = \
+                self._response_body_stream, None
+            if stream is not None:
+                stream.close() # fluuuush
+            self.request_body_stream = None
+            if not self.aborted:
+                connection.end_request(self.id)
+
+    def start_response(self, status, headers):
+        """
+        Start response and determine output stream
+
+        :Parameters:
+         - `status`: Response status line
+         - `headers`: Response headers (``[(key, value), ...]``)
+
+        :Types:
+         - `status`: ``str``
+         - `headers`: ``list``
+
+        :return: response stream
+        :rtype: `stream.GenericStream`
+        """
+        self.response_started = True
+        self._response_body_stream = stream = _stream.GenericStream(
+            _StdoutWriter(self._connection, self)
+        )
+        stream.write("Status: %s\r\n" % status)
+        stream.writelines("%s: %s\r\n" % (key, value)
+            for key, value in headers)
+        stream.write("\r\n")
+        if self.environ.get('REQUEST_METHOD') == 'HEAD':
+            return _stream.dev_null
+        return stream
+
+    def error(self, status, message, headers=()):
+        """
+        Emit a simple error
+
+        :Parameters:
+         - `status`: Status line
+         - `message`: Message
+         - `headers`: Additional headers (``[(name, value), ...]``)
+
+        :Types:
+         - `status`: ``str``
+         - `message`: ``str``
+         - `headers`: ``iterable``
+        """
+        out = "%s\n%s\n" % (status, message)
+        headers = list(headers) + [
+            ("Content-Type", "text/plain"),
+            ("Content-Length", str(len(out))),
+        ]
+        stream = self.start_response(status, headers)
+        stream.write(out)
+
+
+class _StdinReader(object):
+    """
+    Raw stdin stream of a request
+
+    :IVariables:
+     - `read`: Reading function
+
+    :Types:
+     - `read`: ``callable``
+    """
+
+    def __init__(self, request):
+        """
+        Initialization
+
+        :Parameters:
+         - `request`: The request
+
+        :Types:
+         - `request`: `FastCGIRequest`
+        """
+        self.read = request.read_stdin
+
+
+class _StdoutWriter(object):
+    """
+    Raw stdout stream of a request
+
+    Every write is sent as ``FCGI_STDOUT`` record(s). Closing the stream
+    does not end it (that's done by `FastCGIConnection.end_request`).
+    Data written after the request was aborted is dropped.
+
+    :IVariables:
+     - `_connection`: FastCGI connection
+     - `_request`: The request
+
+    :Types:
+     - `_connection`: `FastCGIConnection`
+     - `_request`: `FastCGIRequest`
+    """
+
+    def __init__(self, connection, request):
+        """
+        Initialization
+
+        :Parameters:
+         - `connection`: FastCGI connection
+         - `request`: The request
+
+        :Types:
+         - `connection`: `FastCGIConnection`
+         - `request`: `FastCGIRequest`
+        """
+        self._connection, self._request = connection, request
+
+    def write(self, data):
+        """
+        Write data as stdout record(s)
+
+        :Parameters:
+         - `data`: The data to write
+
+        :Types:
+         - `data`: ``str``
+        """
+        if self._request.aborted:
+            return
+        write, rid = self._connection.write_record, self._request.id
+        for pos in xrange(0, len(data), FCGI_MAX_CONTENT):
+            write(FCGI_STDOUT, rid, data[pos:pos + FCGI_MAX_CONTENT])
+
+    def flush(self):
+        """ Flush the connection """
+        if not self._request.aborted:
+            self._connection.writer.flush()
+
+
+def decode_pairs(data):
+    """
+    Decode FastCGI name-value pairs
+
+    :Parameters:
+     - `data`: The encoded pairs
+
+    :Types:
+     - `data`: ``str``
+
+    :return: The pairs (``[(name, value), ...]``)
+    :rtype: ``list``
+
+    :Exceptions:
+     - `FastCGIError`: Invalid encoding
+    """
+    pos, end, result = 0, len(data), []
+    try:
+        while pos < end:
+            lengths = []
+            for _ in (0, 1):
+                length = ord(data[pos])
+                if length & 0x80:
+                    length = _struct.unpack(
+                        '!L', data[pos:pos + 4]
+                    )[0] & 0x7FFFFFFF
+                    pos += 4
+                else:
+                    pos += 1
+                lengths.append(length)
+            nlen, vlen = lengths
+            name = data[pos:pos + nlen]
+            pos += nlen
+            value = data[pos:pos + vlen]
+            pos += vlen
+            if pos > end:
+                raise IndexError()
+            result.append((name, value))
+    except (IndexError, _struct.error):
+        raise FastCGIError("Invalid name-value pair encoding")
+    return result
+
+
+def encode_pairs(pairs):
+    """
+    Encode FastCGI name-value pairs
+
+    :Parameters:
+     - `pairs`: The pairs (``[(name, value), ...]``)
+
+    :Types:
+     - `pairs`: ``iterable``
+
+    :return: The encoded pairs
+    :rtype: ``str``
+    """
+    result = []
+    for name, value in pairs:
+        for item in (name, value):
+            if len(item) < 0x80:
+                result.append(chr(len(item)))
+            else:
+                result.append(_struct.pack('!L', len(item) | 0x80000000))
+        result.extend((name, value))
+    return ''.join(result)
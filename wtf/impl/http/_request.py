@@ -22,14 +22,15 @@ This is a simple state pattern implementing the request flow.
 
 :Variables:
  - `CRLF`: ASCII CRLF sequence (\r\n)
+ - `LF`: ASCII LF byte (\n)
 
 :Types:
  - `CRLF`: ``str``
+ - `LF`: ``str``
 """
 __author__ = u"Andr\xe9 Malo"
 __docformat__ = "restructuredtext en"
 
-import re as _re
 import socket as _socket
 
 from wtf import Error
@@ -37,10 +38,13 @@ from wtf import stream as _stream
 from wtf.impl import _util as _impl_util
 from wtf.impl.http import _util as _http_util
 
-CRLF = _http_util.CRLF
+CRLF, LF = _http_util.CRLF, _http_util.LF
 
 ParseError = _http_util.ParseError
 BadRequest = _http_util.BadRequest
+InvalidRequestLine = _http_util.InvalidRequestLine
+InvalidHeaderLine = _http_util.InvalidHeaderLine
+IncompleteHeaders = _http_util.IncompleteHeaders
 
 class RequestTimeout(ParseError):
     """ Request timed out """
@@ -58,12 +62,12 @@ class UnImplemented(ParseError):
     """ A feature is unimplemented """
     status = "501 Unimplemented"
 
-class InvalidRequestLine(BadRequest):
-    """ Request line is invalid """
-
 class InvalidContentLength(BadRequest):
     """ The supplied content length is invalid """
 
+class RequestHeadTooLarge(BadRequest):
+    """ The request head exceeds the size limit """
+
 class InvalidTransferEncoding(BadRequest):
     """ An invalid transfer encoding was supplied """
 
@@ -220,46 +224,92 @@ class RequestInitialState(BaseState):
     - `RequestLineReadyState`
 
     :CVariables:
-     - `_LINE_MATCH`: Regex match callable to check if the line does not 
-       start with a WS
-     - `_VER_MATCH`: Regex match callable to parse the HTTP version
+     - `_MAX_HEAD`: Maximum size of the request head in octets
 
     :Types:
-     - `_LINE_MATCH`: ``callable``
-     - `_VER_MATCH`: ``callable``
+     - `_MAX_HEAD`: ``int``
     """
     response_started = False
-    _LINE_MATCH = _re.compile(r'\S').match
-    _VER_MATCH = _re.compile(r'HTTP/(?P<major>\d+)\.(?P<minor>\d+)$').match
+    _MAX_HEAD = 65536
 
     def read_request(self):
-        """ Read request line """
-        request = self._request
-        request_line = request.connection.reader.readline()
-        if not self._LINE_MATCH(request_line):
-            raise InvalidRequestLine("Invalid request line format")
-
-        request_line = request_line.split()
-        if len(request_line) == 2:
-            (method, url), protocol = request_line, (0, 9)
-            if method != 'GET':
-                raise InvalidRequestLine("Invalid method on HTTP/0.9 request")
-        elif len(request_line) == 3:
-            method, url, protocol = request_line
-            match = self._VER_MATCH(protocol)
-            if not match:
-                raise InvalidRequestLine("Invalid protocol string")
-            protocol = tuple(map(int, match.group('major', 'minor')))
-            if protocol < (1, 0):
-                raise InvalidRequestLine("Invalid protocol version")
-        else:
-            raise InvalidRequestLine("Request line format not recognized")
+        """
+        Read request line
 
-        request.method = method
-        request.url = url
-        request.protocol = protocol
+        The headers are read and parsed along with the request line (the
+        octets beyond the request head are pushed back into the reader).
+        They are stored in the request and checked by the next state.
+
+        The head is parsed, when the request line is complete (it might be
+        an HTTP/0.9 request) and again, when the end of the head arrived.
+        Only the newly received octets are searched for the latter.
+        """
+        # pylint: disable = R0912
+        request = self._request
+        reader = request.connection.reader
+        data = reader.read(0)
+        if data:
+            # not an idle keep-alive connection anymore
+            request.connection.settimeout(
+                request._server.timeouts.general # pylint: disable = W0212
+            )
+        head, line, scan = None, False, 0
+        try:
+            while True:
+                if not line:
+                    if data.find(LF, scan) >= 0:
+                        line = True
+                        head = _http_util.parse_head(data)
+                elif data.find(LF + LF, scan) >= 0 or \
+                        data.find(LF + CRLF, scan) >= 0:
+                    head = _http_util.parse_head(data)
+                if head is not None:
+                    break
+                if len(data) > self._MAX_HEAD:
+                    if not line:
+                        raise InvalidRequestLine("Request line too long")
+                    self._set_request_line(data)
+                    raise RequestHeadTooLarge("Request head too large")
+                if not reader.buffered:
+                    # don't hold back pipelined responses while waiting
+                    request.connection.writer.flush()
+                chunk = reader.read(0)
+                if not chunk:
+                    if not line:
+                        head = _http_util.parse_head(data + LF)
+                    if head is None:
+                        self._set_request_line(data)
+                        raise IncompleteHeaders("Headers not completed")
+                    break
+                # the end of the head may start within the last two octets
+                scan = max(0, len(data) - 2)
+                data += chunk
+        except ValueError, e:
+            if e.args[0] == 'request':
+                raise InvalidRequestLine(e.args[1])
+            self._set_request_line(data)
+            raise InvalidHeaderLine(e.args[1])
+
+        request.method, request.url, request.protocol, request.headers, \
+            size = head
+        reader.unread(data[size:])
         self._set_state(RequestLineReadyState)
 
+    def _set_request_line(self, data):
+        """
+        Store the request line only (for error responses)
+
+        :Parameters:
+         - `data`: The octets received so far, starting with a valid
+           request line
+
+        :Types:
+         - `data`: ``str``
+        """
+        request = self._request
+        request.method, request.url, request.protocol, _, _ = \
+            _http_util.parse_head(data.split(LF, 1)[0] + LF + LF)
+
 
 class RequestLineReadyState(BaseState):
     """
@@ -272,17 +322,12 @@ class RequestLineReadyState(BaseState):
     response_started = False
 
     def read_headers(self):
-        """ Read and parse the headers """
+        """ Check the headers read along with the request line """
         request = self._request
-        if request.protocol >= (1, 0):
-            headers = _http_util.read_headers(request.connection.reader)
-            if request.protocol >= (1, 1) and 'host' not in headers:
-                raise MissingHostHeader(
-                    "HTTP/1.1 requests MUST supply a Host header"
-                )
-        else:
-            headers = {}
-        request.headers = headers
+        if request.protocol >= (1, 1) and 'host' not in request.headers:
+            raise MissingHostHeader(
+                "HTTP/1.1 requests MUST supply a Host header"
+            )
         self._set_state(RequestHeadersReadyState)
 
 
@@ -462,7 +507,7 @@ class ResponseHeadersWaitState(BaseState):
         self._set_state(ResponseBodyWaitState)
         request = self._request
         if request.protocol >= (1, 0):
-            out, hdict, writer = [], self._hdict, request.connection.writer
+            hdict, writer = self._hdict, request.connection.writer
             request.response_headers = hdict
             request.connection.compute_status()
             if request.connection.persist or request.sent_100:
@@ -480,31 +525,19 @@ class ResponseHeadersWaitState(BaseState):
                 if request.send_continue == self._send_continue:
                     del request.send_continue
 
-            hdict.update({
-                'server': ["WTF"], 'date': [_http_util.make_date()]
-            })
+            hdict['server'] = ["WTF"]
+            hdict['date'] = [_http_util.current_date()]
             for key, value in request.connection.headers.iteritems():
                 if key not in hdict:
                     self._headers.append(key)
                 hdict[key] = [value]
 
-            for name in self._headers:
-                if name in hdict:
-                    cname = name.title()
-                    if name == 'set-cookie':
-                        out.extend([(cname, val) for val in hdict[name]])
-                    else:
-                        out.append((cname, ", ".join(hdict[name])))
-
-            writer.write(
+            writer.write(_http_util.header_block(
                 # pylint: disable = W0212
                 "HTTP/%d.%d " % request.http_version +
-                    request._response_status_line + CRLF
-            )
-            writer.writelines([
-                "%s: %s%s" % (name, value, CRLF) for name, value in out
-            ])
-            writer.write(CRLF)
+                    request._response_status_line,
+                self._headers, hdict, _http_util.CANONICAL_HEADERS
+            ))
 
 
 class ResponseBodyWaitState(BaseState):
@@ -524,12 +557,22 @@ class ResponseBodyWaitState(BaseState):
         if request.method == 'HEAD':
             stream = _stream.dev_null
         else:
-            stream = request.connection.writer
+            connection = request.connection
+            stream = connection.writer
+            if connection.shared:
+                # If the next request is already waiting (pipelining),
+                # the response is sent along with the following ones
+                stream = _http_util.ResponseWriter(stream,
+                    connection.persist and connection.reader.buffered > 0
+                )
             if request.response_headers and \
                     'transfer-encoding' in request.response_headers:
-                stream = _stream.GenericStream(
-                    _http_util.ChunkedWriter(stream)
-                )
+                server = request._server # pylint: disable = W0212
+                request._response_chunker = chunker = \
+                    _http_util.ChunkedWriter(stream,
+                        server.chunk_buffer, server.chunk_delay
+                    )
+                stream = _stream.GenericStream(chunker)
             request._response_body_stream = stream
         return stream
 
@@ -549,6 +592,8 @@ class HTTPRequest(object):
        are dealt with transparently. Just read it.
      - `_response_body_stream`: Stream for writing the response body (or
        ``None``)
+     - `_response_chunker`: Chunked encoder of the response body (or
+       ``None``)
      - `_server`: HTTP server instance
      - `state`: Current state object. Additional methods and properties are
        looked up there (see `BaseState` for documentation)
@@ -565,6 +610,7 @@ class HTTPRequest(object):
     :Types:
      - `_request_body_stream`: `wtf.stream.GenericStream`
      - `_response_body_stream`: `wtf.stream.GenericStream`
+     - `_response_chunker`: `http._util.ChunkedWriter`
      - `_server`: `http.HTTPServer`
      - `state`: `BaseState`
      - `headers`: ``dict``
@@ -578,12 +624,13 @@ class HTTPRequest(object):
      - `flags`: `wtf.impl.FlagsInterface`
     """
     _request_body_stream, _response_body_stream = None, None
+    _response_chunker = None
     expects_100, sent_100, _response_status_line = False, False, None
     headers, response_status, response_headers = None, None, None
     method, url, protocol = 'GET', '*', (0, 9)
     connection = None
 
-    def __init__(self, server, connection, flags):
+    def __init__(self, server, connection, flags, streams=None):
         """
         Initialization
 
@@ -591,19 +638,36 @@ class HTTPRequest(object):
          - `server`: Server instance
          - `connection`: Connection, this request is served on
          - `flags`: Worker flags
+         - `streams`: Reading and writing stream shared between the requests
+           on the connection (``(reader, writer)``). If omitted or ``None``,
+           the request gets its own streams.
 
         :Types:
          - `server`: `HTTPServer`
          - `connection`: `Connection`
          - `flags`: `FlagsInterface`
+         - `streams`: ``tuple``
         """
         self._server = server
         self.http_version = server.http_version
         self.keep_alive = server.keep_alive
         self.flags = flags
-        self.connection = _http_util.HTTPConnection(self, connection)
+        self.connection = _http_util.HTTPConnection(self, connection, streams)
         self.state = RequestInitialState(self)
 
+    def flush_response(self):
+        """
+        Send the response body written so far
+
+        This includes chunks held back for aggregation. Before the response
+        body stream is determined, this is a no-op.
+        """
+        stream = self._response_body_stream
+        if stream is not None:
+            stream.flush()
+            if self._response_chunker is not None:
+                self._response_chunker.flush(True)
+
     def close(self):
         """ Close all streams """
         self._set_state(ResponseDoneState)
@@ -638,14 +702,13 @@ class HTTPRequest(object):
         """
         try:
             self.read_request()
-            self.connection.settimeout(self._server.timeouts.general)
             if self.protocol > self.http_version:
                 raise UnsupportedHTTPVersion("Sorry.")
             self.read_headers()
         except _socket.timeout:
             raise RequestTimeout("Try typing a little faster")
 
-    def error(self, status, message):
+    def error(self, status, message, headers=()):
         """
         Emit a simple error
 
@@ -654,16 +717,20 @@ class HTTPRequest(object):
            (which is labeled text/plain for >= HTTP/1.0 or wrapped into HTML
            for HTTP/0.9)
          - `message`: The message to emit
+         - `headers`: Additional headers (``[(name, value), ...]``)
 
         :Types:
          - `status`: ``str``
          - `message`: ``str``
+         - `headers`: ``iterable``
         """
         protocol, write = self.protocol, self.connection.writer.write
         if protocol >= (1, 0):
             out = status + CRLF + message + CRLF
             write("HTTP/%d.%d " % self.http_version + status + CRLF)
-            write("Date: %s%s" % (_http_util.make_date(), CRLF))
+            write("Date: %s%s" % (_http_util.current_date(), CRLF))
+            for name, value in headers:
+                write("%s: %s%s" % (name, value, CRLF))
             write("Content-Type: text/plain" + CRLF)
             write("Content-Length: %s%s" % (len(out), CRLF))
             if protocol >= (1, 1):
@@ -42,23 +42,42 @@ class HTTPServer(object):
     """
     HTTP server
 
+    :CVariables:
+     - `_OVERLOADED`: Message of the overload response
+
     :IVariables:
      - `config`: Configuration
      - `opts`: Command line options
      - `args`: Positioned command line arguments
      - `timeouts`: Timeout specs
      - `http_version`: Supported HTTP version (``(major, minor)``)
+     - `keep_alive`: Are connections kept alive?
+     - `parking`: Hand over idle keep-alive connections to the worker?
+     - `cork`: Cork the connection while the responses are written?
+     - `chunk_buffer`: Number of octets chunked responses are aggregated to
+       (``0`` = no aggregation)
+     - `chunk_delay`: Maximum time in seconds small chunks are held back
      - `_gateway`: Gateway instance
 
     :Types:
+     - `_OVERLOADED`: ``str``
      - `config`: `wtf.config.Config`
      - `opts`: ``optparse.OptionContainer``
      - `args`: ``list``
      - `timeouts`: `_TimeOuts`
      - `http_version`: ``tuple``
+     - `keep_alive`: ``bool``
+     - `parking`: ``bool``
+     - `cork`: ``bool``
+     - `chunk_buffer`: ``int``
+     - `chunk_delay`: ``float``
      - `_gateway`: `Gateway`
     """
     __implements__ = [_impl.ServerInterface]
+    _OVERLOADED = (
+        "The server is too busy to process the request right now. "
+        "Please try again later."
+    )
 
     def __init__(self, config, opts, args):
         """
@@ -75,6 +94,14 @@ class HTTPServer(object):
         self.http_version = vtuple
         self.keep_alive = not config.wtf('autoreload', False) \
             and config.wtf('keep-alive', True)
+        self.parking = self.keep_alive and config.wtf('parking', False)
+        self.cork = bool(config.wtf('cork', False))
+        self.chunk_buffer, self.chunk_delay = 0, 0.0
+        if 'chunked' in config.wtf:
+            self.chunk_buffer = max(0, int(config.wtf.chunked('buffer', 0)))
+            self.chunk_delay = max(0.0,
+                float(config.wtf.chunked('delay', 0.2))
+            )
         self._gateway = Gateway(config, opts, args)
 
     def handle(self, (sock, peername), application, flags):
@@ -86,11 +113,17 @@ class HTTPServer(object):
         # pylint: disable = R0912, R0915
 
         conn = _connection.Connection(sock, peername)
+        writer = None
         try:
             conn.settimeout(self.timeouts.general)
             gateway, first = self._gateway.handle, True
+            reader, writer = conn.reader(), conn.writer()
             while True:
-                request = _request.HTTPRequest(self, conn, flags)
+                if self.cork:
+                    conn.cork()
+                request = _request.HTTPRequest(
+                    self, conn, flags, (reader, writer)
+                )
                 try:
                     try:
                         try:
@@ -133,15 +166,75 @@ class HTTPServer(object):
                             break
                 finally:
                     request.close()
+                if flags.shutdown():
+                    break
+
+                # Pipelined requests, which are already buffered, are
+                # handled right away. Their responses are collected and
+                # sent together.
+                if reader.buffered:
+                    first = False
+                    continue
+                try:
+                    writer.flush()
+                    if self.cork:
+                        conn.cork(False) # push out the last partial frame
+                except _socket.error, e:
+                    if e[0] not in (_errno.EPIPE, _errno.ECONNRESET):
+                        raise
+                    break
+                if self.parking:
+                    sock = conn.detach()
+                    if flags.park((sock, peername), self.timeouts.keep_alive):
+                        writer = None
+                        break
+                    conn = _connection.Connection(sock, peername)
+                    reader, writer = conn.reader(), conn.writer()
                 first, _ = False, conn.settimeout(self.timeouts.keep_alive)
         finally:
             try:
-                conn.close()
+                try:
+                    if writer is not None:
+                        writer.close() # send the pending responses
+                finally:
+                    conn.close()
             except (SystemExit, KeyboardInterrupt):
                 raise
             except:
                 pass # nothing we could do here anyway, maybe log it?
 
+    def shed(self, (sock, peername), flags, retry_after):
+        """
+        Reject an accepted socket because of overload
+
+        The request head is read (so the client actually receives the
+        response), the body is not.
+
+        :See: `wtf.impl.ServerInterface`
+        """
+        conn = _connection.Connection(sock, peername)
+        try:
+            conn.settimeout(self.timeouts.keep_alive)
+            request = _request.HTTPRequest(self, conn, flags)
+            try:
+                try:
+                    request.parse()
+                    request.error(
+                        "503 Service Unavailable", self._OVERLOADED,
+                        [("Retry-After", str(retry_after))]
+                    )
+                except (_request.ParseError, _socket.error):
+                    pass
+            finally:
+                request.close()
+        finally:
+            try:
+                conn.close()
+            except (SystemExit, KeyboardInterrupt):
+                raise
+            except:
+                pass
+
 
 class Gateway(_gateway.Gateway):
     """
@@ -154,11 +247,16 @@ class Gateway(_gateway.Gateway):
        appear without the ``HTTP_`` prefix
      - `_HOPS`: Set of standard Hop-by-Hop headers
 
+    :IVariables:
+     - `lazy_environ`: Convert the request headers to ``HTTP_*`` variables
+       on first access only?
+
     :Types:
      - `_NORM_SUB`: ``callable``
      - `_SLASH_SPLIT`: ``callable``
      - `_STRIPPED`: ``tuple``
      - `_HOPS`: ``set``
+     - `lazy_environ`: ``bool``
     """
     _NORM_SUB = _re.compile(r'[^a-zA-Z\d]').sub
     _SLASH_SPLIT = _re.compile(r'%2[fF]').split
@@ -174,6 +272,15 @@ class Gateway(_gateway.Gateway):
         Upgrade
     """.split()])
 
+    def __init__(self, config, opts, args):
+        """
+        Initialization
+
+        :See: `_gateway.Gateway.__init__`
+        """
+        super(Gateway, self).__init__(config, opts, args)
+        self.lazy_environ = bool(config.wtf('lazy-environ', False))
+
     def _populate_base_env(self, base_env):
         """
         Add HTTP implementation specific env constants
@@ -193,23 +300,11 @@ class Gateway(_gateway.Gateway):
         :See: `_gateway.Gateway._init_from_request`
         """
         request.parse()
-        environ = dict(("HTTP_" + self._NORM_SUB("_", key).upper(), value)
-            for key, value in request.headers.iteritems())
-        for key in self._STRIPPED:
-            if key in environ:
-                environ[key[5:]] = environ.pop(key)
-        if 'HTTP_TRANSFER_ENCODING' in environ:
-            environ['CONTENT_LENGTH'] = '-1'
-        if 'HTTP_CONNECTION' in environ:
-            connhops = set(
-                "HTTP_" + self._NORM_SUB("_", key.strip()).upper()
-                for key in environ['HTTP_CONNECTION'].split(',')
-            )
+        if self.lazy_environ:
+            variables = _HeaderVariables(self, request.headers)
+            environ = _gateway.LazyEnviron(variables.content(), variables)
         else:
-            connhops = set()
-        for key in (self._HOPS | connhops):
-            if key in environ:
-                del environ[key]
+            environ = self._header_variables(request.headers)
 
         _, _, path, query, _ = _urlparse.urlsplit(request.url)
         environ.update({
@@ -226,9 +321,11 @@ class Gateway(_gateway.Gateway):
             'wsgi.multithread':  request.flags.multithread,
             'wsgi.multiprocess': request.flags.multiprocess,
             'wsgi.run_once':     request.flags.run_once,
+            'wtf.worker.status': request.flags.status,
             'wsgi.input':        request.request_body_stream() or
                                      _stream.dev_null,
             'wsgi.url_scheme':   'http', # no ssl for now
+            'wtf.response.flush': lambda response: request.flush_response,
         })
         if '%' in path:
             path = '%2F'.join(_webutil.unquote(item)
@@ -244,6 +341,174 @@ class Gateway(_gateway.Gateway):
 
         return environ, start_response
 
+    def _header_variables(self, headers):
+        """
+        Convert request headers to environment variables
+
+        :Parameters:
+         - `headers`: Request headers (``{'lower cased name': 'value'}``)
+
+        :Types:
+         - `headers`: ``dict``
+
+        :return: The variables (``HTTP_*``, ``CONTENT_TYPE`` and
+                 ``CONTENT_LENGTH``)
+        :rtype: ``dict``
+        """
+        environ = dict(("HTTP_" + self._NORM_SUB("_", key).upper(), value)
+            for key, value in headers.iteritems())
+        for key in self._STRIPPED:
+            if key in environ:
+                environ[key[5:]] = environ.pop(key)
+        if 'HTTP_TRANSFER_ENCODING' in environ:
+            environ['CONTENT_LENGTH'] = '-1'
+        for key in self._hop_variables(environ.get('HTTP_CONNECTION')):
+            if key in environ:
+                del environ[key]
+        return environ
+
+    def _hop_variables(self, connection):
+        """
+        Determine the variable names of hop-by-hop headers
+
+        :Parameters:
+         - `connection`: Value of the Connection header (or ``None``)
+
+        :Types:
+         - `connection`: ``str``
+
+        :return: The variable names
+        :rtype: ``set``
+        """
+        if connection is None:
+            return self._HOPS
+        return self._HOPS | set(
+            "HTTP_" + self._NORM_SUB("_", key.strip()).upper()
+            for key in connection.split(',')
+        )
+
+    def _file_stream(self, request):
+        """
+        Determine the raw connection stream for sending a file
+
+        :See: `_gateway.Gateway._file_stream`
+        """
+        if request.method == 'HEAD' or (request.response_headers and
+                'transfer-encoding' in request.response_headers):
+            return None
+        return request.connection.writer
+
+
+class _HeaderVariables(object):
+    """
+    Deferred ``HTTP_*`` variables of a request (see `_gateway.LazyEnviron`)
+
+    Single variables are looked up directly in the headers, unless there
+    are header names, which don't map back unambiguously. In that case
+    (or if all variables are needed) the headers are converted at once.
+
+    :CVariables:
+     - `_ODD_SEARCH`: Regex search callable for header names not consisting
+       of lower case letters, digits and dashes
+
+    :IVariables:
+     - `_gateway`: The gateway
+     - `_headers`: The request headers
+     - `_skip`: Variable names not to be looked up in the headers (or
+       ``None`` if single variables can't be looked up)
+     - `_variables`: The converted variables (or ``None``)
+
+    :Types:
+     - `_ODD_SEARCH`: ``callable``
+     - `_gateway`: `Gateway`
+     - `_headers`: ``dict``
+     - `_skip`: ``set``
+     - `_variables`: ``dict``
+    """
+    _ODD_SEARCH = _re.compile(r'[^a-z\d\n-]').search
+    _skip, _variables = (), None
+
+    def __init__(self, gateway, headers):
+        """
+        Initialization
+
+        :Parameters:
+         - `gateway`: The gateway
+         - `headers`: The request headers (``{'lower cased name': 'value'}``)
+
+        :Types:
+         - `gateway`: `Gateway`
+         - `headers`: ``dict``
+        """
+        self._gateway, self._headers = gateway, headers
+
+    def content(self):
+        """
+        Determine the ``CONTENT_TYPE`` and ``CONTENT_LENGTH`` variables
+
+        :return: The variables
+        :rtype: ``dict``
+        """
+        headers, environ = self._headers, {}
+        if self._ODD_SEARCH('\n'.join(headers)):
+            self._skip, variables = None, self.load()
+            for key in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                if key in variables:
+                    environ[key] = variables[key]
+            return environ
+
+        if 'content-type' in headers:
+            environ['CONTENT_TYPE'] = headers['content-type']
+        if 'transfer-encoding' in headers:
+            environ['CONTENT_LENGTH'] = '-1'
+        elif 'content-length' in headers:
+            environ['CONTENT_LENGTH'] = headers['content-length']
+        return environ
+
+    def lookup(self, key):
+        """
+        Look up a single variable
+
+        `content` must be called first.
+
+        :Parameters:
+         - `key`: The variable name
+
+        :Types:
+         - `key`: ``str``
+
+        :return: The value or ``None`` if the variable does not exist
+        :rtype: ``str``
+        """
+        skip = self._skip
+        if skip is None:
+            return self.load().get(key)
+        elif not key.startswith('HTTP_'):
+            return None
+        elif skip == ():
+            # pylint: disable = W0212
+            skip = self._skip = self._gateway._hop_variables(
+                self._headers.get('connection')
+            ).union(self._gateway._STRIPPED)
+        if key in skip:
+            return None
+        name = key[5:].lower().replace('_', '-')
+        if name.upper().replace('-', '_') != key[5:]:
+            return None
+        return self._headers.get(name)
+
+    def load(self):
+        """
+        Convert all headers
+
+        :return: The variables
+        :rtype: ``dict``
+        """
+        if self._variables is None:
+            # pylint: disable = W0212
+            self._variables = self._gateway._header_variables(self._headers)
+        return self._variables
+
 
 class _TimeOuts(object):
     """
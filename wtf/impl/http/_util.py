@@ -24,24 +24,42 @@ This module implements various tools for HTTP request/response handling.
  - `CR`: ASCII CR byte (\\r)
  - `LF`: ASCII LF byte (\\n)
  - `CRLF`: ASCII CRLF sequence (\\r\\n)
+ - `CANONICAL_HEADERS`: Mapping of common lowercased header names to their
+   canonical (emitted) form
 
 :Types:
  - `CR`: ``str``
  - `LF`: ``str``
  - `CRLF`: ``str``
+ - `CANONICAL_HEADERS`: ``dict``
 """
 __author__ = u"Andr\xe9 Malo"
 __docformat__ = "restructuredtext en"
 
 import errno as _errno
+import heapq as _heapq
+import os as _os
+import re as _re
 import socket as _socket
+import threading as _threading
+import time as _time
 
 from wtf import Error
 from wtf import httputil as _httputil
 from wtf import stream as _stream
 
 CR, LF, CRLF = _httputil.CR, _httputil.LF, _httputil.CRLF
-make_date = _httputil.make_date
+make_date, current_date = _httputil.make_date, _httputil.current_date
+
+CANONICAL_HEADERS = dict((name.lower(), name) for name in (
+    'Accept-Ranges', 'Age', 'Allow', 'Cache-Control', 'Connection',
+    'Content-Disposition', 'Content-Encoding', 'Content-Language',
+    'Content-Length', 'Content-Location', 'Content-Md5', 'Content-Range',
+    'Content-Type', 'Date', 'Etag', 'Expires', 'Keep-Alive',
+    'Last-Modified', 'Location', 'Pragma', 'Retry-After', 'Server',
+    'Set-Cookie', 'Trailer', 'Transfer-Encoding', 'Vary', 'Via', 'Warning',
+    'Www-Authenticate',
+))
 
 
 class ParseError(Error):
@@ -74,6 +92,9 @@ class BadRequest(ParseError):
     """ Bad Request error class """
     status = "400 Bad Request"
 
+class InvalidRequestLine(BadRequest):
+    """ Request line is invalid """
+
 class InvalidHeaderLine(BadRequest):
     """ A header line is invalid """
 
@@ -113,28 +134,178 @@ def read_headers(stream):
         raise InvalidHeaderLine(str(e))
 
 
+def parse_head(data):
+    """
+    Parse a request head (request line and headers)
+
+    :Parameters:
+     - `data`: The octets received so far, starting with the request line
+
+    :Types:
+     - `data`: ``str``
+
+    :return: ``None`` if the head is not complete yet. Otherwise a tuple of
+             method, url, protocol version, a dict of comma folded headers
+             (keys are lower cased) and the size of the head
+             (``('method', 'url', (major, minor), {...}, size)``)
+    :rtype: ``tuple``
+
+    :Exceptions:
+     - `ValueError`: The head is invalid. The exception arguments are the
+       invalid part (``'request'`` or ``'header'``) and the message.
+    """
+    # pylint: disable = R0912
+
+    self, end = parse_head, data.find(LF)
+    if end < 0:
+        return None
+    if not self.LINE_MATCH(data): # pylint: disable = E1101
+        raise ValueError('request', "Invalid request line format")
+
+    request_line = data[:end].split()
+    if len(request_line) == 2:
+        method, url = request_line
+        if method != 'GET':
+            raise ValueError('request', "Invalid method on HTTP/0.9 request")
+        return method, url, (0, 9), {}, end + 1
+    elif len(request_line) == 3:
+        method, url, protocol = request_line
+        match = self.VER_MATCH(protocol) # pylint: disable = E1101
+        if not match:
+            raise ValueError('request', "Invalid protocol string")
+        protocol = tuple(map(int, match.group('major', 'minor')))
+        if protocol < (1, 0):
+            raise ValueError('request', "Invalid protocol version")
+    else:
+        raise ValueError('request', "Request line format not recognized")
+
+    hend = [pos for pos in (data.find(LF + LF, end), data.find(LF + CRLF, end))
+        if pos >= 0]
+    if not hend:
+        return None
+    hend = min(hend)
+    size = data.index(LF, hend + 1) + 1
+
+    headers, name, values = {}, None, None
+    if hend > end:
+        for line in data[end + 1:hend].split(LF):
+            if line.endswith(CR):
+                line = line[:-1]
+            if self.CONT_MATCH(line): # pylint: disable = E1101
+                if name is None:
+                    raise ValueError('header',
+                        "Continuation line without line to continue")
+                values.append(line.lstrip())
+                continue
+            elif name is not None:
+                headers.setdefault(name.lower(), []).append(" ".join(values))
+            match = self.HEADER_MATCH(line) # pylint: disable = E1101
+            if not match:
+                raise ValueError('header', "Invalid header line format")
+            name, value = match.group('name', 'value')
+            values = [value]
+        headers.setdefault(name.lower(), []).append(" ".join(values))
+
+    return method, url, protocol, dict((name, ", ".join(values))
+        for name, values in headers.iteritems()), size
+
+parse_head.LINE_MATCH = _re.compile(r'\S').match # pylint: disable = W0612
+parse_head.VER_MATCH = _re.compile( # pylint: disable = W0612
+    r'HTTP/(?P<major>\d+)\.(?P<minor>\d+)$'
+).match
+parse_head.CONT_MATCH = \
+    _httputil.read_headers.CONT_MATCH # pylint: disable = W0612, E1101
+parse_head.HEADER_MATCH = \
+    _httputil.read_headers.HEADER_MATCH # pylint: disable = W0612, E1101
+
+
+def header_block(status_line, names, hdict, canonical):
+    """
+    Serialize the response head into a single string
+
+    :Parameters:
+     - `status_line`: The complete status line (without CRLF)
+     - `names`: Ordered list of lowercased header names. Names, which are
+       not in `hdict`, are skipped.
+     - `hdict`: Header values (``{'name': ['value', ...], ...}``). Multiple
+       values are comma folded, except for ``set-cookie``, which is emitted
+       once per value.
+     - `canonical`: Mapping of lowercased names to the emitted names. Names
+       not found are title cased.
+
+    :Types:
+     - `status_line`: ``str``
+     - `names`: ``iterable``
+     - `hdict`: ``dict``
+     - `canonical`: ``dict``
+
+    :return: The response head including the final empty line
+    :rtype: ``str``
+    """
+    out = [status_line, CRLF]
+    for name in names:
+        if name in hdict:
+            cname = canonical.get(name) or name.title()
+            if name == 'set-cookie':
+                for value in hdict[name]:
+                    out.extend((cname, ": ", value, CRLF))
+            else:
+                out.extend((cname, ": ", ", ".join(hdict[name]), CRLF))
+    out.append(CRLF)
+    return "".join(out)
+
+
 class ChunkedWriter(object):
     """
     Chunked transfer encoding encoder
 
+    Small writes can be aggregated into larger chunks: the data is held back
+    until `_bufsize` octets are collected, but no longer than `_delay`
+    seconds after the first held back write. The data is released by a
+    timer thread then (see `Releaser`), so an application blocking after
+    a small write doesn't stall it. ``flush(True)`` and closing the stream
+    send it immediately.
+
     :Ivariables:
      - `_stream`: The stream to write the chunks to
+     - `_bufsize`: Aggregation size (``0`` = every write is a chunk)
+     - `_delay`: Time in seconds data may be held back
+     - `_buffer`: Held back data
+     - `_size`: Number of held back octets
+     - `_since`: Time of the first held back write
+     - `_closed`: Was the stream closed?
+     - `_lock`: Lock serializing the access to `_stream` (the timer
+       thread writes as well)
 
     :Types:
      - `_stream`: ``file``
+     - `_bufsize`: ``int``
+     - `_delay`: ``float``
+     - `_buffer`: ``list``
+     - `_size`: ``int``
+     - `_since`: ``float``
+     - `_closed`: ``bool``
+     - `_lock`: ``threading.Lock``
     """
+    _size, _since, _closed = 0, None, False
 
-    def __init__(self, stream):
+    def __init__(self, stream, bufsize=0, delay=0.0):
         """
         Initialization
 
         :Parameters:
          - `stream`: The stream to write the chunks to
+         - `bufsize`: Aggregation size (``0`` = every write is a chunk)
+         - `delay`: Time in seconds data may be held back
 
         :Types:
          - `stream`: ``file``
+         - `bufsize`: ``int``
+         - `delay`: ``float``
         """
         self._stream = stream
+        self._bufsize, self._delay, self._buffer = bufsize, delay, []
+        self._lock = _threading.Lock()
 
     def __getattr__(self, name):
         """
@@ -154,36 +325,242 @@ class ChunkedWriter(object):
         """
         return getattr(self._stream, name)
 
-    def write(self, data, _force_empty=False):
+    def write(self, data):
         """
         Write a chunk of data
 
         :Parameters:
          - `data`: The chunk of data to write
-         - `_force_empty`: Write the chunk even if data is empty
-           (this will be - by definition - the last chunk)
 
         :Types:
          - `data`: ``str``
-         - `_force_empty`: ``bool``
         """
         data = str(data)
-        if data or _force_empty:
-            self._stream.write('%X' % len(data) + CRLF)
-            self._stream.write(data + CRLF)
+        if not data:
+            return
+        self._lock.acquire()
+        try:
+            if self._bufsize > 0:
+                if not self._buffer:
+                    self._since = _time.time()
+                    if self._delay > 0:
+                        releaser().schedule(self._since + self._delay, self)
+                self._buffer.append(data)
+                self._size += len(data)
+                if self._size >= self._bufsize:
+                    self._release()
+            else:
+                self._chunk(data)
+        finally:
+            self._lock.release()
+
+    def _chunk(self, data):
+        """
+        Write a single chunk (lock held)
+
+        :Parameters:
+         - `data`: The chunk data (if empty, it's the last chunk)
+
+        :Types:
+         - `data`: ``str``
+        """
+        self._stream.write('%X' % len(data) + CRLF)
+        self._stream.write(data + CRLF)
+
+    def _release(self):
+        """ Write the held back data as one chunk (lock held) """
+        if self._buffer:
+            data, self._buffer, self._size = "".join(self._buffer), [], 0
+            self._chunk(data)
+
+    def flush(self, force=False):
+        """
+        Flush the stream
+
+        Held back data is kept, unless the delay has expired.
+
+        :Parameters:
+         - `force`: Send held back data in any case?
+
+        :Types:
+         - `force`: ``bool``
+        """
+        self._lock.acquire()
+        try:
+            if self._buffer:
+                if not force and _time.time() - self._since < self._delay:
+                    return
+                self._release()
+            self._stream.flush()
+        finally:
+            self._lock.release()
+
+    def expire(self):
+        """
+        Send the held back data, if the delay has expired
+
+        This is called by the timer thread.
+        """
+        self._lock.acquire()
+        try:
+            if not self._closed and self._buffer and \
+                    _time.time() - self._since >= self._delay:
+                self._release()
+                self._stream.flush()
+        finally:
+            self._lock.release()
 
     def close(self):
         """
         Finish chunked writing
 
-        This writes the last (empty) chunk and closes the stream afterwards.
+        This writes the held back data and the last (empty) chunk and closes
+        the stream afterwards.
         """
-        self.write("", True)
+        self._lock.acquire()
         try:
-            self._stream.close()
-        except _socket.error, e:
-            if e[0] != _errno.EPIPE:
-                raise
+            if self._closed:
+                return
+            self._closed = True
+            self._release()
+            self._chunk("")
+            try:
+                self._stream.close()
+            except _socket.error, e:
+                if e[0] != _errno.EPIPE:
+                    raise
+        finally:
+            self._lock.release()
+
+
+class Releaser(object):
+    """
+    Timer thread sending held back chunks after their delay
+
+    There's one per process, see `releaser`.
+
+    :IVariables:
+     - `_timers`: Scheduled writers (heap of ``(time, writer)``)
+     - `_cond`: Condition guarding `_timers`
+
+    :Types:
+     - `_timers`: ``list``
+     - `_cond`: ``threading.Condition``
+    """
+
+    def __init__(self):
+        """ Initialization - starts the thread """
+        self._timers = []
+        self._cond = _threading.Condition(_threading.Lock())
+        thread = _threading.Thread(target=self._run, name="ChunkReleaser")
+        thread.setDaemon(True)
+        thread.start()
+
+    def schedule(self, when, writer):
+        """
+        Schedule the release of held back data
+
+        :Parameters:
+         - `when`: The time to release the data
+         - `writer`: The writer holding the data
+
+        :Types:
+         - `when`: ``float``
+         - `writer`: `ChunkedWriter`
+        """
+        self._cond.acquire()
+        try:
+            _heapq.heappush(self._timers, (when, writer))
+            if self._timers[0][1] is writer:
+                self._cond.notify()
+        finally:
+            self._cond.release()
+
+    def _run(self):
+        """ Thread main loop """
+        timers, cond = self._timers, self._cond
+        while True:
+            cond.acquire()
+            try:
+                while True:
+                    if not timers:
+                        cond.wait()
+                        continue
+                    timeout = timers[0][0] - _time.time()
+                    if timeout <= 0:
+                        break
+                    cond.wait(timeout)
+                _, writer = _heapq.heappop(timers)
+            finally:
+                cond.release()
+            try:
+                writer.expire()
+            except (_socket.error, IOError):
+                pass # the application gets it on its next write
+
+
+def releaser():
+    """
+    Determine the timer thread of the current process
+
+    It's started on first use (the thread doesn't survive a ``fork``).
+
+    :return: The timer thread
+    :rtype: `Releaser`
+    """
+    global _releaser # pylint: disable = W0603
+
+    pid = _os.getpid()
+    _releaser_lock.acquire()
+    try:
+        if _releaser is None or _releaser[0] != pid:
+            _releaser = pid, Releaser()
+        return _releaser[1]
+    finally:
+        _releaser_lock.release()
+
+_releaser, _releaser_lock = None, _threading.Lock()
+
+
+class ResponseWriter(object):
+    """
+    Response body stream on a shared connection writer
+
+    Closing the stream leaves the connection writer open. If the flushes are
+    deferred, the response is sent together with the following ones (or
+    whenever the write buffer is full).
+
+    :IVariables:
+     - `_stream`: The connection writer
+
+    :Types:
+     - `_stream`: `wtf.stream.GenericStream`
+    """
+
+    def __init__(self, stream, defer_flush):
+        """
+        Initialization
+
+        :Parameters:
+         - `stream`: The connection writer
+         - `defer_flush`: Ignore flush requests?
+
+        :Types:
+         - `stream`: `wtf.stream.GenericStream`
+         - `defer_flush`: ``bool``
+        """
+        self._stream = stream
+        self.write = stream.write
+        if not defer_flush:
+            self.flush = stream.flush
+
+    def flush(self): # pylint: disable = E0202
+        """ Flush the stream (deferred) """
+        pass
+
+    def close(self):
+        """ Close the stream (leaves the connection writer alone) """
+        self._stream = None
 
 
 class ChunkedReader(object):
@@ -431,6 +808,8 @@ class HTTPConnection(object):
      - `persist`: Does the connection persist? This property may be queried
        on a higher level in orer to determine whether to close a connection
        or not.
+     - `shared`: Are the streams shared between the requests on the
+       connection? Shared streams are not closed by `close`.
      - `reader`: Reading stream for this connection
      - `writer`: Writing stream for this connection
      - `headers`: Header dictionary to add to the outgoing headers. This
@@ -441,29 +820,38 @@ class HTTPConnection(object):
      - `KEEPERS`: ``dict``
      - `_request`: `HTTPRequest`
      - `persist`: ``bool``
+     - `shared`: ``bool``
      - `reader`: `wtf.stream.GenericStream`
      - `writer`: `wtf.stream.GenericStream`
      - `headers`: ``dict``
     """
-    reader, writer, persist = None, None, False
+    reader, writer, persist, shared = None, None, False, False
     DROPPERS = dict.fromkeys((400, 405, 408, 411, 413, 414, 500, 501, 503))
     KEEPERS = dict.fromkeys((204, 205, 304))
 
-    def __init__(self, request, connection):
+    def __init__(self, request, connection, streams=None):
         """
         Initialization
 
         :Parameters:
          - `request`: The request instance
          - `connection`: The connection instance
+         - `streams`: Reading and writing stream shared between the requests
+           on the connection (``(reader, writer)``). If omitted or ``None``,
+           the request gets its own streams.
 
         :Types:
          - `request`: `HTTPRequest`
          - `connection`: `wtf.impl.http.Connection`
+         - `streams`: ``tuple``
         """
         self._request = request
-        self.reader = connection.reader()
-        self.writer = connection.writer()
+        if streams is None:
+            self.reader = connection.reader()
+            self.writer = connection.writer()
+        else:
+            self.reader, self.writer = streams
+            self.shared = True
         self.headers = {'connection': 'close'}
         self.settimeout = connection.settimeout
 
@@ -472,6 +860,9 @@ class HTTPConnection(object):
 
     def close(self):
         """ Close the HTTP streams """
+        if self.shared:
+            self.reader = self.writer = None
+            return
         try:
             try:
                 reader, self.reader = self.reader, None
@@ -565,3 +956,15 @@ class HTTPConnection(object):
         # pylint: disable = W0613
 
         raise AssertionError("Object not initialized properly")
+
+
+from wtf import c_override
+cimpl = c_override('_wtf_cutil')
+if cimpl is not None:
+    # pylint: disable = E1103
+    header_block = cimpl.header_block
+cimpl = c_override('_wtf_chttp')
+if cimpl is not None:
+    # pylint: disable = E1103
+    parse_head = cimpl.parse_head
+del c_override, cimpl
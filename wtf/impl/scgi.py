@@ -24,7 +24,6 @@ __author__ = u"Andr\xe9 Malo"
 __docformat__ = "restructuredtext en"
 
 import errno as _errno
-import itertools as _it
 import socket as _socket
 import sys as _sys
 import traceback as _traceback
@@ -46,17 +45,28 @@ class SCGIServer(object):
     """
     SCGI server
 
+    :CVariables:
+     - `_OVERLOADED`: Message of the overload response
+     - `_SHED_TIMEOUT`: Socket timeout while rejecting a request in seconds
+
     :IVariables:
      - `config`: Configuration
      - `opts`: Command line options
      - `args`: Positioned command line arguments
 
     :Types:
+     - `_OVERLOADED`: ``str``
+     - `_SHED_TIMEOUT`: ``float``
      - `config`: `wtf.config.Config`
      - `opts`: ``optparse.OptionContainer``
      - `args`: ``list``
     """
     __implements__ = [_impl.ServerInterface]
+    _OVERLOADED = (
+        "The server is too busy to process the request right now. "
+        "Please try again later."
+    )
+    _SHED_TIMEOUT = 5.0
 
     def __init__(self, config, opts, args):
         """
@@ -110,6 +120,38 @@ class SCGIServer(object):
             except:
                 pass # not much we can do here anyway. Log it?
 
+    def shed(self, (sock, peername), flags, retry_after):
+        """
+        Reject an accepted socket because of overload
+
+        The request environment is read (so the webserver actually receives
+        the response), the body is not.
+
+        :See: `wtf.impl.ServerInterface`
+        """
+        conn = _connection.Connection(sock, peername)
+        try:
+            conn.settimeout(self._SHED_TIMEOUT)
+            request = SCGIRequest(self, conn, flags)
+            try:
+                try:
+                    request.read_environ()
+                    request.error(
+                        "503 Service Unavailable", self._OVERLOADED,
+                        [("Retry-After", str(retry_after))]
+                    )
+                except (NetStringError, KeyError, ValueError, _socket.error):
+                    pass
+            finally:
+                request.close()
+        finally:
+            try:
+                conn.close()
+            except (SystemExit, KeyboardInterrupt):
+                raise
+            except:
+                pass
+
 
 class Gateway(_gateway.Gateway):
     """ SCGI implementation specific gateway """
@@ -157,6 +199,7 @@ class Gateway(_gateway.Gateway):
             'wsgi.multithread':  request.flags.multithread,
             'wsgi.multiprocess': request.flags.multiprocess,
             'wsgi.run_once':     request.flags.run_once,
+            'wtf.worker.status': request.flags.status,
             'wsgi.input':        request.request_body_stream or
                                      _stream.dev_null,
             'wsgi.url_scheme':   self._detect_scheme(environ) or
@@ -165,6 +208,15 @@ class Gateway(_gateway.Gateway):
 
         return environ, request.start_response
 
+    def _file_stream(self, request):
+        """
+        Determine the raw connection stream for sending a file
+
+        :See: `_gateway.Gateway._file_stream`
+        """
+        # HEAD responses don't have a body stream
+        return request._response_body_stream # pylint: disable = W0212
+
     def _detect_scheme_default(self, environ):
         """ HTTPS environment scheme detector (SSL directly in gateway) """
         if environ.get('HTTPS', '').lower() == 'on':
@@ -235,10 +287,9 @@ class SCGIRequest(object):
 
         :Exceptions:
          - `NetStringError`: Error reading or interpreting the netstring
+         - `ValueError`: Invalid header block or content length
         """
-        block = iter(self.connection.read_netstring().split('\0'))
-        env = dict(_it.izip(block, block))
-        clen = int(env['CONTENT_LENGTH'])
+        env, clen = _impl_util.scgi_environ(self.connection.read_netstring())
         if clen > 0:
             self.request_body_stream = _stream.GenericStream(
                 _impl_util.ContentLengthReader(
@@ -274,21 +325,25 @@ class SCGIRequest(object):
             self._response_body_stream = stream = writer
         return stream
 
-    def error(self, status, message):
+    def error(self, status, message, headers=()):
         """
         Emit a simple error
 
         :Parameters:
          - `status`: Status line
          - `message`: Message
+         - `headers`: Additional headers (``[(name, value), ...]``)
 
         :Types:
          - `status`: ``str``
          - `message`: ``str``
+         - `headers`: ``iterable``
         """
         out = "%s\n%s\n" % (status, message)
         write = self.connection.writer.write
         write("Status: %s\n" % status)
+        for name, value in headers:
+            write("%s: %s\n" % (name, value))
         write("Content-Type: text/plain\n")
         write("Content-Length: %s\n" % len(out))
         write("\n")
@@ -299,16 +354,23 @@ class SCGIConnection(object):
     """
     SCGI connection
 
+    :CVariables:
+     - `_BLOCK`: Read size for the netstring
+     - `_MAX_SIZE_DIGITS`: Maximum number of digits of the netstring size
+
     :IVariables:
      - `reader`: Connection read stream
      - `writer`: Connection write stream
      - `settimeout`: Timeout setter
 
     :Types:
+     - `_BLOCK`: ``int``
+     - `_MAX_SIZE_DIGITS`: ``int``
      - `reader`: `stream.GenericStream`
      - `writer`: `stream.GenericStream`
      - `settimeout`: ``callable``
     """
+    _BLOCK, _MAX_SIZE_DIGITS = 8192, 9
 
     def __init__(self, connection):
         """
@@ -342,38 +404,39 @@ class SCGIConnection(object):
         """
         Read "netstring" from connection
 
+        The netstring is read blockwise. Octets read beyond its end are
+        pushed back into the reader.
+
         :return: The netstring value
         :rtype: ``str``
 
         :Exceptions:
          - `NetStringError`: Error reading or interpreting the netstring
         """
-        data = _stream.read_exact(self.reader, self._netstring_size())
-        if self.reader.read(1) != ',':
-            raise NetStringError("EOS before netstring delimiter")
-        return data
-
-    def _netstring_size(self):
-        """
-        Read netstring size from connection
-
-        :return: The netstring size
-        :rtype: ``int``
-
-        :Exceptions:
-         - `NetStringError`: Error reading or interpreting the number
-        """
-        chars, read = [], self.reader.read
-        push = chars.append
-        while True:
-            char = read(1)
-            if not char:
+        reader = self.reader
+        data = reader.read(self._BLOCK)
+        pos = data.find(':')
+        while pos < 0:
+            if len(data) > self._MAX_SIZE_DIGITS:
+                raise NetStringError(
+                    "Invalid netstring size: %r" % data[:self._MAX_SIZE_DIGITS]
+                )
+            chunk = reader.read(self._BLOCK)
+            if not chunk:
                 raise NetStringError("EOS before netstring size delimiter")
-            if char == ':':
-                break
-            push(char)
-        chars = ''.join(chars)
-        try:
-            return int(chars)
-        except ValueError:
-            raise NetStringError("Invalid netstring size: %r" % chars)
+            data += chunk
+            pos = data.find(':')
+        size = data[:pos]
+        if not size.isdigit() or len(size) > self._MAX_SIZE_DIGITS:
+            raise NetStringError("Invalid netstring size: %r" % size)
+
+        end = pos + int(size) + 2
+        if len(data) < end:
+            data += _stream.read_exact(reader, end - len(data))
+            if len(data) < end:
+                raise NetStringError("EOS before netstring delimiter")
+        elif len(data) > end:
+            reader.unread(data[end:])
+        if data[end - 1] != ',':
+            raise NetStringError("EOS before netstring delimiter")
+        return data[pos + 1:end - 1]
@@ -0,0 +1,320 @@
+# -*- coding: ascii -*-
+#
+# Copyright 2007-2012
+# Andr\xe9 Malo or his licensors, as applicable
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+uwsgi Implementation
+====================
+
+Here's the uwsgi handling implemented.
+
+A request starts with a 4 byte packet header (``modifier1``, the size of
+the variables block as 16 bit little endian number, ``modifier2``),
+followed by the variables block and the request body. The response is
+a plain HTTP response.
+"""
+__author__ = u"Andr\xe9 Malo"
+__docformat__ = "restructuredtext en"
+
+import errno as _errno
+import socket as _socket
+import struct as _struct
+import sys as _sys
+import traceback as _traceback
+
+from wtf import Error
+from wtf import impl as _impl
+from wtf import stream as _stream
+from wtf.impl import _connection
+from wtf.impl import _gateway
+from wtf.impl import _util as _impl_util
+
+
+class PacketError(Error):
+    """ uwsgi packet error """
+
+
+class UWSGIServer(object):
+    """
+    uwsgi server
+
+    :CVariables:
+     - `_OVERLOADED`: Message of the overload response
+     - `_SHED_TIMEOUT`: Socket timeout while rejecting a request in seconds
+
+    :IVariables:
+     - `config`: Configuration
+     - `opts`: Command line options
+     - `args`: Positioned command line arguments
+
+    :Types:
+     - `_OVERLOADED`: ``str``
+     - `_SHED_TIMEOUT`: ``float``
+     - `config`: `wtf.config.Config`
+     - `opts`: ``optparse.OptionContainer``
+     - `args`: ``list``
+    """
+    __implements__ = [_impl.ServerInterface]
+    _OVERLOADED = (
+        "The server is too busy to process the request right now. "
+        "Please try again later."
+    )
+    _SHED_TIMEOUT = 5.0
+
+    def __init__(self, config, opts, args):
+        """
+        Initialization
+
+        :See: `wtf.impl.ServerInterface`
+        """
+        self.config, self.opts, self.args = config, opts, args
+        self._gateway = Gateway(config, opts, args)
+
+    def handle(self, (sock, peername), application, flags):
+        """
+        Handle an accepted socket
+
+        :See: `wtf.impl.ServerInterface`
+        """
+        conn = _connection.Connection(sock, peername)
+        try:
+            conn.settimeout(None)
+            request = UWSGIRequest(self, conn, flags)
+            try:
+                try:
+                    self._gateway.handle(conn, request, application)
+                except _socket.error, e:
+                    if e[0] not in (_errno.EPIPE, _errno.ECONNRESET):
+                        raise
+                    print >> _sys.stderr, "Connection to webserver died."
+                except (SystemExit, KeyboardInterrupt):
+                    raise
+                except:
+                    if not request.response_started:
+                        try:
+                            request.error(
+                                "500 Internal Server Error",
+                                "Something went wrong while processing the "
+                                "request. You might want to try again later. "
+                                "Sorry for the inconvenience."
+                            )
+                        except _socket.error:
+                            pass
+                    print >> _sys.stderr, \
+                        "Request aborted due to exception:\n" + ''.join(
+                            _traceback.format_exception(*_sys.exc_info())
+                        )
+            finally:
+                request.close()
+        finally:
+            try:
+                conn.close()
+            except (SystemExit, KeyboardInterrupt):
+                raise
+            except:
+                pass # not much we can do here anyway. Log it?
+
+    def shed(self, (sock, peername), flags, retry_after):
+        """
+        Reject an accepted socket because of overload
+
+        The request variables are read (so the webserver actually receives
+        the response), the body is not.
+
+        :See: `wtf.impl.ServerInterface`
+        """
+        conn = _connection.Connection(sock, peername)
+        try:
+            conn.settimeout(self._SHED_TIMEOUT)
+            request = UWSGIRequest(self, conn, flags)
+            try:
+                try:
+                    request.read_environ()
+                    request.error(
+                        "503 Service Unavailable", self._OVERLOADED,
+                        [("Retry-After", str(retry_after))]
+                    )
+                except (PacketError, ValueError, _socket.error):
+                    pass
+            finally:
+                request.close()
+        finally:
+            try:
+                conn.close()
+            except (SystemExit, KeyboardInterrupt):
+                raise
+            except:
+                pass
+
+
+class Gateway(_gateway.Gateway):
+    """ uwsgi implementation specific gateway """
+
+    def _init_from_request(self, connection, request):
+        """
+        Create uwsgi implementation specific request environment
+
+        :See: `_gateway.Gateway._init_from_request`
+        """
+        environ = request.read_environ()
+        scheme = environ.get('UWSGI_SCHEME', '').lower()
+        if scheme not in ('http', 'https'):
+            if environ.get('HTTPS', '').lower() in ('on', '1'):
+                scheme = 'https'
+            else:
+                scheme = 'http'
+        environ.update({
+            'wsgi.multithread':  request.flags.multithread,
+            'wsgi.multiprocess': request.flags.multiprocess,
+            'wsgi.run_once':     request.flags.run_once,
+            'wtf.worker.status': request.flags.status,
+            'wsgi.input':        request.request_body_stream or
+                                     _stream.dev_null,
+            'wsgi.url_scheme':   scheme,
+        })
+
+        return environ, request.start_response
+
+    def _file_stream(self, request):
+        """
+        Determine the raw connection stream for sending a file
+
+        :See: `_gateway.Gateway._file_stream`
+        """
+        # HEAD responses don't have a body stream
+        return request._response_body_stream # pylint: disable = W0212
+
+
+class UWSGIRequest(object):
+    """ uwsgi Request abstraction """
+    _response_body_stream = None
+    request_body_stream = None
+    response_started = False
+    _env = None
+
+    def __init__(self, server, connection, flags):
+        """
+        Initialization
+
+        :Parameters:
+         - `server`: Server instance
+         - `connection`: Connection, this request is served on
+         - `flags`: Worker flags
+
+        :Types:
+         - `server`: `UWSGIServer`
+         - `connection`: `Connection`
+         - `flags`: `FlagsInterface`
+        """
+        self._server = server
+        self._reader = connection.reader()
+        self._writer = connection.writer()
+        self.flags = flags
+
+    def close(self):
+        """ Close all streams """
+        if self._response_body_stream is not None:
+            self._response_body_stream.close() # fluuuush
+        try:
+            reader, self._reader = self._reader, None
+            if reader is not None:
+                reader.close()
+        finally:
+            writer, self._writer = self._writer, None
+            if writer is not None:
+                writer.close()
+
+    def read_environ(self):
+        """
+        Read the environ from the socket
+
+        :return: The variables dict
+        :rtype: ``dict``
+
+        :Exceptions:
+         - `PacketError`: Error reading or interpreting the packet
+        """
+        header = _stream.read_exact(self._reader, 4)
+        if len(header) < 4:
+            raise PacketError("EOS before end of packet header")
+        modifier1, size, _ = _struct.unpack('<BHB', header)
+        if modifier1 != 0:
+            raise PacketError("Unsupported packet type %d" % modifier1)
+        data = _stream.read_exact(self._reader, size)
+        if len(data) < size:
+            raise PacketError("EOS before end of packet")
+        try:
+            env = _impl_util.uwsgi_vars(data)
+            clen = int(env.get('CONTENT_LENGTH') or 0)
+        except ValueError, e:
+            raise PacketError(str(e))
+        if clen > 0:
+            self.request_body_stream = _stream.GenericStream(
+                _impl_util.ContentLengthReader(self._reader, clen),
+                read_exact=True,
+            )
+        self._env = env
+        return env
+
+    def start_response(self, status, headers):
+        """
+        Start response and determine output stream
+
+        :Parameters:
+         - `status`: Response status line
+         - `headers`: Response headers (``[(key, value), ...]``)
+
+        :Types:
+         - `status`: ``str``
+         - `headers`: ``list``
+
+        :return: response stream
+        :rtype: `stream.GenericStream`
+        """
+        self.response_started = True
+        protocol = (self._env or {}).get('SERVER_PROTOCOL', '')
+        if not protocol.startswith('HTTP/'):
+            protocol = 'HTTP/1.0'
+        writer = self._writer
+        writer.write("%s %s\r\n" % (protocol, status))
+        writer.writelines("%s: %s\r\n" % (key, value)
+            for key, value in headers)
+        writer.write("\r\n")
+        if (self._env or {}).get('REQUEST_METHOD') == 'HEAD':
+            stream = _stream.dev_null
+        else:
+            self._response_body_stream = stream = writer
+        return stream
+
+    def error(self, status, message, headers=()):
+        """
+        Emit a simple error
+
+        :Parameters:
+         - `status`: Status line
+         - `message`: Message
+         - `headers`: Additional headers (``[(name, value), ...]``)
+
+        :Types:
+         - `status`: ``str``
+         - `message`: ``str``
+         - `headers`: ``iterable``
+        """
+        out = "%s\n%s\n" % (status, message)
+        headers = list(headers) + [
+            ("Content-Type", "text/plain"),
+            ("Content-Length", str(len(out))),
+        ]
+        self.start_response(status, headers).write(out)
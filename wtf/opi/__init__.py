@@ -35,7 +35,7 @@ The typical way to load the proper implementation is::
 This evaluates the [wtf] section of the config, where the following options
 are recognized:
 
-protocol = ``scgi|http``
+protocol = ``scgi|http|fastcgi|uwsgi``
   Required option, because there's no sensible default. ``fastcgi`` also
   handles regular CGI if:
 
@@ -178,7 +178,10 @@ class Runner(object):
                 bind = opi.config.wtf.listen
             except KeyError:
                 raise ConfigurationError("Missing listen configuration")
-        sock = _listener.ListenerSocket(bind, basedir=opi.config.ROOT)
+        sock = _listener.ListenerSocket(
+            bind, basedir=opi.config.ROOT,
+            reuseport=opi.config.wtf('reuseport', False),
+        )
         try:
             baseworker = _worker.factory(opi.config, opi.opts, opi.args)
             worker = baseworker.setup(
@@ -355,6 +358,7 @@ class DetachedRunner(Runner):
         def parent_cleanup():
             """ Cleanup parent after fork """
             _os.close(wfd)
+            err_fd.finish()
 
         pidfile = self._daemonopi.pidfile
         def child_cleanup():
@@ -34,6 +34,9 @@ All listening sockets are represented by this single abstraction.
 
   `AF_UNIX` : ``int``
     UNIX address family (``None`` if not available)
+
+  `SO_REUSEPORT` : ``int``
+    SO_REUSEPORT socket option (``None`` if not available)
 """
 __author__ = u"Andr\xe9 Malo"
 __docformat__ = "restructuredtext en"
@@ -52,6 +55,14 @@ from wtf.config import ConfigurationError
 AF_INET = _socket.AF_INET
 AF_INET6 = getattr(_socket, "AF_INET6", None)
 AF_UNIX = getattr(_socket, "AF_UNIX", None)
+SO_REUSEPORT = getattr(_socket, "SO_REUSEPORT", None)
+if SO_REUSEPORT is None and _sys.platform.startswith('linux') and \
+        _re.match(r'(?:i\d86|x86_64|amd64|arm|aarch64|ppc|powerpc|s390|'
+                  r'riscv|ia64)', _os.uname()[4].lower()):
+    # not exported by python 2, but there since linux 3.9. The value is
+    # architecture specific (alpha, mips, parisc and sparc differ), so
+    # only the ones using the generic value are listed.
+    SO_REUSEPORT = 15
 
 
 class ShutdownWarning(WtfWarning):
@@ -81,6 +92,11 @@ class ListenerSocket(object):
     This actually can contain more than one actual socket, but provides
     an interface as it was one.
 
+    If `reuseport` is enabled, the TCP sockets are only bound, but not set
+    to the LISTEN state. Every worker process opens its own listening
+    SO_REUSEPORT sockets instead (via `shard`), so the kernel distributes
+    the incoming connections among them.
+
     :CVariables:
       `_TYPES` : ``tuple``
         Supported socket types and configuration patterns
@@ -89,6 +105,9 @@ class ListenerSocket(object):
     :IVariables:
       `_sockets` : ``list``
         List of actual sockets (``[socket, ...]``)
+
+      `_reuseport` : ``bool``
+        Shard the TCP sockets using SO_REUSEPORT?
     """
     _TYPES = (
         (u'tcp', (
@@ -101,7 +120,7 @@ class ListenerSocket(object):
     )
     _sockets = None
 
-    def __init__(self, listen, basedir=None):
+    def __init__(self, listen, basedir=None, reuseport=False):
         """
         Initialization
 
@@ -111,10 +130,20 @@ class ListenerSocket(object):
 
           `basedir` : ``str``
             Basedir for relative paths
+
+          `reuseport` : ``bool``
+            Shard the TCP sockets using SO_REUSEPORT?
+
+        :Exceptions:
+          - `ConfigurationError`: Invalid listen configuration or
+            SO_REUSEPORT not available
         """
         listen = tuple(listen)
         if not listen:
             raise ConfigurationError("No listeners configured")
+        if reuseport and SO_REUSEPORT is None:
+            raise ConfigurationError("SO_REUSEPORT is not available")
+        self._reuseport = bool(reuseport)
 
         # The way some OS work require us to follow a two-step-approach here:
         # First we "prepare" the sockets by determining the details for
@@ -163,7 +192,8 @@ class ListenerSocket(object):
         """
         Finalize the listening sockets
 
-        This method actually sets the sockets to the LISTEN state.
+        This method actually sets the sockets to the LISTEN state. Shardable
+        sockets are only bound (see `shard`).
 
         :Parameters:
          - `msg`: Configuration error message template
@@ -194,7 +224,8 @@ class ListenerSocket(object):
             socket.setblocking(False)
             try:
                 socket.bind()
-                socket.listen(_socket.SOMAXCONN)
+                if not socket.shardable:
+                    socket.listen(_socket.SOMAXCONN)
             except _socket.error, e:
                 stre = str(e)
                 e = _sys.exc_info()
@@ -215,7 +246,9 @@ class ListenerSocket(object):
                 _warnings.warn("Socket shutdown problem: %s" % str(e),
                     category=ShutdownWarning)
 
-        return Acceptor(item.realsocket for item in self._sockets)
+        return Acceptor(
+            item.realsocket for item in self._sockets if not item.shardable
+        )
 
     def __del__(self):
         self.close()
@@ -231,6 +264,36 @@ class ListenerSocket(object):
                     _warnings.warn("Socket shutdown problem: %s" % str(e),
                         category=ShutdownWarning)
 
+    def shard(self):
+        """
+        Create the listener shard for the current worker process
+
+        If SO_REUSEPORT sharding is not enabled, the listener itself is
+        returned. Otherwise new listening sockets are opened for all
+        shardable bindings, while the others are shared.
+
+        :return: The listener (shard), providing an ``accept`` method
+        :rtype: `ListenerSocket` or `ListenerShard`
+
+        :Exceptions:
+         - `SocketError`: The shard sockets could not be opened
+        """
+        if not self._reuseport:
+            return self
+        return ListenerShard(self._sockets)
+
+    def retire(self):
+        """
+        Stop listening in the current worker process
+
+        The sockets are shared with the other worker processes, so they
+        are left alone. See `ListenerShard.retire`.
+
+        :return: The connections left over (none)
+        :rtype: ``list``
+        """
+        return []
+
     def _setup_tcp(self, bind, basedir=None):
         """
         Setup TCP/IP(v6) socket and append it to the global list
@@ -271,9 +334,12 @@ class ListenerSocket(object):
                         continue
                     raise
                 socket.setsockopt(_socket.SOL_SOCKET, _socket.SO_REUSEADDR, 1)
-                self._sockets.append(
-                    InetSocket(socket, obind, host, family, bind)
-                )
+                if self._reuseport:
+                    socket.setsockopt(_socket.SOL_SOCKET, SO_REUSEPORT, 1)
+                self._sockets.append(InetSocket(
+                    socket, obind, host, family, bind,
+                    shardable=self._reuseport,
+                ))
         except _socket.error:
             e = _sys.exc_info()
             try:
@@ -315,6 +381,93 @@ class ListenerSocket(object):
         self._sockets.append(UnixSocket(socket, obind, path, umask))
 
 
+class ListenerShard(object):
+    """
+    Listener shard of a single worker process
+
+    :IVariables:
+     - `_sockets`: List of the sockets opened by this shard
+
+    :Types:
+     - `_sockets`: ``list``
+    """
+    _sockets = None
+
+    def __init__(self, sockets):
+        """
+        Initialization
+
+        :Parameters:
+         - `sockets`: The sockets of the main listener. The shardable ones
+           are replaced by fresh listening sockets, the others are shared.
+
+        :Types:
+         - `sockets`: ``iterable``
+
+        :Exceptions:
+         - `SocketError`: The shard sockets could not be opened
+        """
+        self._sockets, accept = [], []
+        for socket in sockets:
+            if socket.shardable:
+                try:
+                    socket = socket.shard()
+                except _socket.error:
+                    self.close()
+                    e = _sys.exc_info()
+                    try:
+                        raise SocketError, e[1], e[2]
+                    finally:
+                        del e
+                self._sockets.append(socket)
+            accept.append(socket.realsocket)
+        self.accept = Acceptor(accept)
+
+    def __del__(self):
+        self.close()
+
+    def retire(self):
+        """
+        Stop listening
+
+        The shard's own sockets are closed, so the kernel stops assigning
+        new connections to this process. The connections already waiting
+        in their backlog would be reset by that, so they're accepted
+        first (without blocking).
+
+        :return: The connections left over (``[(sock, peer), ...]``)
+        :rtype: ``list``
+        """
+        result = []
+        for socket in self._sockets or ():
+            while True:
+                try:
+                    sock, peer = socket.realsocket.accept()
+                except _socket.error, e:
+                    if e[0] in (_errno.EAGAIN, _errno.EWOULDBLOCK):
+                        break
+                    elif e[0] in Acceptor._IGNOREFAIL:
+                        continue
+                    _warnings.warn("Socket shutdown problem: %s" % str(e),
+                        category=ShutdownWarning)
+                    break
+                _osutil.close_on_exec(sock.fileno())
+                result.append((sock, peer))
+        self.close()
+        return result
+
+    def close(self):
+        """ Shutdown the shard's own sockets """
+        sockets, self._sockets = self._sockets, None
+        if sockets is not None:
+            for socket in sockets:
+                try:
+                    socket.close()
+                except (_socket.error, OSError), e:
+                    _warnings.warn("Socket shutdown problem: %s" % str(e),
+                        category=ShutdownWarning)
+
+
 class SocketDecorator(object):
     """
     Socket decorating container
@@ -332,12 +485,17 @@ class SocketDecorator(object):
     :IVariables:
      - `realsocket`: The actual socket object
      - `bindspec`: The bind specification from the config
+     - `shardable`: Is the socket sharded per worker process (see
+       `shard`)?
 
     :Types:
      - `_famcomp`: ``dict``
      - `realsocket`: ``socket.socket``
      - `bindspec`: ``str``
+     - `shardable`: ``bool``
     """
+    shardable = False
+
     _famcomp = dict((fam, idx) for idx, fam in enumerate((
         AF_UNIX, AF_INET6, AF_INET
     )) if fam is not None)
@@ -435,6 +593,20 @@ class SocketDecorator(object):
         """ Bind the socket according to its bindspec """
         raise NotImplementedError()
 
+    def shard(self):
+        """
+        Open a new listening socket with the same binding
+
+        The new socket has the same `key` as this one.
+
+        :return: The new socket
+        :rtype: `SocketDecorator`
+
+        :Exceptions:
+         - `socket.error`: Error while opening the socket
+        """
+        raise NotImplementedError()
+
     def family(self):
         """
         Determine the socket address family
@@ -548,7 +720,8 @@ class InetSocket(SocketDecorator):
      - `_host`: ``str``
      - `_family`: ``int``
     """
-    def __init__(self, socket, bindspec, host, family, bind):
+    def __init__(self, socket, bindspec, host, family, bind,
+                 shardable=False):
         """
         Initialization
 
@@ -558,6 +731,7 @@ class InetSocket(SocketDecorator):
          - `host`: Hostname/IP or ``None``
          - `family`: Socket family
          - `bind`: bind value from ``getaddrinfo(3)``
+         - `shardable`: Shard the socket using SO_REUSEPORT?
 
         :Types:
          - `socket`: ``socket.socket``
@@ -565,9 +739,11 @@ class InetSocket(SocketDecorator):
          - `host`: ``str``
          - `family`: ``int``
          - `bind`: ``tuple``
+         - `shardable`: ``bool``
         """
         super(InetSocket, self).__init__(socket, bindspec)
         self._bind, self._host, self._family = bind, host, family
+        self.shardable = shardable
 
     def __cmp__(self, other):
         """
@@ -586,6 +762,26 @@ class InetSocket(SocketDecorator):
         """ Bind the socket according to bindspec """
         self.realsocket.bind(self._bind)
 
+    def shard(self):
+        """ Open a new listening SO_REUSEPORT socket """
+        realsocket = self.realsocket
+        socket = _socket.socket(
+            self._family, realsocket.type, realsocket.proto
+        )
+        try:
+            socket.setsockopt(_socket.SOL_SOCKET, _socket.SO_REUSEADDR, 1)
+            socket.setsockopt(_socket.SOL_SOCKET, SO_REUSEPORT, 1)
+            _osutil.close_on_exec(socket)
+            socket.setblocking(False)
+            socket.bind(self._bind)
+            socket.listen(_socket.SOMAXCONN)
+        except:
+            socket.close()
+            raise
+        return InetSocket(
+            socket, self.bindspec, self._host, self._family, self._bind
+        )
+
     def family(self):
         """ Determine the socket family """
         return self._family
@@ -628,13 +824,8 @@ class Acceptor(object):
         :Types:
          - `sockets`: ``iterable``
         """
-        import collections, select
-        try:
-            pollset = select.poll
-        except AttributeError:
-            pollset = _SelectAdapter()
-        else:
-            pollset = _PollAdapter()
+        import collections
+        pollset = pollset_factory()
         self._fdmap = {}
         for socket in sockets:
             fd = socket.fileno()
@@ -643,6 +834,25 @@ class Acceptor(object):
         self._set = pollset
         self._backlog = collections.deque()
 
+    def add(self, source):
+        """
+        Add another connection source
+
+        The source is polled along with the listener sockets. Its ``accept``
+        method is called as soon as it becomes readable. It's expected to
+        return the same as a socket's ``accept`` method.
+
+        :Parameters:
+         - `source`: The connection source (providing ``fileno`` and
+           ``accept`` methods)
+
+        :Types:
+         - `source`: any
+        """
+        fd = source.fileno()
+        self._set.add(fd)
+        self._fdmap[fd] = source
+
     def __call__(self, timeout=None):
         """
         Accept a new connection
@@ -674,6 +884,53 @@ class Acceptor(object):
             _osutil.close_on_exec(sock.fileno())
             return sock, peer
 
+    def batch(self, size, timeout=None):
+        """
+        Accept a batch of new connections
+
+        After a readiness notification every ready socket is drained
+        (accepting until it would block), until `size` connections are
+        collected. Sockets left over are served first by the next call,
+        without polling again.
+
+        :Parameters:
+         - `size`: Maximum number of connections to accept
+         - `timeout`: Timeout in seconds
+
+        :Types:
+         - `size`: ``int``
+         - `timeout`: ``float``
+
+        :return: New sockets and their peernames (``[(sock, peer), ...]``,
+                 at least one)
+        :rtype: ``list``
+
+        :Exceptions:
+         - `SocketTimeout`: accept call timed out
+         - `SocketError`: An error occured while accepting the socket
+        """
+        backlog, fdmap, result = self._backlog, self._fdmap, []
+        size = max(1, size)
+        while not result:
+            if not backlog:
+                self._poll(timeout)
+            while backlog and len(result) < size:
+                try:
+                    sock, peer = fdmap[backlog[-1]].accept()
+                except _socket.error, e:
+                    if e[0] in (_errno.EAGAIN, _errno.EWOULDBLOCK):
+                        backlog.pop() # drained
+                    elif e[0] not in self._IGNOREFAIL:
+                        e = _sys.exc_info()
+                        try:
+                            raise SocketError, e[1], e[2]
+                        finally:
+                            del e
+                    continue
+                _osutil.close_on_exec(sock.fileno())
+                result.append((sock, peer))
+        return result
+
     def _accept(self, timeout=None):
         """
         Accept a connection
@@ -694,30 +951,73 @@ class Acceptor(object):
         """
         backlog = self._backlog
         if not backlog:
-            pollset, timeout_used = self._set, timeout
-            if timeout_used is None:
-                timeout_used = 1000
-            else:
-                timeout_used = int(timeout_used * 1000)
-            while True:
-                try:
-                    ready = pollset.poll(timeout_used)
-                except pollset.error, e:
-                    if e[0] == _errno.EINTR:
-                        continue
-                    e = _sys.exc_info()
-                    try:
-                        raise SocketPollError, e[1], e[2]
-                    finally:
-                        del e
-                if ready:
-                    break
-                elif timeout is None:
-                    continue
-                raise SocketTimeout(timeout)
-            backlog.extendleft(item[0] for item in ready)
+            self._poll(timeout)
         return self._fdmap[backlog.pop()].accept()
 
+    def _poll(self, timeout=None):
+        """
+        Wait for ready sockets and put them into the backlog
+
+        :Parameters:
+         - `timeout`: Timeout in seconds
+
+        :Types:
+         - `timeout`: ``float``
+
+        :Exceptions:
+         - `SocketTimeout`: poll call timed out
+         - `SocketPollError`: Error with poll call
+        """
+        pollset, timeout_used = self._set, timeout
+        if timeout_used is None:
+            timeout_used = 1000
+        else:
+            timeout_used = int(timeout_used * 1000)
+        while True:
+            try:
+                ready = pollset.poll(timeout_used)
+            except pollset.error, e:
+                if e[0] == _errno.EINTR:
+                    continue
+                e = _sys.exc_info()
+                try:
+                    raise SocketPollError, e[1], e[2]
+                finally:
+                    del e
+            if ready:
+                break
+            elif timeout is None:
+                continue
+            raise SocketTimeout(timeout)
+        self._backlog.extendleft(item[0] for item in ready)
+
+
+def pollset_factory(edge=False):
+    """
+    Create the best poll set available on this platform
+
+    That's (in this order) ``epoll``, ``poll`` or ``select`` based. All of
+    them provide the `_AdapterInterface` and watch their descriptors for
+    reading.
+
+    :Parameters:
+     - `edge`: Prefer edge triggered notifications? Only ``epoll`` supports
+       them. The caller needs to read every descriptor reported until it
+       would block then.
+
+    :Types:
+     - `edge`: ``bool``
+
+    :return: New poll set
+    :rtype: `_AdapterInterface`
+    """
+    import select
+    if hasattr(select, 'epoll'):
+        return _EpollAdapter(edge=edge)
+    elif hasattr(select, 'poll'):
+        return _PollAdapter()
+    return _SelectAdapter()
+
 
 class _AdapterInterface(object):
     """
@@ -725,9 +1025,11 @@ class _AdapterInterface(object):
 
     :IVariables:
      - `error`: Exception to catch on poll()
+     - `ERROR`: Event mask of error conditions
 
     :Types:
      - `error`: ``Exception``
+     - `ERROR`: ``int``
     """
 
     def __init__(self):
@@ -774,16 +1076,21 @@ class _AdapterInterface(object):
         :Types:
          - `timeout`: ``int``
 
-        :return: List of (descriptor, event) tuples, event is useless, though
+        :return: List of (descriptor, event) tuples. The event only tells
+                 about error conditions (see `ERROR`), though.
         :rtype: ``list``
 
         :Exceptions:
          - `self.error`: Select error occured
         """
 
+    def close(self):
+        """ Release the resources held by the poll set """
+
 
 class _SelectAdapter(object):
     __implements__ = [_AdapterInterface]
+    ERROR = 0
 
     def __init__(self):
         import select
@@ -803,6 +1110,9 @@ class _SelectAdapter(object):
         rfds, _, _ = select.select(self._rfds, (), (), timeout)
         return [(item, 0) for item in rfds]
 
+    def close(self):
+        self._rfds.clear()
+
 
 class _PollAdapter(object):
     __implements__ = [_AdapterInterface]
@@ -810,6 +1120,7 @@ class _PollAdapter(object):
     def __init__(self):
         import select
         self.error = select.error
+        self.ERROR = select.POLLERR | select.POLLHUP | select.POLLNVAL
         self._pollset = select.poll()
         self.poll = self._pollset.poll
 
@@ -822,3 +1133,64 @@ class _PollAdapter(object):
 
     def poll(self, timeout=None):
         return self._pollset.poll(timeout)
+
+    def close(self):
+        self._pollset = None
+
+
+class _EpollAdapter(object):
+    __implements__ = [_AdapterInterface]
+
+    def __init__(self, edge=False):
+        import select
+        self.error = IOError
+        self.ERROR = select.EPOLLERR | select.EPOLLHUP
+        self._mask = select.EPOLLIN
+        if edge:
+            self._mask |= select.EPOLLET
+        self._fds = set()
+        self._epoll, self._pid = None, None
+
+    # The epoll instance is created lazily per process. Forked children
+    # would share the kernel object (and its registrations) otherwise.
+    def _get(self):
+        if self._pid != _os.getpid():
+            import select
+            epoll = select.epoll()
+            try:
+                _osutil.close_on_exec(epoll.fileno())
+                for fd in self._fds:
+                    epoll.register(fd, self._mask)
+            except:
+                epoll.close()
+                raise
+            # the inherited instance stays with the parent
+            self._epoll, self._pid = epoll, _os.getpid()
+        return self._epoll
+
+    def add(self, fd):
+        fd = int(fd)
+        if fd in self._fds:
+            raise IOError(_errno.EEXIST, "File exists")
+        if self._pid == _os.getpid():
+            self._epoll.register(fd, self._mask)
+        self._fds.add(fd)
+
+    def remove(self, fd):
+        fd = int(fd)
+        self._fds.remove(fd)
+        if self._pid == _os.getpid():
+            self._epoll.unregister(fd)
+
+    def poll(self, timeout=None):
+        if timeout is None:
+            timeout = -1
+        else:
+            timeout = float(timeout) / 1000.0
+        return self._get().poll(timeout)
+
+    def close(self):
+        self._fds.clear()
+        if self._epoll is not None:
+            self._epoll.close()
+        self._epoll, self._pid = None, None
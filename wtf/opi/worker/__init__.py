@@ -24,6 +24,12 @@ pool models. Currently there are:
 threaded
   There's one single process managing a threadpool. Accepted sockets
   are dispatched to a single worker thread.
+
+prefork
+  Several worker processes are forked, each managing its own threadpool
+  like the ``threaded`` model. All of them are accepting on the same
+  listener socket (or on their own SO_REUSEPORT shard of it, if
+  ``reuseport`` is enabled).
 """
 __author__ = u"Andr\xe9 Malo"
 __docformat__ = "restructuredtext en"
@@ -0,0 +1,303 @@
+# -*- coding: ascii -*-
+#
+# Copyright 2006-2012
+# Andr\xe9 Malo or his licensors, as applicable
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Threadpool Autoscaling
+======================
+
+The controller tracks the time tasks spend in the queue and the time they
+occupy a worker thread. Periodically it adjusts the number of spare
+threads, so that the queue wait stays below a target value.
+"""
+__author__ = u"Andr\xe9 Malo"
+__docformat__ = "restructuredtext en"
+
+import collections as _collections
+import math as _math
+import threading as _threading
+import time as _time
+
+
+class Controller(object):
+    """
+    Adaptive spare thread controller
+
+    The number of spare threads (``minspare``) is doubled as long as the
+    queue wait (both average and 95th percentile) exceeds the target. It's
+    decreased by one as soon as the average wait is well below the target
+    again and halved if there's no traffic at all. Without traffic the
+    pool asks for decisions periodically.
+    ``maxspare`` follows the number of threads needed for the current
+    load (Little's law: arrival rate times service time) plus the spare
+    ones.
+
+    :CVariables:
+     - `_HISTORY`: Number of decisions to remember
+
+    :IVariables:
+     - `target`: Target queue wait in seconds
+     - `interval`: Time between two decisions in seconds
+     - `minspare`: Current number of threads to keep ready
+     - `maxspare`: Current maximum number of idle threads
+     - `_floor`: Lower bound of `minspare`
+     - `_maxthreads`: Upper bound of the thread count
+     - `_wait`: Queue wait statistics
+     - `_service`: Service time statistics
+     - `_count`: Number of tasks since the last decision
+     - `_rate`: Arrival rate at the last decision (tasks per second)
+     - `_last`: Time of the last decision
+     - `_decisions`: Recent decisions
+     - `_lock`: Lock for the statistics
+
+    :Types:
+     - `_HISTORY`: ``int``
+     - `target`: ``float``
+     - `interval`: ``float``
+     - `minspare`: ``int``
+     - `maxspare`: ``int``
+     - `_floor`: ``int``
+     - `_maxthreads`: ``int``
+     - `_wait`: `Stats`
+     - `_service`: `Stats`
+     - `_count`: ``int``
+     - `_rate`: ``float``
+     - `_last`: ``float``
+     - `_decisions`: ``collections.deque``
+     - `_lock`: ``threading.Lock``
+    """
+    _HISTORY = 16
+
+    def __init__(self, target, interval, minspare, maxspare, maxthreads):
+        """
+        Initialization
+
+        :Parameters:
+         - `target`: Target queue wait in seconds
+         - `interval`: Time between two decisions in seconds
+         - `minspare`: Configured ``minspare`` (used as lower bound)
+         - `maxspare`: Configured ``maxspare`` (initial value)
+         - `maxthreads`: Configured ``maxthreads`` (used as upper bound)
+
+        :Types:
+         - `target`: ``float``
+         - `interval`: ``float``
+         - `minspare`: ``int``
+         - `maxspare`: ``int``
+         - `maxthreads`: ``int``
+        """
+        self.target, self.interval = target, interval
+        self.minspare, self.maxspare = minspare, maxspare
+        self._floor, self._maxthreads = minspare, maxthreads
+        self._wait, self._service = Stats(), Stats()
+        self._count, self._rate = 0, 0.0
+        self._last = _time.time()
+        self._decisions = _collections.deque()
+        self._lock = _threading.Lock()
+
+    def waited(self, seconds):
+        """
+        Record the queue wait of a task
+
+        :Parameters:
+         - `seconds`: The time the task spent in the queue
+
+        :Types:
+         - `seconds`: ``float``
+        """
+        self._lock.acquire()
+        try:
+            self._count += 1
+            self._wait.add(seconds)
+        finally:
+            self._lock.release()
+
+    def served(self, seconds):
+        """
+        Record the service time of a task
+
+        :Parameters:
+         - `seconds`: The time the task occupied a worker thread
+
+        :Types:
+         - `seconds`: ``float``
+        """
+        self._lock.acquire()
+        try:
+            self._service.add(seconds)
+        finally:
+            self._lock.release()
+
+    def adjust(self, now):
+        """
+        Make a decision, if it's time to
+
+        :Parameters:
+         - `now`: The current time
+
+        :Types:
+         - `now`: ``float``
+
+        :return: Were the spare bounds changed?
+        :rtype: ``bool``
+        """
+        if now < self._last + self.interval:
+            return False
+
+        self._lock.acquire()
+        try:
+            count, self._count = self._count, 0
+            self._rate = count / max(now - self._last, 0.001)
+            self._last = now
+            wait = self._wait.ewma
+            p95 = self._wait.percentile(95)
+            needed = int(_math.ceil(self._rate * self._service.ewma))
+        finally:
+            self._lock.release()
+
+        minspare, target = self.minspare, self.target
+        if count and wait > target and p95 > target:
+            minspare = min(self._maxthreads, max(minspare + 1, minspare * 2))
+            reason = "queue wait %.3fs (p95 %.3fs) above target" % (
+                wait, p95
+            )
+        elif not count:
+            minspare = max(self._floor, minspare // 2)
+            reason = "no traffic"
+        elif wait < target / 2:
+            minspare = max(self._floor, minspare - 1)
+            reason = "queue wait %.3fs (p95 %.3fs) below target" % (
+                wait, p95
+            )
+        else:
+            reason = None
+        maxspare = min(self._maxthreads, max(minspare, needed + minspare))
+
+        if (minspare, maxspare) == (self.minspare, self.maxspare):
+            return False
+        if reason is None:
+            reason = "%d busy threads needed" % needed
+        self._decisions.append((now, minspare, maxspare, reason))
+        while len(self._decisions) > self._HISTORY:
+            self._decisions.popleft()
+        self.minspare, self.maxspare = minspare, maxspare
+        return True
+
+    def status(self):
+        """
+        Retrieve the controller status
+
+        :return: The status (``{'target': float, 'interval': float,
+                 'minspare': int, 'maxspare': int, 'rate': float, 'wait':
+                 dict, 'service': dict, 'decisions': [(time, minspare,
+                 maxspare, reason), ...]}``). The `wait` and `service` dicts
+                 contain the keys ``ewma``, ``p50``, ``p95`` and ``p99``.
+        :rtype: ``dict``
+        """
+        self._lock.acquire()
+        try:
+            return dict(
+                target=self.target,
+                interval=self.interval,
+                minspare=self.minspare,
+                maxspare=self.maxspare,
+                rate=self._rate,
+                wait=self._wait.summary(),
+                service=self._service.summary(),
+                decisions=list(self._decisions),
+            )
+        finally:
+            self._lock.release()
+
+
+class Stats(object):
+    """
+    Timing statistics
+
+    Keeps an exponentially weighted moving average and a window of recent
+    samples (for the percentiles).
+
+    :CVariables:
+     - `_ALPHA`: Weight of a new sample in the moving average
+     - `_WINDOW`: Number of samples to keep
+
+    :IVariables:
+     - `ewma`: The moving average
+     - `_samples`: The recent samples (ring buffer)
+     - `_next`: Next position in the ring buffer
+
+    :Types:
+     - `_ALPHA`: ``float``
+     - `_WINDOW`: ``int``
+     - `ewma`: ``float``
+     - `_samples`: ``list``
+     - `_next`: ``int``
+    """
+    _ALPHA = 0.2
+    _WINDOW = 256
+
+    def __init__(self):
+        """ Initialization """
+        self.ewma, self._samples, self._next = 0.0, [], 0
+
+    def add(self, value):
+        """
+        Add a sample
+
+        :Parameters:
+         - `value`: The sample
+
+        :Types:
+         - `value`: ``float``
+        """
+        self.ewma += self._ALPHA * (value - self.ewma)
+        if len(self._samples) < self._WINDOW:
+            self._samples.append(value)
+        else:
+            self._samples[self._next] = value
+            self._next = (self._next + 1) % self._WINDOW
+
+    def percentile(self, percent):
+        """
+        Determine a percentile of the recent samples
+
+        :Parameters:
+         - `percent`: The percentile to compute (0..100)
+
+        :Types:
+         - `percent`: ``int``
+
+        :return: The percentile (``0.0`` if there are no samples)
+        :rtype: ``float``
+        """
+        samples = sorted(self._samples)
+        if not samples:
+            return 0.0
+        return samples[min(len(samples) - 1, len(samples) * percent // 100)]
+
+    def summary(self):
+        """
+        Summarize the statistics
+
+        :return: The summary (``{'ewma': float, 'p50': float, 'p95': float,
+                 'p99': float}``)
+        :rtype: ``dict``
+        """
+        return dict(
+            ewma=self.ewma,
+            p50=self.percentile(50),
+            p95=self.percentile(95),
+            p99=self.percentile(99),
+        )
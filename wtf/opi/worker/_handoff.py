@@ -0,0 +1,190 @@
+# -*- coding: ascii -*-
+#
+# Copyright 2006-2012
+# Andr\xe9 Malo or his licensors, as applicable
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Connection Handoff
+==================
+
+Connections are passed from one worker generation to the next one over a
+UNIX domain socket (``SCM_RIGHTS``). The channel is created by the main
+process, so every worker child inherits both ends.
+"""
+__author__ = u"Andr\xe9 Malo"
+__docformat__ = "restructuredtext en"
+
+import errno as _errno
+import os as _os
+import select as _select
+import socket as _socket
+
+from wtf import osutil as _osutil
+
+
+class Handoff(object):
+    """
+    Connection handoff channel
+
+    The receiving end can be polled along with the listener sockets. Its
+    `accept` method returns the next connection handed over. Idle
+    connections are parked directly, if a parking function is attached.
+
+    :CVariables:
+     - `_TIMEOUT`: Time to wait for a receiver, if the channel is full (in
+       seconds)
+
+    :IVariables:
+     - `_out`: The sending end
+     - `_in`: The receiving end
+     - `_stalled`: Did a send time out (nobody's listening)?
+     - `_park`: Parking function for idle connections (or ``None``)
+
+    :Types:
+     - `_TIMEOUT`: ``float``
+     - `_out`: ``socket.socket``
+     - `_in`: ``socket.socket``
+     - `_stalled`: ``bool``
+     - `_park`: ``callable``
+    """
+    _TIMEOUT = 1.0
+    _stalled = False
+    _park = None
+
+    def __init__(self):
+        """ Initialization """
+        self._out, self._in = _socket.socketpair(
+            _socket.AF_UNIX, _socket.SOCK_DGRAM
+        )
+        for sock in (self._out, self._in):
+            _osutil.close_on_exec(sock)
+            sock.setblocking(False)
+
+    def fileno(self):
+        """
+        Determine the descriptor of the receiving end
+
+        :return: The descriptor
+        :rtype: ``int``
+        """
+        return self._in.fileno()
+
+    def attach(self, park):
+        """
+        Attach a parking function for idle connections received
+
+        :Parameters:
+         - `park`: Parking function, called with the connection (as
+           accepted) and the remaining keep-alive timeout. It returns
+           whether it took over the connection (see
+           `wtf.impl.FlagsInterface.park`).
+
+        :Types:
+         - `park`: ``callable``
+        """
+        self._park = park
+
+    def send(self, sock, idle=None):
+        """
+        Hand over a connection
+
+        The local socket is closed in any case. If the connection cannot be
+        passed, it's dropped.
+
+        :Parameters:
+         - `sock`: The connection socket
+         - `idle`: Remaining keep-alive timeout in seconds, if the
+           connection is idle (waiting for the next request), ``None``
+           otherwise
+
+        :Types:
+         - `sock`: ``socket.socket``
+         - `idle`: ``float``
+
+        :return: Was the connection handed over?
+        :rtype: ``bool``
+
+        :Exceptions:
+         - `NotImplementedError`: Descriptor passing is not available. The
+           socket is left alone in this case.
+        """
+        sent, msg = False, str(sock.family)
+        if idle is not None:
+            msg = "%s:%.3f" % (msg, max(0.0, idle))
+        try:
+            while not self._stalled:
+                try:
+                    _osutil.send_fds(self._out, msg, [sock])
+                except OSError, e:
+                    if e[0] == _errno.EINTR:
+                        continue
+                    elif e[0] != _errno.EAGAIN:
+                        break
+                    try:
+                        _, ready, _ = _select.select(
+                            [], [self._out], [], self._TIMEOUT
+                        )
+                    except _select.error, e:
+                        if e[0] == _errno.EINTR:
+                            continue
+                        raise
+                    if not ready:
+                        self._stalled = True
+                else:
+                    sent = True
+                    break
+        except NotImplementedError:
+            raise
+        except:
+            sock.close()
+            raise
+        sock.close()
+        return sent
+
+    def accept(self):
+        """
+        Receive the next connection handed over
+
+        :return: The connection socket and the peername
+        :rtype: ``tuple``
+
+        :Exceptions:
+         - `socket.error`: Nothing to receive (``EAGAIN``) or other error
+        """
+        try:
+            msg, fds = _osutil.recv_fds(self._in, 16, 1)
+        except OSError, e:
+            raise _socket.error(e[0], e[1])
+        if not fds:
+            raise _socket.error(_errno.EAGAIN, "Nothing handed over")
+        family, idle = (msg.split(':', 1) + [None])[:2]
+        try:
+            sock = _socket.fromfd(fds[0], int(family), _socket.SOCK_STREAM)
+        finally:
+            _os.close(fds[0])
+        sock.setblocking(True)
+        try:
+            accepted = _osutil.disable_nagle(sock)
+        except _socket.error:
+            sock.close()
+            raise _socket.error(_errno.ECONNABORTED, "Connection is gone")
+        if idle is not None and self._park is not None:
+            if self._park(accepted, float(idle)):
+                raise _socket.error(_errno.EAGAIN, "Connection parked")
+        return accepted
+
+    def close(self):
+        """ Close the channel """
+        self._out.close()
+        self._in.close()
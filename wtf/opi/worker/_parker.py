@@ -0,0 +1,336 @@
+# -*- coding: ascii -*-
+#
+# Copyright 2006-2012
+# Andr\xe9 Malo or his licensors, as applicable
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Keep-Alive Connection Parker
+============================
+
+Idle keep-alive connections are handed over to a single reactor thread,
+which watches them for incoming data. As soon as a connection becomes
+readable, it's put back into the job queue. Connections idling longer than
+their keep-alive timeout are closed. On shutdown the remaining connections
+are handed over to the next worker generation (if possible).
+"""
+__author__ = u"Andr\xe9 Malo"
+__docformat__ = "restructuredtext en"
+
+import errno as _errno
+import fcntl as _fcntl
+import os as _os
+import socket as _socket
+import sys as _sys
+import thread as _thread
+import threading as _threading
+import time as _time
+import traceback as _traceback
+
+from wtf import osutil as _osutil
+from wtf.opi import listener as _listener
+
+
+class Parker(object):
+    """
+    Connection parker
+
+    :CVariables:
+     - `_SWEEP`: Interval of the timeout checks in seconds
+
+    :IVariables:
+     - `_put_task`: Job queue feeder
+     - `_handoff`: Connection handoff function (or ``None``)
+     - `_finished`: Event, set when the reactor thread is gone
+     - `_lock`: Lock for `_pending` and `_done`
+     - `_pending`: Newly parked connections (``[(task, deadline), ...]``)
+     - `_parked`: Watched connections (``{fd: (task, deadline)}``)
+     - `_done`: Was the parker shut down?
+     - `_signalled`: Was the reactor woken up already?
+     - `_poll`: Poll set
+     - `_wakeup`: Wakeup pipe (``(rfd, wfd)``)
+     - `_sweep`: Time of the next timeout check
+
+    :Types:
+     - `_SWEEP`: ``float``
+     - `_put_task`: ``callable``
+     - `_handoff`: ``callable``
+     - `_finished`: ``threading.Event``
+     - `_lock`: ``threading.Lock``
+     - `_pending`: ``list``
+     - `_parked`: ``dict``
+     - `_done`: ``bool``
+     - `_signalled`: ``bool``
+     - `_poll`: `wtf.opi.listener._AdapterInterface`
+     - `_wakeup`: ``tuple``
+     - `_sweep`: ``float``
+    """
+    _SWEEP = 0.5
+
+    def __init__(self, put_task, handoff=None):
+        """
+        Initialization
+
+        :Parameters:
+         - `put_task`: Job queue feeder, called with the connection (as
+           accepted) as soon as it becomes readable
+         - `handoff`: Connection handoff function, called with the
+           connection socket and the remaining keep-alive timeout on
+           shutdown. It may raise
+           ``NotImplementedError``, in which case the connections are closed.
+           If omitted or ``None``, they are closed anyway.
+
+        :Types:
+         - `put_task`: ``callable``
+         - `handoff`: ``callable``
+        """
+        self._put_task, self._handoff = put_task, handoff
+        self._finished = _threading.Event()
+        self._lock = _threading.Lock()
+        self._pending, self._parked = [], {}
+        self._done, self._signalled = False, False
+        self._poll = _listener.pollset_factory()
+        self._wakeup = tuple(map(_osutil.safe_fd, _os.pipe()))
+        for fd in self._wakeup:
+            _osutil.close_on_exec(fd)
+            _fcntl.fcntl(fd, _fcntl.F_SETFL,
+                _fcntl.fcntl(fd, _fcntl.F_GETFL) | _os.O_NONBLOCK)
+        self._poll.add(self._wakeup[0])
+        self._sweep = _time.time() + self._SWEEP
+
+    def start(self):
+        """ Start the reactor thread """
+        _thread.start_new_thread(self._run, ())
+
+    def shutdown(self):
+        """
+        Shutdown the parker
+
+        All parked connections are handed over or closed by the reactor
+        thread.
+        """
+        self._lock.acquire()
+        try:
+            if not self._done:
+                self._done = True
+                self._signal()
+        finally:
+            self._lock.release()
+
+    def wait(self, timeout):
+        """
+        Wait for the reactor thread to finish (after `shutdown`)
+
+        :Parameters:
+         - `timeout`: Maximum time to wait in seconds
+
+        :Types:
+         - `timeout`: ``float``
+        """
+        self._finished.wait(timeout)
+
+    def park(self, accepted, timeout):
+        """
+        Park a connection
+
+        The parker takes over the connection. If the parker was already
+        shut down, the connection is just closed.
+
+        :Parameters:
+         - `accepted`: The connection socket and peername
+         - `timeout`: Keep-alive timeout in seconds
+
+        :Types:
+         - `accepted`: ``tuple``
+         - `timeout`: ``float``
+
+        :return: Was the connection taken over? (always ``True``)
+        :rtype: ``bool``
+        """
+        self._lock.acquire()
+        try:
+            if not self._done:
+                self._pending.append((accepted, _time.time() + timeout))
+                self._signal()
+                return True
+        finally:
+            self._lock.release()
+        _close(accepted[0])
+        return True
+
+    def _signal(self):
+        """ Wake up the reactor (the lock must be held) """
+        if not self._signalled:
+            self._signalled = True
+            try:
+                _os.write(self._wakeup[1], "!")
+            except OSError, e:
+                if e[0] not in (_errno.EAGAIN, _errno.EINTR):
+                    raise
+
+    def _run(self):
+        """ Reactor thread main loop """
+        try:
+            try:
+                while self._react():
+                    pass
+            except:
+                _sys.stderr.write(
+                    "Uncaught exception in connection parker:\n" +
+                    _traceback.format_exc()
+                )
+        finally:
+            try:
+                parked, self._parked = self._parked, {}
+                for task, deadline in parked.itervalues():
+                    self._release(task[0], deadline)
+                self._lock.acquire()
+                try:
+                    self._done, pending, self._pending = \
+                        True, self._pending, []
+                finally:
+                    self._lock.release()
+                for task, deadline in pending:
+                    self._release(task[0], deadline)
+                for fd in self._wakeup:
+                    _os.close(fd)
+                self._poll.close()
+            finally:
+                self._finished.set()
+
+    def _release(self, sock, deadline=None):
+        """
+        Hand over or close a connection on shutdown
+
+        :Parameters:
+         - `sock`: The connection socket
+         - `deadline`: Keep-alive deadline of an idle connection, ``None``
+           if the connection is readable
+
+        :Types:
+         - `sock`: ``socket.socket``
+         - `deadline`: ``float``
+        """
+        if self._handoff is not None:
+            if deadline is not None:
+                deadline -= _time.time()
+            try:
+                self._handoff(sock, deadline)
+            except NotImplementedError:
+                self._handoff = None
+            except (SystemExit, KeyboardInterrupt):
+                raise
+            except:
+                pass # the socket is closed already
+            else:
+                return
+        _close(sock)
+
+    def _react(self):
+        """
+        Run one reactor cycle
+
+        :return: Continue running?
+        :rtype: ``bool``
+        """
+        wakeup, parked, poll = self._wakeup[0], self._parked, self._poll
+        ready, done = [], False
+        try:
+            events = poll.poll(int(self._SWEEP * 1000))
+        except poll.error, e:
+            if e[0] != _errno.EINTR:
+                raise
+            events = ()
+        for fd, event in events:
+            if fd == wakeup:
+                self._lock.acquire()
+                try:
+                    self._signalled = False
+                    try:
+                        while _os.read(wakeup, 512):
+                            pass
+                    except OSError, e:
+                        if e[0] not in (_errno.EAGAIN, _errno.EINTR):
+                            raise
+                    done = self._done
+                    pending, self._pending = self._pending, []
+                finally:
+                    self._lock.release()
+                for task, deadline in pending:
+                    fd = task[0].fileno()
+                    parked[fd] = task, deadline
+                    poll.add(fd)
+            elif fd in parked:
+                poll.remove(fd)
+                task, _ = parked.pop(fd)
+                if event & poll.ERROR or not _readable(task[0]):
+                    _close(task[0])
+                else:
+                    ready.append(task)
+
+        if done:
+            for task in ready:
+                self._release(task[0])
+            return False
+
+        now = _time.time()
+        if now >= self._sweep:
+            self._sweep = now + self._SWEEP
+            for fd, (task, deadline) in parked.items():
+                if deadline <= now:
+                    poll.remove(fd)
+                    del parked[fd]
+                    _close(task[0])
+
+        put_task = self._put_task
+        for task in ready:
+            put_task(task)
+        return True
+
+
+def _readable(sock):
+    """
+    Check if the socket has data available (and is not at EOF)
+
+    :Parameters:
+     - `sock`: The socket to check
+
+    :Types:
+     - `sock`: ``socket.socket``
+
+    :return: Is there data to read?
+    :rtype: ``bool``
+    """
+    try:
+        return bool(sock.recv(1, _socket.MSG_PEEK))
+    except _socket.error:
+        return False
+
+
+def _close(sock):
+    """
+    Close a parked connection socket
+
+    :Parameters:
+     - `sock`: The socket to close
+
+    :Types:
+     - `sock`: ``socket.socket``
+    """
+    try:
+        try:
+            sock.shutdown(_socket.SHUT_RDWR)
+        except _socket.error:
+            pass
+    finally:
+        sock.close()
@@ -0,0 +1,164 @@
+# -*- coding: ascii -*-
+#
+# Copyright 2006-2012
+# Andr\xe9 Malo or his licensors, as applicable
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Worker Child Recycling
+======================
+
+Worker children watch their request count and memory usage. As soon as a
+limit is hit, the child asks the main process for a replacement. The main
+process starts the replacement and stops the old child, as soon as the new
+one is ready.
+"""
+__author__ = u"Andr\xe9 Malo"
+__docformat__ = "restructuredtext en"
+
+import errno as _errno
+import fcntl as _fcntl
+import os as _os
+import select as _select
+import time as _time
+
+from wtf import osutil as _osutil
+
+
+class Recycler(object):
+    """
+    Recycling request channel
+
+    The children write their pid into a pipe, the main process waits on
+    it (while looking after its children periodically).
+
+    :IVariables:
+     - `_rfd`: Reading end of the pipe (main process)
+     - `_wfd`: Writing end of the pipe (children)
+
+    :Types:
+     - `_rfd`: ``int``
+     - `_wfd`: ``int``
+    """
+
+    def __init__(self):
+        """ Initialization """
+        self._rfd, self._wfd = map(_osutil.safe_fd, _os.pipe())
+        for fd in (self._rfd, self._wfd):
+            _osutil.close_on_exec(fd)
+            _fcntl.fcntl(fd, _fcntl.F_SETFL,
+                _fcntl.fcntl(fd, _fcntl.F_GETFL) | _os.O_NONBLOCK)
+
+    def request(self):
+        """ Ask the main process for a replacement of this process """
+        try:
+            _os.write(self._wfd, "%d\n" % _os.getpid())
+        except OSError, e:
+            if e[0] not in (_errno.EAGAIN, _errno.EINTR):
+                raise
+
+    def wait(self, timeout):
+        """
+        Wait for recycling requests
+
+        :Parameters:
+         - `timeout`: Maximum time to wait in seconds
+
+        :Types:
+         - `timeout`: ``float``
+
+        :return: The pids of the children asking for a replacement (maybe
+                 empty)
+        :rtype: ``set``
+        """
+        try:
+            _select.select([self._rfd], [], [], timeout)
+        except _select.error, e:
+            if e[0] != _errno.EINTR:
+                raise
+        data = []
+        while True:
+            try:
+                chunk = _os.read(self._rfd, 4096)
+            except OSError, e:
+                if e[0] == _errno.EINTR:
+                    continue
+                if e[0] != _errno.EAGAIN:
+                    raise
+                break
+            if not chunk:
+                break
+            data.append(chunk)
+        return set(int(pid) for pid in ''.join(data).split())
+
+
+class Monitor(object):
+    """
+    Recycling limit monitor (in the children)
+
+    :CVariables:
+     - `INTERVAL`: Minimum time between two memory checks in seconds (the
+       limits should be checked at least that often)
+
+    :IVariables:
+     - `requests`: Maximum number of requests (0 = unlimited)
+     - `rss`: Maximum resident set size in bytes (0 = unlimited)
+     - `_next`: Time of the next memory check
+
+    :Types:
+     - `INTERVAL`: ``float``
+     - `requests`: ``int``
+     - `rss`: ``int``
+     - `_next`: ``float``
+    """
+    INTERVAL = 1.0
+    _next = 0.0
+
+    def __init__(self, requests, rss):
+        """
+        Initialization
+
+        :Parameters:
+         - `requests`: Maximum number of requests (0 = unlimited)
+         - `rss`: Maximum resident set size in bytes (0 = unlimited)
+
+        :Types:
+         - `requests`: ``int``
+         - `rss`: ``int``
+        """
+        self.requests, self.rss = requests, rss
+
+    def due(self, handled):
+        """
+        Check if a limit is hit
+
+        :Parameters:
+         - `handled`: Number of requests handled so far
+
+        :Types:
+         - `handled`: ``int``
+
+        :return: The reason, if the process should be recycled, ``None``
+                 otherwise
+        :rtype: ``str``
+        """
+        if self.requests and handled >= self.requests:
+            return "%d requests handled" % handled
+        if self.rss:
+            now = _time.time()
+            if now >= self._next:
+                self._next = now + self.INTERVAL
+                size = _osutil.rss()
+                if size is not None and size >= self.rss:
+                    return "resident set size %d MB" % (size >> 20)
+        return None
@@ -0,0 +1,384 @@
+# -*- coding: ascii -*-
+#
+# Copyright 2006-2012
+# Andr\xe9 Malo or his licensors, as applicable
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Stuck Request Watchdog
+======================
+
+The watchdog keeps track of the requests running in the worker threads.
+Requests running longer than a threshold are reported along with the
+current stack of their thread. Optionally the thread is given up, so the
+pool can start a replacement.
+
+The clock runs while the application handles a request. It's started
+when the application is called and stopped when the response is finished
+(i.e. the application's result is exhausted or closed). Waiting for the
+next request on a keep-alive connection doesn't count.
+"""
+__author__ = u"Andr\xe9 Malo"
+__docformat__ = "restructuredtext en"
+
+import os as _os
+import sys as _sys
+import thread as _thread
+import threading as _threading
+import time as _time
+import traceback as _traceback
+
+
+class Watchdog(object):
+    """
+    Stuck request watchdog
+
+    :IVariables:
+     - `threshold`: Maximum request runtime in seconds
+     - `_abandon`: Function to give up a runner (or ``None``)
+     - `_interval`: Time between two checks in seconds
+     - `_running`: Busy threads (``{thread id: [start, runner,
+       peername, reported]}``). ``start`` is ``None`` while no request is
+       running.
+     - `_abandoned`: Thread ids of the abandoned runners
+     - `_stuck`: Number of requests reported so far
+     - `_lock`: Lock for the request bookkeeping
+     - `_done`: Event, set on shutdown
+
+    :Types:
+     - `threshold`: ``float``
+     - `_abandon`: ``callable``
+     - `_interval`: ``float``
+     - `_running`: ``dict``
+     - `_abandoned`: ``set``
+     - `_stuck`: ``int``
+     - `_lock`: ``threading.Lock``
+     - `_done`: ``threading.Event``
+    """
+
+    def __init__(self, threshold, abandon=None):
+        """
+        Initialization
+
+        :Parameters:
+         - `threshold`: Maximum request runtime in seconds
+         - `abandon`: Function to give up a runner (called with the runner
+           as argument) or ``None``, if stuck runners should be reported
+           only
+
+        :Types:
+         - `threshold`: ``float``
+         - `abandon`: ``callable``
+        """
+        self.threshold, self._abandon = threshold, abandon
+        self._interval = max(0.1, min(1.0, threshold / 4.0))
+        self._running, self._abandoned, self._stuck = {}, set(), 0
+        self._lock = _threading.Lock()
+        self._done = _threading.Event()
+
+    def start(self):
+        """ Start the watchdog thread """
+        _thread.start_new_thread(self._run, ())
+
+    def shutdown(self):
+        """ Finish the watchdog thread """
+        self._done.set()
+
+    def enter(self, runner, task):
+        """
+        Record the start of a task in the current thread
+
+        The clock is not started before the application is called.
+
+        :Parameters:
+         - `runner`: The runner handling the task
+         - `task`: The task (``(socket, peername)``)
+
+        :Types:
+         - `runner`: `TaskRunner`
+         - `task`: ``tuple``
+        """
+        self._lock.acquire()
+        try:
+            self._running[_thread.get_ident()] = [
+                None, runner, task[1], False
+            ]
+        finally:
+            self._lock.release()
+
+    def watch(self, application):
+        """
+        Wrap a WSGI application, so every request runs the clock
+
+        The clock is started with the application call and stopped when
+        the result is exhausted or closed.
+
+        :Parameters:
+         - `application`: The WSGI application
+
+        :Types:
+         - `application`: ``callable``
+
+        :return: The wrapped application
+        :rtype: ``callable``
+        """
+        running, abandoned = self._running, self._abandoned
+        lock, get_ident = self._lock, _thread.get_ident
+        def clock(start):
+            """ Start (or stop if `start` is ``None``) the clock """
+            ident = get_ident()
+            lock.acquire()
+            try:
+                item = running.get(ident)
+                if item is not None and ident not in abandoned:
+                    item[0], item[3] = start, False
+            finally:
+                lock.release()
+
+        def watched(environ, start_response):
+            """ Start the clock and call the application """
+            clock(_time.time())
+            try:
+                result = application(environ, start_response)
+            except:
+                clock(None)
+                raise
+            wrapper = environ.get('wsgi.file_wrapper')
+            if isinstance(wrapper, type) and isinstance(result, wrapper):
+                # keep it recognizable for the gateway
+                result.close = _Closer(result.close, clock)
+                return result
+            return Result(result, clock)
+        return watched
+
+    def leave(self):
+        """
+        Record the end of a task in the current thread
+
+        :return: Was the runner abandoned meanwhile? (It should finish
+                 then)
+        :rtype: ``bool``
+        """
+        ident = _thread.get_ident()
+        self._lock.acquire()
+        try:
+            self._running.pop(ident, None)
+            if ident in self._abandoned:
+                self._abandoned.remove(ident)
+                return True
+            return False
+        finally:
+            self._lock.release()
+
+    def status(self):
+        """
+        Retrieve the watchdog status
+
+        :return: The status (``{'threshold': float, 'running': float,
+                 'stuck': int, 'abandoned': int}``). ``running`` is the
+                 runtime of the longest running request, ``stuck`` the
+                 number of requests reported so far and ``abandoned`` the
+                 number of currently abandoned threads.
+        :rtype: ``dict``
+        """
+        now = _time.time()
+        self._lock.acquire()
+        try:
+            return dict(
+                threshold=self.threshold,
+                running=max([now - item[0]
+                    for item in self._running.itervalues()
+                    if item[0] is not None] or [0.0]),
+                stuck=self._stuck,
+                abandoned=len(self._abandoned),
+            )
+        finally:
+            self._lock.release()
+
+    def _run(self):
+        """ Watchdog thread main loop """
+        while True:
+            self._done.wait(self._interval)
+            if self._done.isSet():
+                break
+            try:
+                self._check()
+            except: # pylint: disable = W0702
+                _sys.stderr.write(
+                    "Uncaught exception in request watchdog:\n" +
+                    _traceback.format_exc()
+                )
+
+    def _check(self):
+        """ Report (and abandon) stuck requests """
+        limit, stuck = _time.time() - self.threshold, []
+        self._lock.acquire()
+        try:
+            for ident, item in self._running.iteritems():
+                if not item[3] and item[0] is not None \
+                        and item[0] <= limit:
+                    item[3] = True
+                    stuck.append((ident, item[0], item[1], item[2]))
+            self._stuck += len(stuck)
+            if self._abandon is not None:
+                self._abandoned.update(ident for ident, _, _, _ in stuck)
+        finally:
+            self._lock.release()
+        if not stuck:
+            return
+
+        # pylint: disable = W0212
+        frames, now = _sys._current_frames(), _time.time()
+        for ident, start, runner, peername in stuck:
+            frame = frames.get(ident)
+            if frame is None:
+                stack = "  (stack not available)\n"
+            else:
+                stack = ''.join(_traceback.format_stack(frame))
+            if self._abandon is not None:
+                self._abandon(runner)
+                action = "Thread abandoned, starting a replacement."
+            else:
+                action = "Thread still busy."
+            print >> _sys.stderr, (
+                "Request from %s running for %.1f seconds in thread %d "
+                "(pid %d). %s Stack:\n%s" % (
+                    peername, now - start, ident, _os.getpid(), action,
+                    stack,
+                )
+            )
+
+
+class Result(object):
+    """
+    Application result, which stops the clock when it's done
+
+    :IVariables:
+     - `_result`: The wrapped result
+     - `_clock`: Clock function (see `Watchdog.watch`)
+     - `_iter`: Iterator over the wrapped result (or ``None`` before the
+       first step)
+
+    :Types:
+     - `_result`: ``iterable``
+     - `_clock`: ``callable``
+     - `_iter`: ``iterator``
+    """
+    _iter = None
+
+    def __init__(self, result, clock):
+        """
+        Initialization
+
+        :Parameters:
+         - `result`: The result to wrap
+         - `clock`: Clock function
+
+        :Types:
+         - `result`: ``iterable``
+         - `clock`: ``callable``
+        """
+        self._result, self._clock = result, clock
+
+    def __iter__(self):
+        """
+        Return iterator object (iterator protocol)
+
+        :return: The iterator object
+        :rtype: `Result`
+        """
+        return self
+
+    def next(self):
+        """
+        Return next item of the result (iterator protocol)
+
+        :return: The next item
+        :rtype: ``str``
+        """
+        if self._iter is None:
+            self._iter = iter(self._result)
+        try:
+            return self._iter.next()
+        except StopIteration:
+            self._clock(None)
+            raise
+
+    def __len__(self):
+        """
+        Determine the number of remaining items
+
+        :return: The length
+        :rtype: ``int``
+
+        :Exceptions:
+         - `TypeError`: The number is unknown
+        """
+        if self._iter is None:
+            return len(self._result)
+        try:
+            return len(self._iter)
+        except TypeError:
+            if type(self._iter) not in _EXACT_HINTS:
+                raise
+            return self._iter.__length_hint__()
+
+    def close(self):
+        """ Close the result (if possible) and stop the clock """
+        try:
+            try:
+                close = self._result.close
+            except AttributeError:
+                pass
+            else:
+                close()
+        finally:
+            self._clock(None)
+
+_EXACT_HINTS = tuple([typ for typ in (type(iter([])), type(iter(())))
+    if hasattr(typ, '__length_hint__')])
+
+
+class _Closer(object):
+    """
+    Close method replacement, which stops the clock as well
+
+    :IVariables:
+     - `_close`: The original close method
+     - `_clock`: Clock function (see `Watchdog.watch`)
+
+    :Types:
+     - `_close`: ``callable``
+     - `_clock`: ``callable``
+    """
+
+    def __init__(self, close, clock):
+        """
+        Initialization
+
+        :Parameters:
+         - `close`: The original close method
+         - `clock`: Clock function
+
+        :Types:
+         - `close`: ``callable``
+         - `clock`: ``callable``
+        """
+        self._close, self._clock = close, clock
+
+    def __call__(self):
+        """ Close and stop the clock """
+        try:
+            self._close()
+        finally:
+            self._clock(None)
@@ -0,0 +1,219 @@
+# -*- coding: ascii -*-
+#
+# Copyright 2006-2012
+# Andr\xe9 Malo or his licensors, as applicable
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Prefork Worker Model
+====================
+
+Here's the prefork handling implemented. The main process forks a number
+of worker children, each of them running its own threadpool on the shared
+listener socket.
+"""
+__author__ = u"Andr\xe9 Malo"
+__docformat__ = "restructuredtext en"
+
+import errno as _errno
+import os as _os
+import sys as _sys
+import time as _time
+
+from wtf import autoreload as _reload
+from wtf import osutil as _osutil
+from wtf.opi import worker as _worker
+from wtf.opi.worker import threaded as _threaded
+
+
+class PreforkWorker(_threaded.ThreadedWorker):
+    """
+    Implement prefork worker model
+
+    :See: `wtf.opi.worker.WorkerInterface`
+    """
+    __implements__ = [_worker.WorkerInterface]
+
+    def setup(self, sock, prerun, parent_cleanup, child_cleanup):
+        """
+        Initialization
+
+        :See: `wtf.opi.worker.WorkerInterface`
+        """
+        return WorkerChildren(
+            self, sock, prerun, parent_cleanup, child_cleanup
+        )
+
+
+class WorkerChildren(_threaded.WorkerChild):
+    """
+    Worker pool implementation, consisting of several worker children
+
+    :CVariables:
+     - `_RESTART_DELAY`: Minimum lifetime of a child in seconds. Children
+       dying earlier are restarted after this delay (avoids fork loops).
+
+    :IVariables:
+     - `workers`: Number of worker children
+     - `stagger`: Delay between two child startups in seconds
+     - `_pids`: Running children (``{pid: (slot, starttime)}``)
+
+    :Types:
+     - `_RESTART_DELAY`: ``float``
+     - `workers`: ``int``
+     - `stagger`: ``float``
+     - `_pids`: ``dict``
+    """
+    multiprocess = True
+    _RESTART_DELAY = 1.0
+
+    def __init__(self, model, sock, prerun, parent_cleanup, child_cleanup):
+        """
+        Initialization
+
+        :See: `wtf.opi.worker.threaded.WorkerChild`
+        """
+        super(WorkerChildren, self).__init__(
+            model, sock, prerun, parent_cleanup, child_cleanup
+        )
+        workers, stagger = None, 0.1
+        if 'prefork' in model.config.wtf:
+            workers = model.config.wtf.prefork('workers', workers)
+            stagger = model.config.wtf.prefork('stagger', stagger)
+        if not workers:
+            workers = _osutil.cpu_count()
+        self.workers = max(1, int(workers))
+        self.stagger = max(0.0, float(stagger))
+        self._pids = {}
+
+    def run(self):
+        """
+        Pool runner
+
+        A new generation of children is started first (one after another).
+        After that the previous generation (if any) is shut down. Children
+        failing to start are restarted like children dying on their own
+        (individually, after a delay). The previous generation is kept
+        until the new one is complete. Children asking for recycling are
+        replaced individually as well. The previous generation is kept in
+        `_old` until it's stopped, so an interrupted run doesn't lose it.
+
+        :See: `wtf.opi.worker.WorkerPoolInterface`
+        """
+        self._preload()
+        self._old.extend(self._pids)
+        self._pids, failed = {}, set()
+        for slot in xrange(self.workers):
+            if slot and self.stagger:
+                _time.sleep(self.stagger)
+            if not self._fork(slot):
+                failed.add(slot)
+        if len(failed) == self.workers and not self._old:
+            return # nothing started and nothing to keep serving
+        if not failed:
+            self._stop_old()
+
+        while True:
+            try:
+                pid, code = _os.waitpid(-1, _os.WNOHANG)
+            except OSError, e:
+                if e[0] == _errno.EINTR:
+                    continue
+                raise
+            if not pid:
+                for pid in self.recycler.wait(self._POLL_INTERVAL):
+                    if pid in self._pids:
+                        self._recycle_child(pid)
+                continue
+            try:
+                slot, started = self._pids.pop(pid)
+            except KeyError:
+                continue # not ours (anymore)
+
+            if _os.WIFEXITED(code) and \
+                    _os.WEXITSTATUS(code) == _reload.ReloadRequested.CODE:
+                raise _reload.ReloadRequested()
+
+            print >> _sys.stderr, (
+                "Worker child #%d (pid %d) exited, restarting it." %
+                (slot, pid)
+            )
+            delay = started + self._RESTART_DELAY - _time.time()
+            if delay > 0:
+                _time.sleep(delay)
+            if not self._fork(slot):
+                failed.add(slot)
+            elif slot in failed:
+                failed.remove(slot)
+                if not failed:
+                    self._stop_old()
+
+    def shutdown(self):
+        """
+        Pool shutdown
+
+        :See: `wtf.opi.worker.WorkerPoolInterface`
+        """
+        self._old.extend(self._pids)
+        self._pids = {}
+        super(WorkerChildren, self).shutdown()
+
+    def _recycle_child(self, pid):
+        """
+        Replace a worker child by a new one
+
+        :Parameters:
+         - `pid`: The pid of the child to replace
+
+        :Types:
+         - `pid`: ``int``
+        """
+        slot, _ = self._pids[pid]
+        if self._fork(slot):
+            del self._pids[pid]
+            self._old.append(pid)
+            self._stop_old()
+            print >> _sys.stderr, (
+                "Worker child #%d (pid %d) recycled." % (slot, pid)
+            )
+        else: # keep the old one
+            failed = [cpid for cpid, (cslot, _) in self._pids.iteritems()
+                if cslot == slot and cpid != pid]
+            for cpid in failed:
+                del self._pids[cpid]
+            self._old.extend(failed)
+            self._stop_old()
+
+    def _fork(self, slot):
+        """
+        Fork a new worker child and wait until it's ready
+
+        The prerunner is passed to the very first child only. The parent
+        cleanup is executed after the very first fork.
+
+        :Parameters:
+         - `slot`: The slot number of the child
+
+        :Types:
+         - `slot`: ``int``
+
+        :return: Did the child start up successfully?
+        :rtype: ``bool``
+        """
+        prerun, self.prerun = self.prerun, None
+        parent_cleanup, self.parent_cleanup = self.parent_cleanup, None
+        pid, ready = self._spawn(prerun)
+        self._pids[pid] = slot, _time.time()
+        if parent_cleanup is not None:
+            parent_cleanup()
+        return self._ready(ready)
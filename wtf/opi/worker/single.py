@@ -80,7 +80,7 @@ class Worker(object):
          - `parent_cleanup`: ``callable``
          - `child_cleanup`: ``callable``
         """
-        self.model, self.sock, self.prerun = model, sock, prerun
+        self.model, self.sock, self.prerun = model, sock.shard(), prerun
 
     def run(self):
         """
@@ -132,3 +132,11 @@ class Flags(object):
     def shutdown(self):
         """ Retrieve shutdown flag """
         return False
+
+    def park(self, accepted, timeout):
+        """ Park an idle connection (not supported) """
+        return False
+
+    def status(self):
+        """ Retrieve the worker status (not available) """
+        return None
@@ -25,6 +25,7 @@ __docformat__ = "restructuredtext en"
 
 import collections as _collections
 import errno as _errno
+import gc as _gc
 import os as _os
 import signal as _signal
 import socket as _socket
@@ -34,17 +35,28 @@ import threading as _threading
 import time as _time
 import traceback as _traceback
 
+from wtf import WtfWarning
 from wtf import autoreload as _reload
 from wtf import impl as _impl
 from wtf import osutil as _osutil
 from wtf import app as _app
+from wtf.opi import listener as _listener
 from wtf.opi import worker as _worker
+from wtf.opi.worker import _autoscale
+from wtf.opi.worker import _handoff
+from wtf.opi.worker import _parker
+from wtf.opi.worker import _recycle
+from wtf.opi.worker import _watchdog
 
 
 class SigTerm(SystemExit):
     """ SIGTERM received """
 
 
+class PreloadWarning(WtfWarning):
+    """ Application preloading is not possible """
+
+
 class ThreadedWorker(object):
     """
     Implement threadpool worker model
@@ -72,9 +84,39 @@ class ThreadedWorker(object):
 
 
 class WorkerChild(object):
-    """ Worker pool implementation """
+    """
+    Worker pool implementation
+
+    :CVariables:
+     - `multiprocess`: Are there more worker processes serving the same
+       sockets?
+     - `_POLL_INTERVAL`: Time between two checks for dead children in
+       seconds (while waiting for recycling requests)
+
+    :IVariables:
+     - `handoff`: Connection handoff channel between the worker generations
+     - `recycler`: Recycling request channel
+     - `preload`: Build the application in the main process before forking
+       the children?
+     - `_preloaded`: Preloaded protocol implementation and application
+       (``(impl, app)``) or ``None``
+     - `_old`: Pids of replaced worker children, which are not stopped
+       yet. They are kept here until `_stop_old` finished, so they're not
+       lost if a signal interrupts the replacement.
+
+    :Types:
+     - `multiprocess`: ``bool``
+     - `_POLL_INTERVAL`: ``float``
+     - `handoff`: `_handoff.Handoff`
+     - `recycler`: `_recycle.Recycler`
+     - `preload`: ``bool``
+     - `_preloaded`: ``tuple``
+     - `_old`: ``list``
+    """
     __implements__ = [_worker.WorkerPoolInterface]
-    _pid, _usergroup = None, None
+    _pid, _spare, _usergroup, _preloaded = None, None, None, None
+    multiprocess = False
+    _POLL_INTERVAL = 1.0
 
     def __init__(self, model, sock, prerun, parent_cleanup, child_cleanup):
         """
@@ -99,6 +141,15 @@ class WorkerChild(object):
         self.prerun = prerun
         self.parent_cleanup = parent_cleanup
         self.child_cleanup = child_cleanup
+        self.handoff = _handoff.Handoff()
+        self.recycler = _recycle.Recycler()
+        self._old = []
+        self.preload = bool(model.config.wtf('preload_app', False))
+        if self.preload and model.config.wtf('autoreload', False):
+            PreloadWarning.emit(
+                "preload_app is ignored, because autoreload is turned on"
+            )
+            self.preload = False
         if 'user' in model.config.wtf:
             self._usergroup = model.config.wtf.user, model.config.wtf.group
 
@@ -106,57 +157,226 @@ class WorkerChild(object):
         """
         Pool runner
 
+        The new worker child is started first. The old one (if any) is
+        stopped as soon as the new one is ready to serve. If the new one
+        fails to start, the old one is kept. The same happens, if the child
+        asks for recycling. A child left over by an interrupted run is
+        stopped along with the old one.
+
         :See: `wtf.opi.worker.WorkerPoolInterface`
         """
-        # pylint: disable = R0912
-
-        oldpid, self._pid = self._pid, None
+        self._preload()
+        if self._spare is not None:
+            self._old.append(self._spare)
+            self._spare = None
         prerun, self.prerun = self.prerun, None
         parent_cleanup, self.parent_cleanup = self.parent_cleanup, None
-        self._pid = _os.fork()
-        if self._pid == 0: # child
+        self._spare, ready = self._spawn(prerun)
+        if parent_cleanup is not None:
+            parent_cleanup()
+        if self._ready(ready) or self._pid is None:
+            if self._pid is not None:
+                self._old.append(self._pid)
+            self._pid, self._spare = self._spare, None
+        else:
+            print >> _sys.stderr, (
+                "Worker child (pid %d) failed to start, keeping pid %d." %
+                (self._spare, self._pid)
+            )
+            self._old.append(self._spare)
+            self._spare = None
+        self._stop_old()
+        while True:
             try:
+                pid, code = _os.waitpid(self._pid, _os.WNOHANG)
+            except OSError, e:
+                if e[0] != _errno.EINTR:
+                    raise
+                continue
+            if pid:
+                break
+            if self._pid in self.recycler.wait(self._POLL_INTERVAL):
+                self._recycle()
+        self._pid = None
+        if _os.WIFEXITED(code):
+            code = _os.WEXITSTATUS(code)
+            if code == _reload.ReloadRequested.CODE:
+                raise _reload.ReloadRequested()
+
+    def _recycle(self):
+        """ Replace the worker child by a new one """
+        self._spare, ready = self._spawn(None)
+        if self._ready(ready):
+            self._old.append(self._pid)
+            self._pid, self._spare = self._spare, None
+            print >> _sys.stderr, (
+                "Worker child (pid %d) recycled, replaced by pid %d." %
+                (self._old[-1], self._pid)
+            )
+        else:
+            self._old.append(self._spare)
+            self._spare = None
+        self._stop_old()
+
+    def _preload(self):
+        """
+        Build the application in the main process (if configured)
+
+        This happens only once. The children share the memory pages with
+        the main process then (until they're written to). Note that the
+        application is not reloaded by SIGHUP in this case.
+        """
+        if self.preload and self._preloaded is None:
+            model = self.model
+            config, opts, args = model.config, model.opts, model.args
+            self._preloaded = (
+                _impl.factory(config, opts, args),
+                _app.factory(config, opts, args),
+            )
+            # Collect now, so the collector doesn't touch (and copy) all
+            # the pages in every child later
+            _gc.collect()
+
+    def _stop_old(self):
+        """ Stop the replaced worker children """
+        if self._old:
+            self._stop(list(self._old))
+            self._old = []
+
+    def _stop(self, pids):
+        """
+        Stop worker children
+
+        :Parameters:
+         - `pids`: The pids of the children to stop
+
+        :Types:
+         - `pids`: ``iterable``
+        """
+        tokill = []
+        for pid in pids:
+            try:
+                _os.kill(pid, _signal.SIGTERM)
+            except OSError, e:
+                if e[0] != _errno.ESRCH:
+                    raise
+            else:
+                tokill.append(pid)
+        for pid in tokill:
+            while True:
                 try:
-                    if self._usergroup:
-                        _osutil.change_identity(*self._usergroup)
-                    _signal.signal(_signal.SIGINT, _signal.SIG_IGN)
-                    _signal.signal(_signal.SIGHUP, _signal.SIG_IGN)
-                    if self.child_cleanup is not None:
-                        self.child_cleanup()
-
-                    model = self.model
-                    config, opts, args = model.config, model.opts, model.args
-                    reload_checker = _reload.Autoreload(config, opts, args)
+                    _os.waitpid(pid, 0)
+                except OSError, e:
+                    if e[0] == _errno.EINTR:
+                        continue
+                    if e[0] != _errno.ECHILD:
+                        raise
+                break
+
+    def _spawn(self, prerun):
+        """
+        Fork a new worker child
+
+        :Parameters:
+         - `prerun`: Prerunner (maybe ``None``)
+
+        :Types:
+         - `prerun`: ``callable``
+
+        :return: The child's pid and the descriptor to wait on for its
+                 readiness (see `_ready`)
+        :rtype: ``tuple``
+        """
+        rfd, wfd = map(_osutil.safe_fd, _os.pipe())
+        pid = _os.fork()
+        if pid == 0: # child
+            _os.close(rfd)
+            def ready():
+                """ Finish setup and notify the parent """
+                if prerun is not None:
+                    prerun()
+                try:
+                    _os.write(wfd, "!")
+                except OSError, e:
+                    # the parent gave up waiting (interrupted by a signal)
+                    # and is going to stop us
+                    if e[0] != _errno.EPIPE:
+                        raise
+                _os.close(wfd)
+            self._child(ready)
+        _os.close(wfd)
+        return pid, rfd
+
+    def _ready(self, rfd):
+        """
+        Wait until a new worker child is ready to serve
+
+        :Parameters:
+         - `rfd`: The descriptor returned by `_spawn`
+
+        :Types:
+         - `rfd`: ``int``
+
+        :return: Did the child start up successfully?
+        :rtype: ``bool``
+        """
+        try:
+            while True:
+                try:
+                    return bool(_os.read(rfd, 1))
+                except OSError, e:
+                    if e[0] != _errno.EINTR:
+                        raise
+        finally:
+            _os.close(rfd)
+
+    def _child(self, prerun):
+        """
+        Run the worker child (after the fork)
+
+        This method never returns, the process exits instead.
+
+        :Parameters:
+         - `prerun`: Prerunner (maybe ``None``)
+
+        :Types:
+         - `prerun`: ``callable``
+        """
+        try:
+            try:
+                self.sock = self.sock.shard()
+                if self._usergroup:
+                    _osutil.change_identity(*self._usergroup)
+                _signal.signal(_signal.SIGINT, _signal.SIG_IGN)
+                _signal.signal(_signal.SIGHUP, _signal.SIG_IGN)
+                if self.child_cleanup is not None:
+                    self.child_cleanup()
+
+                model = self.model
+                config, opts, args = model.config, model.opts, model.args
+                reload_checker = _reload.Autoreload(config, opts, args)
+                if self._preloaded is not None:
+                    impl, app = self._preloaded
+                else:
                     impl = _impl.factory(config, opts, args)
                     app = _app.factory(config, opts, args)
 
-                    try:
-                        pool = ThreadPool(
-                            self, reload_checker, impl, app.call
-                        )
-                        if prerun is not None:
-                            prerun()
-                        pool.run()
-                    finally:
-                        app.shutdown()
-                except SystemExit, e:
-                    _os._exit(e.code or 0) # pylint: disable = W0212
-                except:
-                    _traceback.print_exc()
-                    _os._exit(1) # pylint: disable = W0212
-            finally:
-                _os._exit(0) # pylint: disable = W0212
-        else: # parent
-            if parent_cleanup is not None:
-                parent_cleanup()
-            if oldpid is not None:
-                _os.kill(oldpid, _signal.SIGTERM)
-                _os.waitpid(oldpid, 0)
-            self._pid, (_, code) = None, _os.waitpid(self._pid, 0)
-            if _os.WIFEXITED(code):
-                code = _os.WEXITSTATUS(code)
-                if code == _reload.ReloadRequested.CODE:
-                    raise _reload.ReloadRequested()
+                try:
+                    pool = ThreadPool(
+                        self, reload_checker, impl, app.call
+                    )
+                    if prerun is not None:
+                        prerun()
+                    pool.run()
+                finally:
+                    app.shutdown()
+            except SystemExit, e:
+                _os._exit(e.code or 0) # pylint: disable = W0212
+            except:
+                _traceback.print_exc()
+                _os._exit(1) # pylint: disable = W0212
+        finally:
+            _os._exit(0) # pylint: disable = W0212
 
     def shutdown(self):
         """
@@ -164,15 +384,13 @@ class WorkerChild(object):
 
         :See: `wtf.opi.worker.WorkerPoolInterface`
         """
-        oldpid, self._pid = self._pid, None
-        if oldpid is not None:
-            try:
-                _os.kill(oldpid, _signal.SIGTERM)
-            except OSError, e:
-                if e[0] != _errno.ESRCH:
-                    raise
-            else:
-                _os.waitpid(oldpid, 0)
+        self._old.extend([pid for pid in (self._pid, self._spare)
+            if pid is not None])
+        self._pid = self._spare = None
+        self._stop_old()
+        preloaded, self._preloaded = self._preloaded, None
+        if preloaded is not None:
+            preloaded[1].shutdown()
 
 
 class ThreadPool(object):
@@ -190,6 +408,21 @@ class ThreadPool(object):
        (new threads are started if the threshold is reached)
      - `maxqueue`: Maximum of jobs in the queue (if no thread is available).
        The queue blocks if maxqueue is reached.
+     - `multiprocess`: Are there more worker processes serving the same
+       sockets?
+     - `parking`: Park idle keep-alive connections (instead of blocking a
+       thread)?
+     - `handoff`: Connection handoff channel to the next worker generation
+     - `drain`: Time to wait for running requests on shutdown (in seconds)
+     - `autoscale`: Autoscaling parameters (``(target, interval)``) or
+       ``None``
+     - `overload`: Load shedding parameters (``(deadline, retry_after)``)
+       or ``None``
+     - `batch`: Maximum number of connections to accept at once
+     - `watchdog`: Stuck request watchdog parameters (``(threshold,
+       abandon)``) or ``None``
+     - `recycler`: Recycling request channel
+     - `recycle`: Recycling limit monitor (or ``None``)
 
     :Types:
      - `sock`: ``socket.socket``
@@ -199,6 +432,16 @@ class ThreadPool(object):
      - `maxspare`: ``int``
      - `minspare`: ``int``
      - `maxqueue`: ``int``
+     - `multiprocess`: ``bool``
+     - `parking`: ``bool``
+     - `handoff`: `_handoff.Handoff`
+     - `drain`: ``float``
+     - `autoscale`: ``tuple``
+     - `overload`: ``tuple``
+     - `batch`: ``int``
+     - `watchdog`: ``tuple``
+     - `recycler`: `_recycle.Recycler`
+     - `recycle`: `_recycle.Monitor`
     """
 
     def __init__(self, workerchild, reload_checker, impl, app):
@@ -228,51 +471,152 @@ class ThreadPool(object):
             self.maxspare, max(1, config.wtf('minspare', 1))
         )
         self.maxqueue = max(1, config.wtf('maxqueue', 1))
+        self.multiprocess = workerchild.multiprocess
+        self.parking = bool(config.wtf('parking', False))
+        self.handoff = workerchild.handoff
+        self.drain = 10.0
+        if 'timeout' in config.wtf:
+            self.drain = float(config.wtf.timeout('drain', self.drain))
+        self.autoscale = None
+        if 'autoscale' in config.wtf:
+            target = float(config.wtf.autoscale('target', 0))
+            if target > 0:
+                self.autoscale = target, max(0.1, float(
+                    config.wtf.autoscale('interval', 1)
+                ))
+        self.batch = max(1, int(config.wtf('accept-batch', 1)))
+        self.recycler, self.recycle = workerchild.recycler, None
+        if 'recycle' in config.wtf:
+            requests = max(0, int(config.wtf.recycle('requests', 0)))
+            rss = max(0, int(float(config.wtf.recycle('rss', 0)) * 1048576))
+            if requests or rss:
+                self.recycle = _recycle.Monitor(requests, rss)
+        self.overload = None
+        if 'overload' in config.wtf:
+            deadline = float(config.wtf.overload('deadline', 0))
+            if deadline > 0:
+                self.overload = deadline, max(0, int(
+                    config.wtf.overload('retry-after', 5)
+                ))
+        self.watchdog = None
+        if 'watchdog' in config.wtf:
+            threshold = float(config.wtf.watchdog('threshold', 0))
+            if threshold > 0:
+                self.watchdog = threshold, bool(
+                    config.wtf.watchdog('abandon', False)
+                )
 
     def run(self):
-        """ Run the pool infinitely """
+        """
+        Run the pool infinitely
+
+        Connections handed over by the previous worker generation are
+        accepted along with the regular ones. On shutdown the listener
+        (shard) is retired and the running requests are finished first.
+        """
         def termhandler(*args):
             """ Act on SIGTERM """
             _signal.signal(_signal.SIGTERM, _signal.SIG_IGN)
             raise SigTerm()
 
         queue, accept = JobWorkerQueue(self), self.sock.accept
+        accept.add(self.handoff)
+        self.handoff.attach(queue.flags.park)
         need_reload = self.reload_checker.check
         try:
             try:
                 _signal.signal(_signal.SIGTERM, termhandler)
                 queue.startup()
+                batch, recycle = self.batch, self.recycle
+                timeout = None
+                if self.autoscale is not None:
+                    # adjust the spare threads without traffic as well
+                    timeout = self.autoscale[1]
+                if recycle is not None and (timeout is None
+                        or timeout > recycle.INTERVAL):
+                    # requests may arrive over kept-alive connections
+                    timeout = recycle.INTERVAL
                 while True:
-                    task = accept()
-                    changed = need_reload()
-                    if changed:
-                        print >> _sys.stderr, (
-                            "Application reload requested by mtime change "
-                            "of module(s):\n  * %s" % "\n  * ".join(changed)
-                        )
-                        queue.shutdown()
-                        self._force_reload(task)
-                        raise _reload.ReloadRequested()
-                    queue.put_task(task)
+                    try:
+                        if batch > 1:
+                            tasks = accept.batch(batch, timeout)
+                        else:
+                            tasks = [accept(timeout)]
+                    except _listener.SocketTimeout:
+                        queue.adjust()
+                    else:
+                        changed = need_reload()
+                        if changed:
+                            print >> _sys.stderr, (
+                                "Application reload requested by mtime "
+                                "change of module(s):\n  * %s"
+                                % "\n  * ".join(changed)
+                            )
+                            queue.shutdown()
+                            for task in tasks:
+                                self._force_reload(task)
+                            raise _reload.ReloadRequested()
+                        queue.put_tasks(tasks)
+                    if recycle is not None:
+                        reason = recycle.due(queue.requests)
+                        if reason is not None:
+                            print >> _sys.stderr, (
+                                "Worker child (pid %d) asks for recycling: "
+                                "%s." % (_os.getpid(), reason)
+                            )
+                            self.recycler.request()
+                            recycle = None
             except SigTerm:
                 pass
         finally:
-            queue.shutdown()
+            try:
+                self._retire_listener()
+            finally:
+                queue.shutdown()
+                queue.drain(self.drain)
+
+    def _retire_listener(self):
+        """
+        Stop listening and pass the waiting connections on
+
+        Only sharded listeners (SO_REUSEPORT) are actually closed, because
+        the kernel would keep assigning connections to them. The
+        connections accepted from their backlogs are handed over to the
+        next worker generation.
+        """
+        for task in self.sock.retire():
+            self._force_reload(task)
 
     def _force_reload(self, accepted):
         """
         Force the application reload and handle the one accepted socket
 
-        This method forks the process and proxies the socket to the new one.
+        The socket is handed over to the next worker generation.
 
         :Parameters:
          - `accepted`: Accepted socket
 
         :Types:
          - `accepted`: ``tuple``
+        """
+        try:
+            self.handoff.send(accepted[0])
+        except NotImplementedError:
+            self._proxy(accepted)
 
-        :Exceptions:
-         - `ReloadRequested`: raised in parent to stop further processing
+    def _proxy(self, accepted):
+        """
+        Proxy the one accepted socket to the next worker generation
+
+        This method forks the process and proxies the socket to the new one.
+        It's used if the socket cannot be handed over directly (descriptor
+        passing needs the C extension).
+
+        :Parameters:
+         - `accepted`: Accepted socket
+
+        :Types:
+         - `accepted`: ``tuple``
         """
         # pylint: disable = R0912, R0914, R0915
 
@@ -384,23 +728,59 @@ class Flags(object):
 
     :IVariables:
      - `_shutdown`: Shutdown flag and mutex (``(bool, threading.Lock)``)
+     - `_park`: Connection parker (or ``None``)
+     - `_status`: Status function (or ``None``)
+
+    :Types:
+     - `_park`: ``callable``
+     - `_status`: ``callable``
     """
     __implements__ = [_impl.FlagsInterface]
     multithread = True
     multiprocess = False
     run_once = False
 
-    def __init__(self, shutdown=False):
+    def __init__(self, shutdown=False, multiprocess=False, park=None,
+                 status=None):
         """
         Initialization
 
         :Parameters:
          - `shutdown`: Initial state of shutdown flag
+         - `multiprocess`: Are there more worker processes?
+         - `park`: Connection parker (or ``None``)
+         - `status`: Status function (or ``None``)
 
         :Types:
          - `shutdown`: ``bool``
+         - `multiprocess`: ``bool``
+         - `park`: ``callable``
+         - `status`: ``callable``
         """
         self._shutdown = bool(shutdown), _threading.Lock()
+        if multiprocess:
+            self.multiprocess = True
+        self._park, self._status = park, status
+
+    def status(self):
+        """
+        Retrieve the worker status
+
+        :See: `wtf.impl.FlagsInterface.status`
+        """
+        if self._status is None:
+            return None
+        return self._status()
+
+    def park(self, accepted, timeout):
+        """
+        Park an idle connection
+
+        :See: `wtf.impl.FlagsInterface.park`
+        """
+        if self._park is None:
+            return False
+        return self._park(accepted, timeout)
 
     def shutdown(self, flag=None):
         """
@@ -428,7 +808,33 @@ class Flags(object):
 
 
 class JobWorkerQueue(object):
-    """ Combined management of jobs and workers """
+    """
+    Combined management of jobs and workers
+
+    :IVariables:
+     - `minspare`: Current number of threads to keep ready
+     - `maxspare`: Current maximum number of idle threads
+     - `served`: Service time recorder (or ``None``)
+     - `shed`: Overload rejector for the current thread (or ``None``)
+     - `requests`: Number of requests handled so far (only counted if
+       the recycling request limit is active)
+     - `watchdog`: Stuck request watchdog (or ``None``)
+     - `_autoscale`: Autoscaling controller (or ``None``)
+     - `_shedder`: Overload rejector (or ``None``)
+     - `_deadline`: Maximum queue wait in seconds (or ``None``)
+
+    :Types:
+     - `minspare`: ``int``
+     - `maxspare`: ``int``
+     - `served`: ``callable``
+     - `shed`: ``callable``
+     - `requests`: ``int``
+     - `watchdog`: `_watchdog.Watchdog`
+     - `_autoscale`: `_autoscale.Controller`
+     - `_shedder`: `Shedder`
+     - `_deadline`: ``float``
+    """
+    requests = 0
 
     def __init__(self, pool):
         """
@@ -441,38 +847,176 @@ class JobWorkerQueue(object):
          - `pool`: `ThreadPool`
         """
         self.pool = pool
-        self.flags = Flags()
+        if pool.parking:
+            self._parker = _parker.Parker(self.put_task, pool.handoff.send)
+            park = self._parker.park
+        else:
+            self._parker = park = None
+        self.minspare, self.maxspare = pool.minspare, pool.maxspare
+        if pool.autoscale is not None:
+            self._autoscale = _autoscale.Controller(
+                pool.autoscale[0], pool.autoscale[1],
+                pool.minspare, pool.maxspare, pool.maxthreads,
+            )
+        else:
+            self._autoscale = None
+        if self._autoscale is not None:
+            self.served = self._autoscale.served
+        else:
+            self.served = None
+        self.flags = Flags(
+            multiprocess=pool.multiprocess, park=park, status=self.status
+        )
+        if pool.overload is not None:
+            self._deadline = pool.overload[0]
+            self._shedder = Shedder(pool.impl, self.flags, pool.overload[1])
+            self.shed = self._shedder.shed
+        else:
+            self._deadline = self._shedder = self.shed = None
+        if pool.watchdog is not None:
+            threshold, abandon = pool.watchdog
+            self.watchdog = _watchdog.Watchdog(
+                threshold, abandon and self.abandon or None
+            )
+        else:
+            self.watchdog = None
         self._tasks = _collections.deque()
         self._runners = set()
         self._idle = set()
         self._lock = _threading.Lock()
         self._not_empty = _threading.Condition(self._lock)
         self._not_full = _threading.Condition(self._lock)
+        self._drained = _threading.Condition(_threading.Lock())
+        self._count_lock = _threading.Lock()
+
+    def counted(self, application):
+        """
+        Wrap a WSGI application, so its calls are counted in `requests`
+
+        The application is returned unchanged if nobody's interested in
+        the number.
+
+        :Parameters:
+         - `application`: The WSGI application
+
+        :Types:
+         - `application`: ``callable``
+
+        :return: The (maybe) wrapped application
+        :rtype: ``callable``
+        """
+        recycle = self.pool.recycle
+        if recycle is None or not recycle.requests:
+            return application
+        lock = self._count_lock
+        def count(environ, start_response):
+            """ Count the request and call the application """
+            lock.acquire()
+            try:
+                self.requests += 1
+            finally:
+                lock.release()
+            return application(environ, start_response)
+        return count
 
     def startup(self):
         """ Start the queue """
         self._not_full.acquire()
         try:
-            while len(self._idle) < self.pool.maxspare:
+            while len(self._idle) < self.maxspare:
                 TaskRunner(self).start()
         finally:
             self._not_full.release()
+        if self._parker is not None:
+            self._parker.start()
+        if self._shedder is not None:
+            self._shedder.start()
+        if self.watchdog is not None:
+            self.watchdog.start()
 
     def shutdown(self):
         """ Shutdown the queue - finish all threads """
         self.flags.shutdown(True)
+        if self._parker is not None:
+            self._parker.shutdown()
+        if self._shedder is not None:
+            self._shedder.shutdown()
+        if self.watchdog is not None:
+            self.watchdog.shutdown()
         self._not_full.acquire()
         try:
-            self._tasks.extendleft([None] * (len(self._runners) + 1))
-            self._not_empty.notify()
+            self._tasks.extendleft(
+                [(None, None)] * (len(self._runners) + 1)
+            )
+            self._not_empty.notifyAll()
         finally:
             self._not_full.release()
 
+    def drain(self, timeout):
+        """
+        Wait for the runners to finish (after `shutdown`)
+
+        :Parameters:
+         - `timeout`: Maximum time to wait in seconds
+
+        :Types:
+         - `timeout`: ``float``
+        """
+        end = _time.time() + timeout
+        self._drained.acquire()
+        try:
+            while self._runners:
+                remaining = end - _time.time()
+                if remaining <= 0:
+                    break
+                self._drained.wait(remaining)
+        finally:
+            self._drained.release()
+        if self._parker is not None:
+            self._parker.wait(max(0.0, end - _time.time()))
+
+    def status(self):
+        """
+        Retrieve the pool status
+
+        :return: The status (``{'threads': int, 'idle': int, 'queued': int,
+                 'minspare': int, 'maxspare': int, 'maxthreads': int,
+                 'autoscale': dict, 'watchdog': dict}``). ``autoscale`` is
+                 ``None`` if autoscaling is disabled, the controller status
+                 otherwise (see `_autoscale.Controller.status`).
+                 ``watchdog`` is ``None`` if the watchdog is disabled, its
+                 status otherwise (see `_watchdog.Watchdog.status`).
+        :rtype: ``dict``
+        """
+        self._lock.acquire()
+        try:
+            result = dict(
+                threads=len(self._runners),
+                idle=len(self._idle),
+                queued=len(self._tasks),
+                minspare=self.minspare,
+                maxspare=self.maxspare,
+                maxthreads=self.pool.maxthreads,
+            )
+        finally:
+            self._lock.release()
+        if self._autoscale is not None:
+            result['autoscale'] = self._autoscale.status()
+        else:
+            result['autoscale'] = None
+        if self.watchdog is not None:
+            result['watchdog'] = self.watchdog.status()
+        else:
+            result['watchdog'] = None
+        return result
+
     def put_task(self, task):
         """
         Put a new task into the queue
 
-        This function blocks until there's actually space in the queue.
+        This function blocks until there's actually space in the queue. If
+        load shedding is enabled, tasks waiting longer than the deadline are
+        removed from the queue and rejected, in order to make space.
 
         :Parameters:
          - `task`: The task to put, if ``None``, the receiving runner
@@ -481,50 +1025,116 @@ class JobWorkerQueue(object):
         :Types:
          - `task`: any
         """
+        self.put_tasks([task])
+
+    def put_tasks(self, tasks):
+        """
+        Put several new tasks into the queue at once
+
+        This function blocks until there's actually space in the queue for
+        all of them (see `put_task`).
+
+        :Parameters:
+         - `tasks`: The tasks to put
+
+        :Types:
+         - `tasks`: ``iterable``
+        """
+        now = _time.time()
         self._not_full.acquire()
         try:
-            while (len(self._idle) < self.pool.minspare and
-                    len(self._runners) < self.pool.maxthreads):
-                TaskRunner(self).start()
+            self._adjust(now)
+            queue, idle, runners = self._tasks, self._idle, self._runners
+            maxthreads, maxqueue = self.pool.maxthreads, self.pool.maxqueue
+            for task in tasks:
+                # wait for space
+                while True:
+                    # idle threads not claimed by a queued task yet
+                    while (len(idle) - len(queue) < self.minspare and
+                            len(runners) < maxthreads):
+                        TaskRunner(self).start()
+
+                    if len(idle) > len(queue) \
+                            or len(runners) < maxthreads \
+                            or len(queue) - len(idle) < maxqueue:
+                        break
+                    if self._deadline is None or queue[-1][1] is None:
+                        self._not_full.wait()
+                        continue
+                    limit = _time.time() - self._deadline
+                    while queue and queue[-1][1] is not None \
+                            and queue[-1][1] <= limit:
+                        self._shedder.put_task(queue.pop()[0])
+                    if queue and len(queue) - len(idle) >= maxqueue:
+                        self._not_full.wait(max(0.001, queue[-1][1] - limit))
+
+                # ...and queue it
+                queue.appendleft((task, now))
+                self._not_empty.notify()
+        finally:
+            self._not_full.release()
 
-            # wait for space
-            while True:
-                if self._idle \
-                        or len(self._runners) < self.pool.maxthreads \
-                        or len(self._tasks) < self.pool.maxqueue:
-                    break
-                self._not_full.wait()
+    def adjust(self):
+        """
+        Let the autoscaling controller adjust the spare thread bounds
 
-            # ...and queue it
-            self._tasks.appendleft(task)
-            self._not_empty.notify()
+        This happens anyway when tasks are put into the queue. The method
+        is called periodically while there are none.
+        """
+        self._not_full.acquire()
+        try:
+            self._adjust(_time.time())
         finally:
             self._not_full.release()
 
+    def _adjust(self, now):
+        """
+        Adjust the spare thread bounds, if it's time to (lock held)
+
+        :Parameters:
+         - `now`: The current time
+
+        :Types:
+         - `now`: ``float``
+        """
+        if self._autoscale is not None and self._autoscale.adjust(now):
+            self.minspare = self._autoscale.minspare
+            self.maxspare = self._autoscale.maxspare
+            self._not_empty.notifyAll() # let surplus idle threads go
+
     def get_task(self, runner):
         """
         Get the next task out of the queue.
 
         This function blocks until there's actually a task available.
 
-        :return: The new task, if ``None``, the receiving runner should finish
-        :rtype: any
+        :return: The new task (if ``None``, the receiving runner should
+                 finish) and whether it's overdue (waited longer than the
+                 load shedding deadline)
+        :rtype: ``tuple``
         """
         self._not_empty.acquire()
         try:
             self._idle.add(runner)
             try:
+                overdue = False
                 while not self._tasks:
-                    if len(self._idle) > self.pool.maxspare:
+                    if len(self._idle) > self.maxspare:
                         task = None
                         break
                     self._not_empty.wait()
                 else:
-                    task = self._tasks.pop()
+                    task, queued = self._tasks.pop()
+                    if queued is not None:
+                        waited = _time.time() - queued
+                        if self._autoscale is not None:
+                            self._autoscale.waited(waited)
+                        if self._deadline is not None:
+                            overdue = waited > self._deadline
             finally:
                 self._idle.remove(runner)
             self._not_full.notify()
-            return task
+            return task, overdue
         finally:
             self._not_empty.release()
 
@@ -541,6 +1151,31 @@ class JobWorkerQueue(object):
         self._runners.add(runner)
         self._idle.add(runner)
 
+    def abandon(self, runner):
+        """
+        Give up a runner stuck in a request
+
+        The runner doesn't count as pool thread anymore, so a replacement
+        can be started. It finishes as soon as the request is done.
+
+        :Parameters:
+         - `runner`: The runner to give up
+
+        :Types:
+         - `runner`: `TaskRunner`
+        """
+        self._not_full.acquire()
+        try:
+            self._runners -= set([runner])
+            self._not_full.notify()
+        finally:
+            self._not_full.release()
+        self._drained.acquire()
+        try:
+            self._drained.notifyAll()
+        finally:
+            self._drained.release()
+
     def unregister(self, runner):
         """
         Remove a runner from the list
@@ -552,6 +1187,11 @@ class JobWorkerQueue(object):
          - `runner`: `TaskRunner`
         """
         self._runners -= set([runner])
+        self._drained.acquire()
+        try:
+            self._drained.notifyAll()
+        finally:
+            self._drained.release()
 
 
 class TaskRunner(object):
@@ -575,22 +1215,40 @@ class TaskRunner(object):
         get_task, flags, unregister = \
             queue.get_task, queue.flags, queue.unregister
         handle, app = queue.pool.impl.handle, queue.pool.app
+        shed, served = queue.shed, queue.served
+        app, watchdog = queue.counted(app), queue.watchdog
+        if watchdog is not None:
+            app = watchdog.watch(app)
 
         def work():
             """ Wait for tasks and run them """
             try:
-                while True:
-                    task = get_task(self)
+                abandoned = False
+                while not abandoned:
+                    task, overdue = get_task(self)
                     if task is None: # finish command
                         break
+                    start = _time.time()
                     try:
-                        handle(task, app, flags)
+                        if overdue:
+                            shed(task)
+                            continue
+                        if watchdog is None:
+                            handle(task, app, flags)
+                        else:
+                            watchdog.enter(self, task)
+                            try:
+                                handle(task, app, flags)
+                            finally:
+                                abandoned = watchdog.leave()
                     except: # pylint: disable = W0702
                         _sys.stderr.write(
                             "Uncaught exception in worker thread:\n" +
                             _traceback.format_exc()
                         )
                         break
+                    if served is not None:
+                        served(_time.time() - start)
             finally:
                 unregister(self)
 
@@ -601,3 +1259,103 @@ class TaskRunner(object):
             unregister(self)
             raise
         _time.sleep(0.000001) # 1 usec, to let the thread run (Solaris hack)
+
+
+class Shedder(object):
+    """
+    Reject overdue tasks
+
+    The tasks are rejected in a separate thread, so neither the accept loop
+    nor the worker threads are blocked by it.
+
+    :IVariables:
+     - `_shed`: Rejector (``impl.shed``)
+     - `_flags`: Worker flags
+     - `_retry_after`: Retry-After value in seconds
+     - `_tasks`: Tasks to reject
+     - `_ready`: Condition to wait on for new tasks
+
+    :Types:
+     - `_shed`: ``callable``
+     - `_flags`: `Flags`
+     - `_retry_after`: ``int``
+     - `_tasks`: ``collections.deque``
+     - `_ready`: ``threading.Condition``
+    """
+
+    def __init__(self, impl, flags, retry_after):
+        """
+        Initialization
+
+        :Parameters:
+         - `impl`: WSGI implementation
+         - `flags`: Worker flags
+         - `retry_after`: Retry-After value in seconds
+
+        :Types:
+         - `impl`: `wtf.impl.ServerInterface`
+         - `flags`: `Flags`
+         - `retry_after`: ``int``
+        """
+        self._shed, self._flags = impl.shed, flags
+        self._retry_after = retry_after
+        self._tasks = _collections.deque()
+        self._ready = _threading.Condition(_threading.Lock())
+
+    def start(self):
+        """ Start the rejector thread """
+        _thread.start_new_thread(self._run, ())
+
+    def shutdown(self):
+        """ Finish the rejector thread (after the pending tasks) """
+        self.put_task(None)
+
+    def put_task(self, task):
+        """
+        Put a task to reject
+
+        :Parameters:
+         - `task`: The task to reject, if ``None``, the thread finishes
+
+        :Types:
+         - `task`: any
+        """
+        self._ready.acquire()
+        try:
+            self._tasks.appendleft(task)
+            self._ready.notify()
+        finally:
+            self._ready.release()
+
+    def shed(self, task):
+        """
+        Reject a task immediately (in the current thread)
+
+        :Parameters:
+         - `task`: The task to reject
+
+        :Types:
+         - `task`: any
+        """
+        self._shed(task, self._flags, self._retry_after)
+
+    def _run(self):
+        """ Rejector thread main loop """
+        tasks, ready = self._tasks, self._ready
+        while True:
+            ready.acquire()
+            try:
+                while not tasks:
+                    ready.wait()
+                task = tasks.pop()
+            finally:
+                ready.release()
+            if task is None:
+                break
+            try:
+                self.shed(task)
+            except: # pylint: disable = W0702
+                _sys.stderr.write(
+                    "Uncaught exception in overload rejector:\n" +
+                    _traceback.format_exc()
+                )
@@ -230,6 +230,47 @@ def close_descriptors(*keep):
             pass
 
 
+def cpu_count():
+    """
+    Determine the number of online CPUs
+
+    :return: The number of CPUs (at least 1, if it couldn't be determined)
+    :rtype: ``int``
+    """
+    try:
+        return max(1, int(_os.sysconf('SC_NPROCESSORS_ONLN')))
+    except (AttributeError, ValueError, OSError):
+        return 1
+
+
+def rss():
+    """
+    Determine the resident set size of the current process
+
+    On systems without ``/proc`` the peak resident set size is returned
+    instead.
+
+    :return: The size in bytes or ``None`` if it couldn't be determined
+    :rtype: ``int``
+    """
+    try:
+        fp = open('/proc/self/statm')
+        try:
+            pages = int(fp.read().split()[1])
+        finally:
+            fp.close()
+        return pages * _os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, IndexError, ValueError, AttributeError):
+        pass
+    try:
+        size = _resource.getrusage(_resource.RUSAGE_SELF).ru_maxrss
+    except (AttributeError, _resource.error):
+        return None
+    if _sys.platform != 'darwin':
+        size *= 1024 # kilobytes
+    return size
+
+
 try:
     _myflag = _socket.TCP_NODELAY
 except AttributeError:
@@ -291,6 +332,48 @@ else:
         return sock, peername
 
 
+try:
+    _myflag = _socket.TCP_CORK
+except AttributeError:
+    def cork(sock, flag=True):
+        """
+        Cork or uncork a TCP socket
+
+        :Note: This function is a NOOP on this platform (not implemented).
+
+        :Parameters:
+         - `sock`: Socket to process
+         - `flag`: Cork (hold back partial frames) or uncork (send them)?
+
+        :Types:
+         - `sock`: ``socket.socket``
+         - `flag`: ``bool``
+        """
+        # pylint: disable = W0613
+
+        pass
+else:
+    def cork(sock, flag=True, _flag=_myflag):
+        """
+        Cork or uncork a TCP socket
+
+        While the socket is corked, the kernel holds back partial frames.
+        Uncorking sends them.
+
+        :Parameters:
+         - `sock`: Socket to process
+         - `flag`: Cork (hold back partial frames) or uncork (send them)?
+
+        :Types:
+         - `sock`: ``socket.socket``
+         - `flag`: ``bool``
+        """
+        try:
+            sock.setsockopt(_socket.IPPROTO_TCP, _flag, int(bool(flag)))
+        except _socket.error:
+            pass # not TCP or not connected anymore. Nothing to do then.
+
+
 _connect_cache = {}
 _connect_cache_lock = _threading.Lock()
 def connect(spec, timeout=None, nagle_off=True, cache=0,
@@ -488,9 +571,148 @@ def initgroups(username, gid):
     raise NotImplementedError()
 
 
+def send_fds(sock, data, fds):
+    """
+    Send data along with file descriptors over a UNIX domain socket
+
+    :Parameters:
+     - `sock`: The socket (or its descriptor)
+     - `data`: The data to send, must not be empty
+     - `fds`: The descriptors (or objects providing a ``fileno`` method)
+
+    :Types:
+     - `sock`: ``socket.socket``
+     - `data`: ``str``
+     - `fds`: ``sequence``
+
+    :return: The number of bytes sent
+    :rtype: ``int``
+
+    :Exceptions:
+     - `OSError`: sendmsg() didn't succeed
+     - `NotImplementedError`: Descriptor passing is not implemented
+       (needs c-extension)
+    """
+    # pylint: disable = W0613
+
+    raise NotImplementedError()
+
+
+def recv_fds(sock, size, maxfds):
+    """
+    Receive data along with file descriptors from a UNIX domain socket
+
+    :Parameters:
+     - `sock`: The socket (or its descriptor)
+     - `size`: Maximum number of bytes to receive
+     - `maxfds`: Maximum number of descriptors to receive
+
+    :Types:
+     - `sock`: ``socket.socket``
+     - `size`: ``int``
+     - `maxfds`: ``int``
+
+    :return: The received data and the list of descriptors
+             (``(str, [int, ...])``)
+    :rtype: ``tuple``
+
+    :Exceptions:
+     - `OSError`: recvmsg() didn't succeed
+     - `NotImplementedError`: Descriptor passing is not implemented
+       (needs c-extension)
+    """
+    # pylint: disable = W0613
+
+    raise NotImplementedError()
+
+
+def sendfile(out_fd, in_fd, offset, count):
+    """
+    Copy data from a file to a socket within the kernel
+
+    :Parameters:
+     - `out_fd`: The socket (or its descriptor)
+     - `in_fd`: The file (or its descriptor)
+     - `offset`: The file position to start at
+     - `count`: Maximum number of bytes to send
+
+    :Types:
+     - `out_fd`: ``socket.socket``
+     - `in_fd`: ``file``
+     - `offset`: ``int``
+     - `count`: ``int``
+
+    :return: The number of bytes sent (0 at the end of the file)
+    :rtype: ``int``
+
+    :Exceptions:
+     - `OSError`: sendfile() didn't succeed
+     - `NotImplementedError`: sendfile is not implemented (needs
+       c-extension)
+    """
+    try:
+        impl = _os.sendfile
+    except AttributeError:
+        raise NotImplementedError()
+    if not isinstance(out_fd, (int, long)):
+        out_fd = out_fd.fileno()
+    if not isinstance(in_fd, (int, long)):
+        in_fd = in_fd.fileno()
+    return impl(out_fd, in_fd, offset, count)
+
+
+def inotify_init():
+    """
+    Create a new inotify instance
+
+    The descriptor is non-blocking and close-on-exec.
+
+    :return: The inotify descriptor
+    :rtype: ``int``
+
+    :Exceptions:
+     - `OSError`: inotify_init1() didn't succeed
+     - `NotImplementedError`: inotify is not implemented (needs c-extension)
+    """
+    raise NotImplementedError()
+
+
+def inotify_add_watch(fd, path, mask):
+    """
+    Add a watch to an inotify instance
+
+    :Parameters:
+     - `fd`: The inotify descriptor
+     - `path`: The path to watch
+     - `mask`: The events to watch for (``IN_*``)
+
+    :Types:
+     - `fd`: ``int``
+     - `path`: ``str``
+     - `mask`: ``int``
+
+    :return: The watch descriptor
+    :rtype: ``int``
+
+    :Exceptions:
+     - `OSError`: inotify_add_watch() didn't succeed
+     - `NotImplementedError`: inotify is not implemented (needs c-extension)
+    """
+    # pylint: disable = W0613
+
+    raise NotImplementedError()
+
+
 from wtf import c_override
 cimpl = c_override('_wtf_cutil')
 if cimpl is not None:
     # pylint: disable = E1103
     initgroups = cimpl.initgroups
+    if cimpl.HAVE_FD_PASSING:
+        send_fds, recv_fds = cimpl.send_fds, cimpl.recv_fds
+    if cimpl.HAVE_INOTIFY:
+        inotify_init = cimpl.inotify_init
+        inotify_add_watch = cimpl.inotify_add_watch
+    if cimpl.HAVE_SENDFILE:
+        sendfile = cimpl.sendfile
 del c_override, cimpl
@@ -746,6 +746,12 @@ GenericStreamType_getclosed(genericstreamobject *self, void *closure)
     Py_RETURN_FALSE;
 }
 
+static PyObject *
+GenericStreamType_getbuffered(genericstreamobject *self, void *closure)
+{
+    return PyInt_FromSsize_t(self->rbuf_size);
+}
+
 static PyObject *
 GenericStreamType_getsoftspace(genericstreamobject *self, void *closure)
 {
@@ -782,6 +788,11 @@ static PyGetSetDef GenericStreamType_getset[] = {
      NULL,
      NULL, NULL},
 
+    {"buffered",
+     (getter)GenericStreamType_getbuffered,
+     NULL,
+     NULL, NULL},
+
     {"softspace",
      (getter)GenericStreamType_getsoftspace,
      (setter)GenericStreamType_setsoftspace,
@@ -979,6 +990,50 @@ GenericStreamType_xreadlines(PyObject *self, PyObject *args)
     return Py_INCREF(self), self;
 }
 
+PyDoc_STRVAR(GenericStreamType_unread__doc__,
+"``s.unread(tounread)``\n\
+\n\
+Pushes `tounread` octets back\n\
+\n\
+They are returned by the next read operation.\n\
+\n\
+Parameters\n\
+----------\n\
+- ``tounread``: The buffer to push back\n\
+\n\
+Types\n\
+-----\n\
+- ``tounread``: ``str``");
+
+static PyObject *
+GenericStreamType_unread(genericstreamobject *self, PyObject *args)
+{
+    PyObject *data;
+    bufitem *item;
+    Py_ssize_t size;
+
+    if (!PyArg_ParseTuple(args, "S", &data))
+        return NULL;
+
+    if ((size = PyString_GET_SIZE(data)) > 0) {
+        if ((self->rbuf_size + size) < self->rbuf_size) {
+            PyErr_SetString(PyExc_OverflowError, "Buffer became too big");
+            return NULL;
+        }
+        if (!(item = bufitem_new()))
+            return NULL;
+        Py_INCREF(data);
+        item->load = data;
+        item->next = self->rbuf_last;
+        if (!self->rbuf)
+            self->rbuf = item;
+        self->rbuf_last = item;
+        self->rbuf_size += size;
+    }
+
+    Py_RETURN_NONE;
+}
+
 PyDoc_STRVAR(GenericStreamType_write__doc__,
 "``s.write(data)``\n\
 \n\
@@ -1142,6 +1197,10 @@ static struct PyMethodDef GenericStreamType_methods[] = {
      (PyCFunction)GenericStreamType_xreadlines,  METH_NOARGS,
      GenericStreamType_xreadlines__doc__},
 
+    {"unread",
+     (PyCFunction)GenericStreamType_unread,      METH_VARARGS,
+     GenericStreamType_unread__doc__},
+
     {"write",
      (PyCFunction)GenericStreamType_write,       METH_VARARGS,
      GenericStreamType_write__doc__},
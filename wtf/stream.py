@@ -166,6 +166,19 @@ class GenericStream(object):
             return True
         return locals()
 
+    @Property
+    def buffered():
+        """
+        The number of octets in the read buffer
+
+        :Type: ``int``
+        """
+        # pylint: disable = E0211, C0111, W0212, W0612
+
+        def fget(self):
+            return sum(map(len, self._rbuffer))
+        return locals()
+
     def fileno(self):
         """ Determine underlying fileno """
         if self.closed:
@@ -294,7 +307,7 @@ class GenericStream(object):
                 newbuffer = None
                 eolpos = linebuffer.find("\n", findstart)
                 if eolpos >= 0 and (size == 0 or eolpos < size):
-                    self._unread(linebuffer[eolpos + 1:])
+                    self.unread(linebuffer[eolpos + 1:])
                     linebuffer = linebuffer[:eolpos + 1]
                     break
                 elif size > 0:
@@ -302,7 +315,7 @@ class GenericStream(object):
                     if llen == size:
                         break
                     elif llen > size:
-                        self._unread(linebuffer[size:])
+                        self.unread(linebuffer[size:])
                         linebuffer = linebuffer[:size]
                         break
                     else:
@@ -374,10 +387,12 @@ class GenericStream(object):
         for line in lines:
             self.write(line)
 
-    def _unread(self, tounread):
+    def unread(self, tounread):
         """
         Pushes `tounread` octets back
 
+        They are returned by the next read operation.
+
         :Parameters:
          - `tounread`: The buffer to push back
 
@@ -19,6 +19,7 @@
 EXT_INIT_FUNC;
 
 #include <stdint.h>
+#include <string.h>
 
 #ifdef WTF_HAVE_INITGROUPS
 #ifndef _BSD_SOURCE
@@ -29,10 +30,96 @@ EXT_INIT_FUNC;
 #include <grp.h>
 #endif
 
+#ifdef WTF_HAVE_FD_PASSING
+#include <unistd.h>
+#include <string.h>
+#include <sys/types.h>
+#include <sys/socket.h>
+#include <sys/uio.h>
+
+/* SCM_MAX_FD on linux */
+#define WTF_MAX_FDS (253)
+#endif
+
+#ifdef WTF_HAVE_INOTIFY
+#include <sys/inotify.h>
+#endif
+
+#ifdef WTF_HAVE_SENDFILE
+#include <sys/types.h>
+#include <sys/sendfile.h>
+#endif
+
 #include "util_private.h"
 
 /* --------------------------BEGIN HELPER FUNCTIONS------------------------- */
 
+/*
+ * Append len bytes to the string buffer at *pos, growing it as needed
+ *
+ * Returns -1 on error (the buffer is gone then)
+ */
+static int
+buffer_append(PyObject **buffer, Py_ssize_t *pos, const char *data,
+              Py_ssize_t len)
+{
+    Py_ssize_t size = PyString_GET_SIZE(*buffer);
+
+    if (*pos + len > size) {
+        while (*pos + len > size)
+            size *= 2;
+        if (_PyString_Resize(buffer, size) == -1)
+            return -1;
+    }
+    memcpy(PyString_AS_STRING(*buffer) + *pos, data, (size_t)len);
+    *pos += len;
+
+    return 0;
+}
+
+/*
+ * Append the string representation of obj to the string buffer
+ *
+ * Returns -1 on error (the buffer is gone then)
+ */
+static int
+buffer_append_object(PyObject **buffer, Py_ssize_t *pos, PyObject *obj)
+{
+    int res;
+
+    if (PyString_CheckExact(obj))
+        return buffer_append(buffer, pos, PyString_AS_STRING(obj),
+                             PyString_GET_SIZE(obj));
+
+    if (!(obj = PyObject_Str(obj))) {
+        Py_CLEAR(*buffer);
+        return -1;
+    }
+    res = buffer_append(buffer, pos, PyString_AS_STRING(obj),
+                        PyString_GET_SIZE(obj));
+    Py_DECREF(obj);
+
+    return res;
+}
+
+/*
+ * Append a single header line to the string buffer
+ *
+ * Returns -1 on error (the buffer is gone then)
+ */
+static int
+buffer_append_header(PyObject **buffer, Py_ssize_t *pos, PyObject *name,
+                     PyObject *value)
+{
+    if (buffer_append_object(buffer, pos, name) == -1
+        || buffer_append(buffer, pos, ": ", 2) == -1
+        || buffer_append_object(buffer, pos, value) == -1
+        || buffer_append(buffer, pos, "\r\n", 2) == -1)
+        return -1;
+
+    return 0;
+}
+
 static PyObject *
 quote_internal(PyObject *string, PyObject *safe_obj, PyObject *encoding_obj,
                PyObject *errors_obj, int plus)
@@ -308,6 +395,420 @@ wtf_initgroups(PyObject *self, PyObject *args, PyObject *kwds)
 }
 
 
+PyDoc_STRVAR(wtf_send_fds__doc__,
+"send_fds(sock, data, fds)\n\
+\n\
+Send data along with file descriptors over a UNIX domain socket\n\
+(``SCM_RIGHTS``).\n\
+\n\
+:See: `HAVE_FD_PASSING`\n\
+\n\
+Parameters\n\
+----------\n\
+- ``sock``: The socket (or its descriptor)\n\
+- ``data``: The data to send, must not be empty\n\
+- ``fds``: The descriptors (or objects providing a ``fileno`` method)\n\
+\n\
+Types\n\
+-----\n\
+- ``sock``: ``socket.socket``\n\
+- ``data``: ``str``\n\
+- ``fds``: ``sequence``\n\
+\n\
+:return: The number of bytes sent\n\
+:rtype: ``int``\n\
+\n\
+:Exceptions:\n\
+ - `OSError`: sendmsg() didn't succeed\n\
+ - `NotImplementedError`: Descriptor passing is not available");
+
+static PyObject *
+wtf_send_fds(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"sock", "data", "fds", NULL};
+    PyObject *sock_object, *fds_object;
+    char *data;
+    Py_ssize_t size;
+#ifdef WTF_HAVE_FD_PASSING
+    struct msghdr msg;
+    struct iovec iov;
+    struct cmsghdr *cmsg;
+    PyObject *seq;
+    char *control;
+    int *fdp, sock;
+    Py_ssize_t j, nfds;
+    ssize_t result;
+#endif
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "Os#O", kwlist,
+            &sock_object, &data, &size, &fds_object))
+        return NULL;
+
+#ifdef WTF_HAVE_FD_PASSING
+    if ((sock = PyObject_AsFileDescriptor(sock_object)) == -1)
+        return NULL;
+    if (size < 1) {
+        PyErr_SetString(PyExc_ValueError, "data must not be empty");
+        return NULL;
+    }
+    if (!(seq = PySequence_Fast(fds_object, "fds must be a sequence")))
+        return NULL;
+    nfds = PySequence_Fast_GET_SIZE(seq);
+    if (nfds < 1 || nfds > WTF_MAX_FDS) {
+        PyErr_SetString(PyExc_ValueError, "Invalid number of descriptors");
+        goto error_seq;
+    }
+    if (!(control = PyMem_Malloc(CMSG_SPACE(nfds * sizeof(int))))) {
+        PyErr_NoMemory();
+        goto error_seq;
+    }
+    memset(control, 0, CMSG_SPACE(nfds * sizeof(int)));
+    memset(&msg, 0, sizeof(msg));
+    iov.iov_base = data;
+    iov.iov_len = (size_t)size;
+    msg.msg_iov = &iov;
+    msg.msg_iovlen = 1;
+    msg.msg_control = control;
+    msg.msg_controllen = CMSG_SPACE(nfds * sizeof(int));
+
+    cmsg = CMSG_FIRSTHDR(&msg);
+    cmsg->cmsg_level = SOL_SOCKET;
+    cmsg->cmsg_type = SCM_RIGHTS;
+    cmsg->cmsg_len = CMSG_LEN(nfds * sizeof(int));
+    fdp = (int *)CMSG_DATA(cmsg);
+    for (j = 0; j < nfds; ++j) {
+        fdp[j] = PyObject_AsFileDescriptor(PySequence_Fast_GET_ITEM(seq, j));
+        if (fdp[j] == -1)
+            goto error_control;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    result = sendmsg(sock, &msg, 0);
+    Py_END_ALLOW_THREADS
+    if (result == -1) {
+        PyErr_SetFromErrno(PyExc_OSError);
+        goto error_control;
+    }
+
+    PyMem_Free(control);
+    Py_DECREF(seq);
+    return PyInt_FromSsize_t((Py_ssize_t)result);
+
+error_control:
+    PyMem_Free(control);
+error_seq:
+    Py_DECREF(seq);
+    return NULL;
+#else
+    PyErr_SetString(PyExc_NotImplementedError,
+                    "Descriptor passing is not available");
+    return NULL;
+#endif
+}
+
+
+PyDoc_STRVAR(wtf_inotify_init__doc__,
+"inotify_init()\n\
+\n\
+Create a new inotify instance. The descriptor is non-blocking and\n\
+close-on-exec.\n\
+\n\
+:See: `HAVE_INOTIFY`\n\
+\n\
+:return: The inotify descriptor\n\
+:rtype: ``int``\n\
+\n\
+:Exceptions:\n\
+ - `OSError`: inotify_init1() didn't succeed\n\
+ - `NotImplementedError`: inotify is not available");
+
+static PyObject *
+wtf_inotify_init(PyObject *self, PyObject *args)
+{
+#ifdef WTF_HAVE_INOTIFY
+    int fd;
+
+    if ((fd = inotify_init1(IN_NONBLOCK | IN_CLOEXEC)) == -1)
+        return PyErr_SetFromErrno(PyExc_OSError);
+
+    return PyInt_FromLong((long)fd);
+#else
+    PyErr_SetString(PyExc_NotImplementedError, "inotify is not available");
+    return NULL;
+#endif
+}
+
+
+PyDoc_STRVAR(wtf_inotify_add_watch__doc__,
+"inotify_add_watch(fd, path, mask)\n\
+\n\
+Add a watch to an inotify instance\n\
+\n\
+:See: `HAVE_INOTIFY`\n\
+\n\
+Parameters\n\
+----------\n\
+- ``fd``: The inotify descriptor\n\
+- ``path``: The path to watch\n\
+- ``mask``: The events to watch for\n\
+\n\
+Types\n\
+-----\n\
+- ``fd``: ``int``\n\
+- ``path``: ``str``\n\
+- ``mask``: ``int``\n\
+\n\
+:return: The watch descriptor\n\
+:rtype: ``int``\n\
+\n\
+:Exceptions:\n\
+ - `OSError`: inotify_add_watch() didn't succeed\n\
+ - `NotImplementedError`: inotify is not available");
+
+static PyObject *
+wtf_inotify_add_watch(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"fd", "path", "mask", NULL};
+    PyObject *fd_object;
+    char *path;
+    unsigned long mask;
+#ifdef WTF_HAVE_INOTIFY
+    int fd, wd;
+#endif
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "Osk", kwlist,
+            &fd_object, &path, &mask))
+        return NULL;
+
+#ifdef WTF_HAVE_INOTIFY
+    if ((fd = PyObject_AsFileDescriptor(fd_object)) == -1)
+        return NULL;
+
+    Py_BEGIN_ALLOW_THREADS
+    wd = inotify_add_watch(fd, path, (uint32_t)mask);
+    Py_END_ALLOW_THREADS
+    if (wd == -1)
+        return PyErr_SetFromErrnoWithFilename(PyExc_OSError, path);
+
+    return PyInt_FromLong((long)wd);
+#else
+    PyErr_SetString(PyExc_NotImplementedError, "inotify is not available");
+    return NULL;
+#endif
+}
+
+
+PyDoc_STRVAR(wtf_recv_fds__doc__,
+"recv_fds(sock, size, maxfds)\n\
+\n\
+Receive data along with file descriptors from a UNIX domain socket\n\
+(``SCM_RIGHTS``). The received descriptors are close-on-exec, if\n\
+the system supports it.\n\
+\n\
+:See: `HAVE_FD_PASSING`\n\
+\n\
+Parameters\n\
+----------\n\
+- ``sock``: The socket (or its descriptor)\n\
+- ``size``: Maximum number of bytes to receive\n\
+- ``maxfds``: Maximum number of descriptors to receive\n\
+\n\
+Types\n\
+-----\n\
+- ``sock``: ``socket.socket``\n\
+- ``size``: ``int``\n\
+- ``maxfds``: ``int``\n\
+\n\
+:return: The received data and the list of descriptors\n\
+         (``(str, [int, ...])``)\n\
+:rtype: ``tuple``\n\
+\n\
+:Exceptions:\n\
+ - `OSError`: recvmsg() didn't succeed\n\
+ - `NotImplementedError`: Descriptor passing is not available");
+
+static PyObject *
+wtf_recv_fds(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"sock", "size", "maxfds", NULL};
+    PyObject *sock_object;
+    Py_ssize_t size, maxfds;
+#ifdef WTF_HAVE_FD_PASSING
+    struct msghdr msg;
+    struct iovec iov;
+    struct cmsghdr *cmsg;
+    PyObject *data, *fds, *item;
+    char *control;
+    int *fdp, sock, flags;
+    Py_ssize_t j, nfds;
+    ssize_t result;
+#endif
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "Onn", kwlist,
+            &sock_object, &size, &maxfds))
+        return NULL;
+
+#ifdef WTF_HAVE_FD_PASSING
+    if ((sock = PyObject_AsFileDescriptor(sock_object)) == -1)
+        return NULL;
+    if (size < 1 || maxfds < 1 || maxfds > WTF_MAX_FDS) {
+        PyErr_SetString(PyExc_ValueError, "Invalid size or maxfds");
+        return NULL;
+    }
+    if (!(data = PyString_FromStringAndSize(NULL, size)))
+        return NULL;
+    if (!(control = PyMem_Malloc(CMSG_SPACE(maxfds * sizeof(int))))) {
+        PyErr_NoMemory();
+        goto error_data;
+    }
+    memset(control, 0, CMSG_SPACE(maxfds * sizeof(int)));
+    memset(&msg, 0, sizeof(msg));
+    iov.iov_base = PyString_AS_STRING(data);
+    iov.iov_len = (size_t)size;
+    msg.msg_iov = &iov;
+    msg.msg_iovlen = 1;
+    msg.msg_control = control;
+    msg.msg_controllen = CMSG_SPACE(maxfds * sizeof(int));
+#ifdef MSG_CMSG_CLOEXEC
+    flags = MSG_CMSG_CLOEXEC;
+#else
+    flags = 0;
+#endif
+
+    Py_BEGIN_ALLOW_THREADS
+    result = recvmsg(sock, &msg, flags);
+    Py_END_ALLOW_THREADS
+    if (result == -1) {
+        PyErr_SetFromErrno(PyExc_OSError);
+        goto error_control;
+    }
+
+    if (!(fds = PyList_New(0)))
+        goto error_fds;
+    for (cmsg = CMSG_FIRSTHDR(&msg); cmsg; cmsg = CMSG_NXTHDR(&msg, cmsg)) {
+        if (cmsg->cmsg_level != SOL_SOCKET || cmsg->cmsg_type != SCM_RIGHTS)
+            continue;
+        fdp = (int *)CMSG_DATA(cmsg);
+        nfds = (cmsg->cmsg_len - CMSG_LEN(0)) / sizeof(int);
+        for (j = 0; j < nfds; ++j) {
+            if (fds) {
+                if (!(item = PyInt_FromLong((long)fdp[j])))
+                    Py_CLEAR(fds);
+                else if (PyList_Append(fds, item) == -1) {
+                    Py_DECREF(item);
+                    Py_CLEAR(fds);
+                }
+                else {
+                    Py_DECREF(item);
+                    continue;
+                }
+            }
+            close(fdp[j]); /* don't leak on errors */
+        }
+    }
+    if (!fds)
+        goto error_control;
+
+    PyMem_Free(control);
+    if (result < size && _PyString_Resize(&data, (Py_ssize_t)result) == -1) {
+        for (j = 0; j < PyList_GET_SIZE(fds); ++j)
+            close((int)PyInt_AS_LONG(PyList_GET_ITEM(fds, j)));
+        Py_DECREF(fds);
+        return NULL;
+    }
+    return Py_BuildValue("(NN)", data, fds);
+
+error_fds:
+    for (cmsg = CMSG_FIRSTHDR(&msg); cmsg; cmsg = CMSG_NXTHDR(&msg, cmsg)) {
+        if (cmsg->cmsg_level != SOL_SOCKET || cmsg->cmsg_type != SCM_RIGHTS)
+            continue;
+        fdp = (int *)CMSG_DATA(cmsg);
+        nfds = (cmsg->cmsg_len - CMSG_LEN(0)) / sizeof(int);
+        for (j = 0; j < nfds; ++j)
+            close(fdp[j]);
+    }
+error_control:
+    PyMem_Free(control);
+error_data:
+    Py_DECREF(data);
+    return NULL;
+#else
+    PyErr_SetString(PyExc_NotImplementedError,
+                    "Descriptor passing is not available");
+    return NULL;
+#endif
+}
+
+
+PyDoc_STRVAR(wtf_sendfile__doc__,
+"sendfile(out_fd, in_fd, offset, count)\n\
+\n\
+Copy data from a file to a socket within the kernel (``sendfile(2)``)\n\
+\n\
+:See: `HAVE_SENDFILE`\n\
+\n\
+:Parameters:\n\
+- ``out_fd``: The socket (or its descriptor)\n\
+- ``in_fd``: The file (or its descriptor)\n\
+- ``offset``: The file position to start at\n\
+- ``count``: Maximum number of bytes to send\n\
+\n\
+:Types:\n\
+- ``out_fd``: ``socket.socket``\n\
+- ``in_fd``: ``file``\n\
+- ``offset``: ``int``\n\
+- ``count``: ``int``\n\
+\n\
+:return: The number of bytes sent (0 at the end of the file)\n\
+:rtype: ``int``\n\
+\n\
+:Exceptions:\n\
+ - `OSError`: sendfile() didn't succeed\n\
+ - `NotImplementedError`: sendfile is not available");
+
+static PyObject *
+wtf_sendfile(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"out_fd", "in_fd", "offset", "count", NULL};
+    PyObject *out_object, *in_object;
+    PY_LONG_LONG offset_long;
+    Py_ssize_t count;
+#ifdef WTF_HAVE_SENDFILE
+    int out_fd, in_fd;
+    off_t offset;
+    ssize_t result;
+#endif
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "OOLn", kwlist,
+            &out_object, &in_object, &offset_long, &count))
+        return NULL;
+
+#ifdef WTF_HAVE_SENDFILE
+    if ((out_fd = PyObject_AsFileDescriptor(out_object)) == -1)
+        return NULL;
+    if ((in_fd = PyObject_AsFileDescriptor(in_object)) == -1)
+        return NULL;
+    if (offset_long < 0 || count < 0) {
+        PyErr_SetString(PyExc_ValueError,
+                        "offset and count must not be negative");
+        return NULL;
+    }
+    offset = (off_t)offset_long;
+
+    Py_BEGIN_ALLOW_THREADS
+    result = sendfile(out_fd, in_fd, &offset, (size_t)count);
+    Py_END_ALLOW_THREADS
+    if (result == -1)
+        return PyErr_SetFromErrno(PyExc_OSError);
+
+    return PyInt_FromSsize_t((Py_ssize_t)result);
+#else
+    PyErr_SetString(PyExc_NotImplementedError, "sendfile is not available");
+    return NULL;
+#endif
+}
+
+
 PyDoc_STRVAR(wtf_quote__doc__,
 "quote(s, safe='/', encoding='utf-8', errors='strict')\n\
 \n\
@@ -513,11 +1014,306 @@ wtf_hash32(PyObject *self, PyObject *args, PyObject *kwds)
 }
 
 
+PyDoc_STRVAR(wtf_header_block__doc__,
+"header_block(status_line, names, hdict, canonical)\n\
+\n\
+Serialize the response head into a single string\n\
+\n\
+:Parameters:\n\
+ - `status_line`: The complete status line (without CRLF)\n\
+ - `names`: Ordered list of lowercased header names. Names, which are\n\
+   not in `hdict`, are skipped.\n\
+ - `hdict`: Header values (``{'name': ['value', ...], ...}``). Multiple\n\
+   values are comma folded, except for ``set-cookie``, which is emitted\n\
+   once per value.\n\
+ - `canonical`: Mapping of lowercased names to the emitted names. Names\n\
+   not found are title cased.\n\
+\n\
+:Types:\n\
+ - `status_line`: ``str``\n\
+ - `names`: ``iterable``\n\
+ - `hdict`: ``dict``\n\
+ - `canonical`: ``dict``\n\
+\n\
+:return: The response head including the final empty line\n\
+:rtype: ``str``");
+
+static PyObject *
+wtf_header_block(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"status_line", "names", "hdict", "canonical",
+                             NULL};
+    PyObject *status_line, *names, *hdict, *canonical, *iter, *name, *cname,
+             *values, *buffer;
+    Py_ssize_t pos = 0, j, vlen;
+    int is_cookie;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "OOO!O!", kwlist,
+            &status_line, &names, &PyDict_Type, &hdict,
+            &PyDict_Type, &canonical))
+        return NULL;
+
+    if (!(iter = PyObject_GetIter(names)))
+        return NULL;
+
+    if (!(buffer = PyString_FromStringAndSize(NULL, 1024)))
+        goto error_iter;
+
+    if (buffer_append_object(&buffer, &pos, status_line) == -1
+        || buffer_append(&buffer, &pos, "\r\n", 2) == -1)
+        goto error_iter;
+
+    while ((name = PyIter_Next(iter))) {
+        if (!(values = PyDict_GetItem(hdict, name))) {
+            Py_DECREF(name);
+            continue;
+        }
+        if (!(values = PySequence_Fast(values, "header values must be a "
+                                               "sequence")))
+            goto error_name;
+
+        if ((cname = PyDict_GetItem(canonical, name)))
+            Py_INCREF(cname);
+        else if (!(cname = PyObject_CallMethod(name, "title", NULL)))
+            goto error_values;
+
+        is_cookie = PyString_CheckExact(name)
+            && PyString_GET_SIZE(name) == 10
+            && !memcmp(PyString_AS_STRING(name), "set-cookie", 10);
+
+        vlen = PySequence_Fast_GET_SIZE(values);
+        if (is_cookie) {
+            for (j = 0; j < vlen; ++j) {
+                if (buffer_append_header(&buffer, &pos, cname,
+                        PySequence_Fast_GET_ITEM(values, j)) == -1)
+                    goto error_cname;
+            }
+        }
+        else {
+            if (buffer_append_object(&buffer, &pos, cname) == -1
+                || buffer_append(&buffer, &pos, ": ", 2) == -1)
+                goto error_cname;
+            for (j = 0; j < vlen; ++j) {
+                if (j && buffer_append(&buffer, &pos, ", ", 2) == -1)
+                    goto error_cname;
+                if (buffer_append_object(&buffer, &pos,
+                        PySequence_Fast_GET_ITEM(values, j)) == -1)
+                    goto error_cname;
+            }
+            if (buffer_append(&buffer, &pos, "\r\n", 2) == -1)
+                goto error_cname;
+        }
+
+        Py_DECREF(cname);
+        Py_DECREF(values);
+        Py_DECREF(name);
+    }
+    if (PyErr_Occurred())
+        goto error_iter;
+    Py_DECREF(iter);
+
+    if (buffer_append(&buffer, &pos, "\r\n", 2) == -1
+        || _PyString_Resize(&buffer, pos) == -1)
+        return NULL;
+
+    return buffer;
+
+error_cname:
+    Py_DECREF(cname);
+error_values:
+    Py_DECREF(values);
+error_name:
+    Py_DECREF(name);
+error_iter:
+    Py_XDECREF(buffer);
+    Py_DECREF(iter);
+    return NULL;
+}
+
+
+PyDoc_STRVAR(wtf_uwsgi_vars__doc__,
+"uwsgi_vars(data)\n\
+\n\
+Decode the variables block of an uwsgi request packet\n\
+\n\
+The block consists of key/value pairs, each of them prefixed by its\n\
+length (16 bit little endian).\n\
+\n\
+:Parameters:\n\
+ - `data`: The variables block\n\
+\n\
+:Types:\n\
+ - `data`: ``str``\n\
+\n\
+:return: The variables (``{'key': 'value', ...}``)\n\
+:rtype: ``dict``\n\
+\n\
+:Exceptions:\n\
+ - `ValueError`: The block is truncated");
+
+static PyObject *
+wtf_uwsgi_vars(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"data", NULL};
+    PyObject *env, *key, *value;
+    const unsigned char *data, *end, *kstart;
+    Py_ssize_t size, klen, vlen;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "s#", kwlist, &data, &size))
+        return NULL;
+
+    if (!(env = PyDict_New()))
+        return NULL;
+
+    for (end = data + size; data < end; data += vlen) {
+        if (end - data < 2)
+            goto error_truncated;
+        klen = data[0] | (data[1] << 8);
+        data += 2;
+        if (end - data < klen + 2)
+            goto error_truncated;
+        kstart = data;
+        data += klen;
+        vlen = data[0] | (data[1] << 8);
+        data += 2;
+        if (end - data < vlen)
+            goto error_truncated;
+
+        if (!(key = PyString_FromStringAndSize((const char *)kstart, klen)))
+            goto error;
+        if (!(value = PyString_FromStringAndSize((const char *)data, vlen))) {
+            Py_DECREF(key);
+            goto error;
+        }
+        if (PyDict_SetItem(env, key, value) == -1) {
+            Py_DECREF(value);
+            Py_DECREF(key);
+            goto error;
+        }
+        Py_DECREF(value);
+        Py_DECREF(key);
+    }
+
+    return env;
+
+error_truncated:
+    PyErr_SetString(PyExc_ValueError, "Truncated uwsgi variables block");
+error:
+    Py_DECREF(env);
+    return NULL;
+}
+
+
+PyDoc_STRVAR(wtf_scgi_environ__doc__,
+"scgi_environ(data)\n\
+\n\
+Decode the header block of an SCGI request\n\
+\n\
+The block (the netstring payload) consists of NUL terminated names and\n\
+values. ``CONTENT_LENGTH`` is required and must be a decimal number.\n\
+\n\
+:Parameters:\n\
+ - `data`: The header block\n\
+\n\
+:Types:\n\
+ - `data`: ``str``\n\
+\n\
+:return: The environment and the content length\n\
+         (``({'name': 'value', ...}, int)``)\n\
+:rtype: ``tuple``\n\
+\n\
+:Exceptions:\n\
+ - `ValueError`: The block is invalid or the content length is missing or\n\
+   invalid");
+
+static PyObject *
+wtf_scgi_environ(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"data", NULL};
+    PyObject *env, *key, *value, *clen;
+    const char *data, *end, *kend, *vstart, *vend, *cur;
+    Py_ssize_t size;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "s#", kwlist, &data, &size))
+        return NULL;
+
+    if (!(env = PyDict_New()))
+        return NULL;
+
+    for (end = data + size; data < end; data = vend + 1) {
+        if (!(kend = memchr(data, '\0', (size_t)(end - data))))
+            goto error_block;
+        vstart = kend + 1;
+        if (!(vend = memchr(vstart, '\0', (size_t)(end - vstart))))
+            goto error_block;
+
+        if (!(key = PyString_FromStringAndSize(data, kend - data)))
+            goto error;
+        if (!(value = PyString_FromStringAndSize(vstart, vend - vstart))) {
+            Py_DECREF(key);
+            goto error;
+        }
+        if (PyDict_SetItem(env, key, value) == -1) {
+            Py_DECREF(value);
+            Py_DECREF(key);
+            goto error;
+        }
+        Py_DECREF(value);
+        Py_DECREF(key);
+    }
+
+    /* Only the final value counts (the last occurrence wins) */
+    if (!(value = PyDict_GetItemString(env, "CONTENT_LENGTH")))
+        goto error_clen;
+    vstart = PyString_AS_STRING(value);
+    vend = vstart + PyString_GET_SIZE(value);
+    if (vend == vstart)
+        goto error_clen;
+    for (cur = vstart; cur < vend; ++cur) {
+        if (*cur < '0' || *cur > '9')
+            goto error_clen;
+    }
+    if (!(clen = PyInt_FromString((char *)vstart, NULL, 10)))
+        goto error;
+
+    return Py_BuildValue("(NN)", env, clen);
+
+error_block:
+    PyErr_SetString(PyExc_ValueError, "Invalid SCGI header block");
+    goto error;
+error_clen:
+    PyErr_SetString(PyExc_ValueError, "Missing or invalid CONTENT_LENGTH");
+error:
+    Py_DECREF(env);
+    return NULL;
+}
+
+
 EXT_METHODS = {
     {"initgroups",
         (PyCFunction)wtf_initgroups, METH_KEYWORDS,
         wtf_initgroups__doc__},
 
+    {"send_fds",
+        (PyCFunction)wtf_send_fds, METH_KEYWORDS,
+        wtf_send_fds__doc__},
+
+    {"recv_fds",
+        (PyCFunction)wtf_recv_fds, METH_KEYWORDS,
+        wtf_recv_fds__doc__},
+
+    {"sendfile",
+        (PyCFunction)wtf_sendfile, METH_KEYWORDS,
+        wtf_sendfile__doc__},
+
+    {"inotify_init",
+        (PyCFunction)wtf_inotify_init, METH_NOARGS,
+        wtf_inotify_init__doc__},
+
+    {"inotify_add_watch",
+        (PyCFunction)wtf_inotify_add_watch, METH_KEYWORDS,
+        wtf_inotify_add_watch__doc__},
+
     {"quote",
         (PyCFunction)wtf_quote, METH_KEYWORDS,
         wtf_quote__doc__},
@@ -538,6 +1334,18 @@ EXT_METHODS = {
         (PyCFunction)wtf_hash32, METH_KEYWORDS,
         wtf_hash32__doc__},
 
+    {"header_block",
+        (PyCFunction)wtf_header_block, METH_KEYWORDS,
+        wtf_header_block__doc__},
+
+    {"uwsgi_vars",
+        (PyCFunction)wtf_uwsgi_vars, METH_KEYWORDS,
+        wtf_uwsgi_vars__doc__},
+
+    {"scgi_environ",
+        (PyCFunction)wtf_scgi_environ, METH_KEYWORDS,
+        wtf_scgi_environ__doc__},
+
     {NULL}  /* Sentinel */
 };
 
@@ -549,9 +1357,16 @@ This module provides some misc util implementations for WTF.\n\
 \n\
 :Variables:\n\
  - `HAVE_INITGROUPS`: Is ``initgroups(3)`` on this system implemented?\n\
+ - `HAVE_FD_PASSING`: Is descriptor passing (``SCM_RIGHTS``) on this\n\
+   system implemented?\n\
+ - `HAVE_INOTIFY`: Is inotify on this system implemented?\n\
+ - `HAVE_SENDFILE`: Is ``sendfile(2)`` on this system implemented?\n\
 \n\
 :Types:\n\
- - `HAVE_INITGROUPS`: ``bool``");
+ - `HAVE_INITGROUPS`: ``bool``\n\
+ - `HAVE_FD_PASSING`: ``bool``\n\
+ - `HAVE_INOTIFY`: ``bool``\n\
+ - `HAVE_SENDFILE`: ``bool``");
 
 
 #define ADD_STRING(MODULE, NAME, STRING) do {                 \
@@ -561,7 +1376,7 @@ This module provides some misc util implementations for WTF.\n\
 
 #define ADD_OBJECT(MODULE, NAME, VALUE) do {          \
     Py_INCREF(VALUE);                                 \
-    if (!(PyModule_AddObject(MODULE, NAME, VALUE))) { \
+    if (PyModule_AddObject(MODULE, NAME, VALUE) < 0) { \
         Py_DECREF(VALUE);                             \
         return;                                       \
     }                                                 \
@@ -582,6 +1397,21 @@ EXT_INIT_FUNC {
 #else
     ADD_OBJECT(m, "HAVE_INITGROUPS", Py_False);
 #endif
+#ifdef WTF_HAVE_FD_PASSING
+    ADD_OBJECT(m, "HAVE_FD_PASSING", Py_True);
+#else
+    ADD_OBJECT(m, "HAVE_FD_PASSING", Py_False);
+#endif
+#ifdef WTF_HAVE_INOTIFY
+    ADD_OBJECT(m, "HAVE_INOTIFY", Py_True);
+#else
+    ADD_OBJECT(m, "HAVE_INOTIFY", Py_False);
+#endif
+#ifdef WTF_HAVE_SENDFILE
+    ADD_OBJECT(m, "HAVE_SENDFILE", Py_True);
+#else
+    ADD_OBJECT(m, "HAVE_SENDFILE", Py_False);
+#endif
 }
 
 /* ------------------------- END MODULE DEFINITION ------------------------- */